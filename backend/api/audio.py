@@ -9,6 +9,8 @@ from middleware.auth_middleware import get_current_user
 from models.postgresql.note import Note
 from models.postgresql.user import User as PGUser
 from services.ai_service import ai_service
+from services.document_store import document_text_store
+from services.ai_usage import ai_usage, usage_scope
 from datetime import datetime
 import os
 from services.elevenlabs_service import elevenlabs_service
@@ -68,8 +70,9 @@ async def generate_audio_overview(
                 detail="Note must have an uploaded file to generate audio overview"
             )
 
-        # Get document content for audio generation
-        document_content = note.content or ""
+        # Get document content for audio generation: the uploaded file's extracted
+        # text when it has been stored, otherwise the note's own content
+        document_content = document_text_store.get_text(db, note.id) or note.content or ""
         if not document_content:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -77,7 +80,9 @@ async def generate_audio_overview(
             )
 
         # Generate audio script using AI service
-        script = await ai_service.generate_audio_overview_script(document_content)
+        ai_usage.check_quota(user_id=current_user.id)
+        with usage_scope(user_id=current_user.id, document_id=request.note_id):
+            script = await ai_service.generate_audio_overview_script(document_content)
 
         if not script or not script.get("host_script") or not script.get("expert_script"):
             raise HTTPException(
@@ -165,8 +170,9 @@ async def synthesize_audio(
                 raise Exception("Voice IDs for host and expert must be set in environment.")
             
             # Synthesize host and expert lines
-            host_audio = elevenlabs_service.synthesize(audio["host_script"], host_voice_id)
-            expert_audio = elevenlabs_service.synthesize(audio["expert_script"], expert_voice_id)
+            with usage_scope(user_id=current_user.id, document_id=audio.get("note_id")):
+                host_audio = elevenlabs_service.synthesize(audio["host_script"], host_voice_id)
+                expert_audio = elevenlabs_service.synthesize(audio["expert_script"], expert_voice_id)
             
             # Save to temp files
             with tempfile.NamedTemporaryFile(delete=False, suffix="_host.mp3") as host_file:
@@ -7,6 +7,7 @@ from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from core.database import get_db, get_mongo_db
 from services.ai_service import ai_service
+from services.ai_usage import ai_usage, usage_scope
 from services.encryption_service import encryption_service
 from models.postgresql.room import RoomParticipant
 from models.postgresql.topic import Topic
@@ -107,12 +108,14 @@ async def ai_chat(request: AIRequest):
         ]
         
         # Generate AI response
-        ai_response = await ai_service.generate_group_chat_response(
-            message=request.message,
-            chat_history=formatted_history,
-            room_id=request.room_id,
-            user_id=request.user_id
-        )
+        ai_usage.check_quota(user_id=request.user_id, room_id=request.room_id)
+        with usage_scope(user_id=request.user_id, room_id=request.room_id):
+            ai_response = await ai_service.generate_group_chat_response(
+                message=request.message,
+                chat_history=formatted_history,
+                room_id=request.room_id,
+                user_id=request.user_id
+            )
         
         # Create AI message
         ai_message = ChatMessage(
@@ -145,6 +148,8 @@ async def ai_chat(request: AIRequest):
         
         return ai_message
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating AI response: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate AI response")
@@ -1,21 +1,29 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Request, status
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, BackgroundTasks, HTTPException, UploadFile, File, Depends, Request, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
+import asyncio
+import json
 import os
-import uuid
 from datetime import datetime
 from pydantic import BaseModel
 import logging
 from sqlalchemy.orm import Session
-from core.database import get_db, get_mongo_db
+from core.database import get_db, get_mongo_db, SessionLocal
 from core.config import settings
 from services.rag_service import rag_service
 from services.ai_service import ai_service
 from services.storage_service import storage_service
+from services.document_store import document_text_store, content_hash
+from services.uploads import UploadTooLarge, spool_upload
+from services.ingestion import ingestion_pipeline, release_document
+from services.extractors import supported_extensions
+from services.ai_usage import ai_usage, usage_scope
 from middleware.auth_middleware import get_current_user
 from models.postgresql.note import Note
 from models.postgresql.user import User as PGUser
 from models.postgresql.chat_log import ChatLog
+from models.postgresql.ingestion_job import IngestionJob
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/notes", tags=["Notes"])
@@ -58,7 +66,7 @@ class QuizResponse(BaseModel):
 class AudioResponse(BaseModel):
     host_script: str
     expert_script: str
-    audio_url: Optional[str]
+    audio_url: Optional[str] = None
 
 # API Endpoints
 @router.post("/{note_id}/ask")
@@ -76,7 +84,11 @@ async def ask_note_question(
         note = db.query(Note).filter(Note.id == note_id, Note.user_id == user.id).first()
         if not note:
             raise HTTPException(status_code=404, detail="Note not found or access denied.")
-        answer = rag_service.query(db, note_id, question, user.id)
+        ai_usage.check_quota(user_id=user.id)
+        with usage_scope(user_id=user.id, document_id=note_id):
+            answer = await rag_service.query(
+                db, note_id, question, user.id, document_hash=document_text_store.embedded_hash(db, note_id)
+            )
         return {"note_id": note_id, "question": question, "answer": answer}
     except HTTPException:
         raise
@@ -86,9 +98,64 @@ async def ask_note_question(
         logger.error(f"Error answering note question: {e}")
         raise HTTPException(status_code=500, detail="Failed to answer question.")
 
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/{note_id}/ask/stream")
+async def ask_note_question_stream(
+    note_id: str,
+    body: AskQuestion,
+    user: PGUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Ask a question about an uploaded note, streaming the answer as Server-Sent Events.
+
+    Emits a `context` event with the retrieved chunk ids/scores, one `token`
+    event per answer delta, then `done` with the full answer (or `error`).
+    """
+    question = body.question.strip()
+    if not question:
+        raise HTTPException(status_code=400, detail="Question is required.")
+    note = db.query(Note).filter(Note.id == note_id, Note.user_id == user.id).first()
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found or access denied.")
+    try:
+        rag_service._check_configured()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    ai_usage.check_quota(user_id=user.id)
+    user_id = user.id
+    document_hash = document_text_store.embedded_hash(db, note_id)
+
+    async def event_stream():
+        try:
+            with usage_scope(user_id=user_id, document_id=note_id):
+                async for event, data in rag_service.stream_query(note_id, question, user_id, document_hash=document_hash):
+                    yield _sse_event(event, data)
+        except Exception as e:
+            logger.error(f"Error streaming note answer: {e}")
+            yield _sse_event("error", {"detail": "Failed to answer question."})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _sync_note_content(note_id: str, user_id: str):
+    """Re-embed what changed in a note's text, after the response is sent"""
+    try:
+        with usage_scope(user_id=user_id, document_id=note_id):
+            await rag_service.sync_note_content(note_id, user_id)
+    except RuntimeError as e:
+        logger.debug(f"Not indexing note {note_id}: {e}")
+    except Exception as e:
+        logger.warning(f"Could not update vectors for note {note_id}: {e}")
+
 @router.post("/create", response_model=NoteResponse)
 async def create_note(
     note_data: NoteCreate,
+    background_tasks: BackgroundTasks,
     current_user: PGUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -103,6 +170,8 @@ async def create_note(
         db.add(new_note)
         db.commit()
         db.refresh(new_note)
+        if new_note.content:
+            background_tasks.add_task(_sync_note_content, new_note.id, current_user.id)
         
         # Convert to response format
         note_dict = new_note.to_dict()
@@ -185,6 +254,7 @@ async def get_note(
 async def update_note(
     note_id: str,
     note_data: NoteUpdate,
+    background_tasks: BackgroundTasks,
     current_user: PGUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -205,12 +275,16 @@ async def update_note(
         # Update fields
         if note_data.title is not None:
             note.title = note_data.title
+        content_changed = note_data.content is not None and note_data.content != note.content
         if note_data.content is not None:
             note.content = note_data.content
         
         note.updated_at = datetime.utcnow()
         db.commit()
         db.refresh(note)
+        if content_changed:
+            # Only chunks whose text changed are embedded again
+            background_tasks.add_task(_sync_note_content, note_id, current_user.id)
         
         # Convert to response format
         note_dict = note.to_dict()
@@ -231,6 +305,7 @@ async def update_note(
 @router.delete("/{note_id}")
 async def delete_note(
     note_id: str,
+    background_tasks: BackgroundTasks,
     current_user: PGUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -248,9 +323,14 @@ async def delete_note(
                 detail="Note not found"
             )
         
-        # Soft delete
+        # Soft delete; a shared document is released once no note uses it
         note.is_active = False
+        released = document_text_store.detach(db, note.id)
         db.commit()
+        if released is not None:
+            await release_document(released)
+        # Drop the vectors of the note's text
+        background_tasks.add_task(_sync_note_content, note_id, current_user.id)
         
         return {"message": "Note deleted successfully"}
         
@@ -264,14 +344,14 @@ async def delete_note(
             detail="Failed to delete note"
         )
 
-@router.post("/{note_id}/upload-file")
+@router.post("/{note_id}/upload-file", status_code=status.HTTP_202_ACCEPTED)
 async def upload_file_to_note(
     note_id: str,
     file: UploadFile = File(...),
     current_user: PGUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Upload a file to a note and generate AI summary"""
+    """Upload a file to a note; its processing and AI summary follow in the background"""
     try:
         # Check if note exists and user owns it
         note = db.query(Note).filter(
@@ -287,7 +367,7 @@ async def upload_file_to_note(
             )
         
         # Validate file type
-        allowed_extensions = ['.pdf', '.doc', '.docx', '.txt']
+        allowed_extensions = supported_extensions()
         file_extension = os.path.splitext(file.filename)[1].lower()
         if file_extension not in allowed_extensions:
             raise HTTPException(
@@ -295,60 +375,35 @@ async def upload_file_to_note(
                 detail=f"File type not allowed. Allowed types: {', '.join(allowed_extensions)}"
             )
         
-        # Validate file size (10MB limit)
+        # Validate file size (10MB limit); the declared size can be missing
+        # or wrong, so spooling enforces the limit on the bytes actually read
         if file.size is not None and file.size > settings.MAX_FILE_SIZE:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="File too large. Maximum size is 10MB"
             )
-        
-        # Read file content
-        file_content = await file.read()
-
-        # Upload to S3
-        file_id = str(uuid.uuid4())
-        file_path = f"notes/{current_user.id}/{file_id}/{file.filename}"
-        try:
-            await storage_service.upload_bytes(file_content, file_path, content_type=file.content_type)
-        except RuntimeError as e:
-            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
-
-        # Update note with file information
-        note.uploaded_file_path = file_path
-        note.uploaded_file_name = file.filename
-        note.uploaded_file_type = file_extension[1:]  # Remove the dot
-        note.uploaded_file_size = str(len(file_content))
-        note.updated_at = datetime.utcnow()
-
-        # Generate AI summary and make the document queryable via RAG
         try:
-            document_text = await ai_service.extract_text_from_document(
-                file_content,
-                note.uploaded_file_type
+            upload = await spool_upload(file, suffix=file_extension)
+        except UploadTooLarge:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="File too large. Maximum size is 10MB"
             )
 
-            summary = await ai_service.generate_document_summary(document_text)
-            note.document_summary = summary
-
-            # Embedding failures (quota, network, Pinecone outage, etc.) should
-            # never clobber a summary that already generated successfully.
-            try:
-                rag_service.embed_and_store_chunks(note_id, current_user.id, document_text)
-            except Exception as e:
-                logger.warning(f"Skipping RAG embedding for note {note_id}: {e}")
-
-        except Exception as e:
-            logger.error(f"Error generating AI summary: {e}")
-            note.document_summary = "Failed to generate summary"
-
-        db.commit()
-        db.refresh(note)
+        # Storing, parsing, embedding and summarizing run in the background;
+        # clients follow the job through /ingestion or /ingestion/stream
+        with usage_scope(user_id=current_user.id, document_id=note_id):
+            job = ingestion_pipeline.submit(
+                db, note, current_user.id, upload, file.filename, file_extension, file.content_type
+            )
 
         note_dict = note.to_dict()
         note_dict["description"] = note_dict.pop("content", None)
 
         return {
-            "message": "File uploaded successfully",
+            "message": "File uploaded, processing started",
+            "job_id": job.id,
+            "ingestion": job.to_dict(),
             "note": NoteResponse(**note_dict)
         }
         
@@ -362,9 +417,92 @@ async def upload_file_to_note(
             detail="Failed to upload file"
         )
 
+def _ingestion_payload(job: IngestionJob, note: Note) -> dict:
+    note_dict = note.to_dict()
+    note_dict["description"] = note_dict.pop("content", None)
+    return {"ingestion": job.to_dict(), "note": NoteResponse(**note_dict).dict()}
+
+@router.get("/{note_id}/ingestion")
+async def get_note_ingestion(
+    note_id: str,
+    job_id: Optional[str] = None,
+    current_user: PGUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Progress of a note's upload processing: the given job, or the latest one"""
+    note = db.query(Note).filter(Note.id == note_id, Note.user_id == current_user.id).first()
+    if not note:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found")
+    job = ingestion_pipeline.latest(db, note_id, job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No upload is being processed for this note")
+    return _ingestion_payload(job, note)
+
+@router.get("/{note_id}/ingestion/stream")
+async def stream_note_ingestion(
+    note_id: str,
+    job_id: Optional[str] = None,
+    current_user: PGUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Follow a note's upload processing as Server-Sent Events.
+
+    Emits a `progress` event with the job whenever it changes, then `done`
+    with the finished job and the updated note.
+    """
+    note = db.query(Note).filter(Note.id == note_id, Note.user_id == current_user.id).first()
+    if not note:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found")
+    job = ingestion_pipeline.latest(db, note_id, job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No upload is being processed for this note")
+    job_id = job.id
+
+    def read_job(stream_db: Session):
+        """("done", payload) once the job finished, else ("progress", job); None if it is gone"""
+        stream_db.expire_all()
+        ingestion_pipeline.fail_stale(stream_db, job_id)
+        job = stream_db.get(IngestionJob, job_id)
+        if job is None:
+            return None
+        if job.finished:
+            return "done", _ingestion_payload(job, stream_db.get(Note, note_id))
+        return "progress", job.to_dict()
+
+    async def event_stream():
+        # The job may run in another app process, so follow it through the database
+        stream_db = SessionLocal()
+        try:
+            last = None
+            while True:
+                state = await run_in_threadpool(read_job, stream_db)
+                if state is None:
+                    yield _sse_event("error", {"detail": "Upload processing job not found."})
+                    return
+                event, current = state
+                if event == "done":
+                    yield _sse_event("done", current)
+                    return
+                if current != last:
+                    yield _sse_event("progress", current)
+                    last = current
+                await asyncio.sleep(settings.INGESTION_POLL_INTERVAL_SECONDS)
+        except Exception as e:
+            logger.error(f"Error streaming ingestion progress: {e}")
+            yield _sse_event("error", {"detail": "Failed to follow upload processing."})
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.delete("/{note_id}/remove-file")
 async def remove_file_from_note(
     note_id: str,
+    background_tasks: BackgroundTasks,
     current_user: PGUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -388,11 +526,13 @@ async def remove_file_from_note(
                 detail="No file uploaded to this note"
             )
         
-        # Delete file from S3
-        try:
-            await storage_service.delete_file(note.uploaded_file_path)
-        except Exception as e:
-            logger.error(f"Error deleting file from storage: {e}")
+        # Shared documents are only deleted (S3 object and vectors) once no
+        # note uses them; files uploaded before sharing belong to this note.
+        document = document_text_store.get(db, note.id)
+        legacy_file_path = None
+        if document is None or document.storage_path != note.uploaded_file_path:
+            legacy_file_path = note.uploaded_file_path
+        released = document_text_store.detach(db, note.id)
         
         # Clear file information
         note.uploaded_file_path = None
@@ -406,6 +546,17 @@ async def remove_file_from_note(
         
         db.commit()
         db.refresh(note)
+        if note.content:
+            # Q&A falls back to the note's own text
+            background_tasks.add_task(_sync_note_content, note_id, current_user.id)
+
+        if released is not None:
+            await release_document(released)
+        elif legacy_file_path:
+            try:
+                await storage_service.delete_file(legacy_file_path)
+            except Exception as e:
+                logger.error(f"Error deleting file from storage: {e}")
 
         note_dict = note.to_dict()
         note_dict["description"] = note_dict.pop("content", None)
@@ -425,6 +576,54 @@ async def remove_file_from_note(
             detail="Failed to remove file"
         )
 
+async def _get_document_text(note: Note, db: Session) -> str:
+    """Text of the note's uploaded file, from the document store.
+
+    Notes uploaded before the store existed fall back to downloading and
+    parsing the file, and the result is saved so that happens only once.
+    """
+    document_text = document_text_store.get_text(db, note.id)
+    if document_text is not None:
+        return document_text
+
+    # Get file content from S3
+    try:
+        file_info = await storage_service.get_file_info(note.uploaded_file_path)
+        if not file_info:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Uploaded file not found"
+            )
+        file_content = await storage_service.download_file(note.uploaded_file_path)
+    except HTTPException:
+        raise
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error accessing uploaded file: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to access uploaded file"
+        )
+
+    try:
+        pages = await ai_service.extract_pages_from_document(file_content, note.uploaded_file_type)
+    except Exception as e:
+        logger.error(f"Error extracting text from document: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Could not extract text from the uploaded file"
+        )
+    document = document_text_store.save(
+        db, content_hash(file_content), pages,
+        storage_path=note.uploaded_file_path,
+        file_type=note.uploaded_file_type,
+        file_size=len(file_content),
+    )
+    document_text_store.attach(db, note.id, document)
+    db.commit()
+    return document.text
+
 @router.post("/{note_id}/generate-quiz", response_model=QuizResponse)
 async def generate_quiz(
     note_id: str,
@@ -451,38 +650,18 @@ async def generate_quiz(
                 detail="No file uploaded. Please upload a document first."
             )
         
-        # Get file content from S3
-        try:
-            file_info = await storage_service.get_file_info(note.uploaded_file_path)
-            if not file_info:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Uploaded file not found"
-                )
-            file_content = await storage_service.download_file(note.uploaded_file_path)
-        except HTTPException:
-            raise
-        except RuntimeError as e:
-            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
-        except Exception as e:
-            logger.error(f"Error accessing uploaded file: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to access uploaded file"
-            )
+        ai_usage.check_quota(user_id=current_user.id)
+        
+        document_text = await _get_document_text(note, db)
 
-        # Extract text and generate quiz
+        # Generate quiz
         try:
-            document_text = await ai_service.extract_text_from_document(
-                file_content, 
-                note.uploaded_file_type
-            )
-            
-            quiz_questions = await ai_service.generate_quiz_questions(
-                document_text,
-                num_questions=10,
-                difficulty="medium"
-            )
+            with usage_scope(user_id=current_user.id, document_id=note_id):
+                quiz_questions = await ai_service.generate_quiz_questions(
+                    document_text,
+                    num_questions=10,
+                    difficulty="medium"
+                )
             
             # Mark quiz as generated
             note.quiz_generated = True
@@ -537,34 +716,14 @@ async def generate_audio_overview(
                 detail="No file uploaded. Please upload a document first."
             )
         
-        # Get file content from S3
-        try:
-            file_info = await storage_service.get_file_info(note.uploaded_file_path)
-            if not file_info:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Uploaded file not found"
-                )
-            file_content = await storage_service.download_file(note.uploaded_file_path)
-        except HTTPException:
-            raise
-        except RuntimeError as e:
-            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
-        except Exception as e:
-            logger.error(f"Error accessing uploaded file: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to access uploaded file"
-            )
+        ai_usage.check_quota(user_id=current_user.id)
+        
+        document_text = await _get_document_text(note, db)
 
-        # Extract text and generate audio script
+        # Generate audio script
         try:
-            document_text = await ai_service.extract_text_from_document(
-                file_content, 
-                note.uploaded_file_type
-            )
-            
-            audio_script = await ai_service.generate_audio_overview_script(document_text)
+            with usage_scope(user_id=current_user.id, document_id=note_id):
+                audio_script = await ai_service.generate_audio_overview_script(document_text)
             
             # Mark audio as generated
             note.audio_overview_generated = True
@@ -8,6 +8,8 @@ from middleware.auth_middleware import get_current_user
 from models.postgresql.note import Note
 from models.postgresql.user import User as PGUser
 from services.ai_service import ai_service
+from services.document_store import document_text_store
+from services.ai_usage import ai_usage, usage_scope
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -69,8 +71,9 @@ async def generate_quiz(
                 detail="Note must have an uploaded file to generate quiz"
             )
 
-        # Get document content for quiz generation
-        document_content = note.content or ""
+        # Get document content for quiz generation: the uploaded file's extracted
+        # text when it has been stored, otherwise the note's own content
+        document_content = document_text_store.get_text(db, note.id) or note.content or ""
         if not document_content:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -78,11 +81,13 @@ async def generate_quiz(
             )
 
         # Generate quiz questions using AI service
-        questions = await ai_service.generate_quiz_questions(
-            document_content=document_content,
-            num_questions=request.num_questions,
-            difficulty=request.difficulty
-        )
+        ai_usage.check_quota(user_id=current_user.id)
+        with usage_scope(user_id=current_user.id, document_id=request.note_id):
+            questions = await ai_service.generate_quiz_questions(
+                document_content=document_content,
+                num_questions=request.num_questions,
+                difficulty=request.difficulty
+            )
 
         if not questions:
             raise HTTPException(
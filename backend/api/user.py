@@ -7,6 +7,10 @@ from sqlalchemy.orm import Session
 from core.database import get_db
 from typing import List
 import logging
+from services.ai_usage import ai_usage
+from services.ai_scheduler import ai_scheduler
+from services.ai_cache import ai_response_cache
+from services.rag_service import rag_service
 
 logger = logging.getLogger(__name__)
 
@@ -116,4 +120,25 @@ def update_user_status(
     except Exception as e:
         db.rollback()
         logger.error(f"Error updating user status: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to update user status")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to update user status")
+
+@router.get("/admin/ai-usage")
+async def get_ai_usage_stats(
+    hours: int = 24,
+    admin_user: PGUser = Depends(verify_admin_user)
+):
+    """AI token/latency accounting, quotas, scheduler, cache and embedding throughput - admin only"""
+    try:
+        return {
+            "worker": ai_usage.stats(),
+            "persisted": await ai_usage.persisted_stats(hours=hours),
+            "scheduler": ai_scheduler.stats(),
+            "cache": ai_response_cache.stats(),
+            "embedding": rag_service.embedder.stats(),
+            "embedding_cache": rag_service.cache.stats(),
+            "answer_cache": rag_service.answers.stats(),
+        }
+    except Exception as e:
+        logger.error(f"Error fetching AI usage stats: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch AI usage stats")
+
@@ -0,0 +1,102 @@
+"""Speed and chunk shape of the RAG chunker.
+
+    cd backend
+    python -m benchmarks.chunking                 # synthetic prose, 10-1000 pages
+    python -m benchmarks.chunking --pages 300 --tokens 200 --overlap 40
+
+Compares the sentence chunker (on the whole text and fed page by page, as
+uploads stream in) with the fixed 500-word windows it replaced. It reports
+throughput, chunk count, the spread of estimated tokens per chunk, and how
+many chunks end mid-sentence.
+"""
+import argparse
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.corpus import page_text
+from services.chunking import SentenceChunker
+from services.document_store import join_pages
+
+SENTENCE_ENDS = (".", "!", "?")
+
+
+def prose_pages(count: int) -> List[str]:
+    """Pages of sentences of varying length, a paragraph break every few sentences"""
+    pages = []
+    for number in range(count):
+        lines = page_text(seed=number, lines=30, words_per_line=6 + number % 18)
+        paragraphs = [". ".join(lines[i:i + 5]) + "." for i in range(0, len(lines), 5)]
+        pages.append("\n\n".join(paragraphs))
+    return pages
+
+
+def word_windows(pages: List[str], chunk_size: int = 500) -> List[str]:
+    words = "\n".join(pages).split()
+    return [" ".join(words[i:i + chunk_size]) for i in range(0, len(words), chunk_size)]
+
+
+def _sentence_chunks(tokens: int, overlap: int) -> Callable[[List[str]], List[str]]:
+    def run(pages: List[str]) -> List[str]:
+        return [chunk.text for chunk in SentenceChunker(tokens, overlap).chunk(*join_pages(pages))]
+    return run
+
+
+def _streamed_chunks(tokens: int, overlap: int) -> Callable[[List[str]], List[str]]:
+    def run(pages: List[str]) -> List[str]:
+        chunker = SentenceChunker(tokens, overlap)
+        chunks = [chunk.text for page in pages for chunk in chunker.feed(page)]
+        return chunks + [chunk.text for chunk in chunker.finish()]
+    return run
+
+
+def measure(name: str, fn: Callable[[List[str]], List[str]], pages: List[str], repeat: int) -> Dict:
+    chars = sum(len(page) for page in pages)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        chunks = fn(pages)
+    seconds = (time.perf_counter() - started) / repeat
+    tokens = [len(chunk) // 4 + 1 for chunk in chunks]
+    return {
+        "chunker": name,
+        "pages": len(pages),
+        "mb_per_sec": chars / 1e6 / seconds,
+        "chunks": len(chunks),
+        "tokens_mean": statistics.mean(tokens),
+        "tokens_min": min(tokens),
+        "tokens_max": max(tokens),
+        "tokens_stdev": statistics.pstdev(tokens),
+        "cut_mid_sentence": sum(not chunk.endswith(SENTENCE_ENDS) for chunk in chunks[:-1]) / max(1, len(chunks) - 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--tokens", type=int, default=300, help="sentence chunker window")
+    parser.add_argument("--overlap", type=int, default=50, help="sentence chunker overlap")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    chunkers = [
+        ("words-500", word_windows),
+        (f"sentences-{args.tokens}/{args.overlap}", _sentence_chunks(args.tokens, args.overlap)),
+        ("  streamed", _streamed_chunks(args.tokens, args.overlap)),
+    ]
+    header = (f"{'chunker':<20} {'pages':>6} {'MB/s':>7} {'chunks':>7} "
+              f"{'tok mean':>9} {'min':>5} {'max':>5} {'stdev':>6} {'mid-sent':>9}")
+    print(header)
+    print("-" * len(header))
+    for count in args.pages:
+        pages = prose_pages(count)
+        for name, fn in chunkers:
+            row = measure(name, fn, pages, args.repeat)
+            print(
+                f"{row['chunker']:<20} {row['pages']:>6} {row['mb_per_sec']:>7.1f} {row['chunks']:>7} "
+                f"{row['tokens_mean']:>9.1f} {row['tokens_min']:>5} {row['tokens_max']:>5} "
+                f"{row['tokens_stdev']:>6.1f} {row['cut_mid_sentence']:>9.0%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
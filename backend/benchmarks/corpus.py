@@ -0,0 +1,93 @@
+"""Synthetic, reproducible documents for the extraction benchmark and tests.
+
+Every document is generated from a seed, so its ground-truth text is known
+and extractors can be scored on correctness as well as speed. PDFs are
+written directly (one Helvetica text block per page, no dependencies);
+Word files need python-docx.
+"""
+import io
+import os
+import random
+from typing import Dict, List, Sequence
+
+_VOCABULARY = (
+    "photosynthesis chlorophyll energy light carbon dioxide glucose cell membrane enzyme protein "
+    "molecule reaction oxygen water nucleus structure function process cycle system theory model "
+    "equation variable experiment result analysis data evidence history revolution economy market "
+    "culture language society network algorithm memory storage signal frequency current voltage"
+).split()
+
+# Characters per page for formats without real pages, when reporting pages/sec
+PAGE_EQUIVALENT_CHARS = 3000
+
+
+def page_text(seed: int, lines: int = 40, words_per_line: int = 12) -> List[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(_VOCABULARY) for _ in range(words_per_line)).capitalize() for _ in range(lines)]
+
+
+def make_pdf(pages: Sequence[str]) -> bytes:
+    """A minimal text PDF; each page's lines become one text block"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        lines = "".join(f"({line}) Tj T* " for line in text.split("\n"))
+        stream = f"BT /F1 10 Tf 12 TL 50 750 Td {lines}ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def make_docx(paragraphs: Sequence[str]) -> bytes:
+    from docx import Document
+
+    doc = Document()
+    for paragraph in paragraphs:
+        doc.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def make_markdown(pages: Sequence[str]) -> str:
+    sections = [f"## Section {i + 1}\n\n" + page.replace("\n", " ") for i, page in enumerate(pages)]
+    return "# Benchmark document\n\n" + "\n\n".join(sections) + "\n"
+
+
+def build_corpus(directory: str, page_counts: Sequence[int] = (1, 10, 100, 300)) -> List[Dict]:
+    """Write one document per (format, size) and return their descriptions.
+
+    Each entry has `path`, `format`, `pages` and the `expected` text.
+    """
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for count in page_counts:
+        pages = ["\n".join(page_text(seed=count * 1000 + i)) for i in range(count)]
+        documents = {
+            "pdf": make_pdf(pages),
+            "txt": "\n".join(pages).encode("utf-8"),
+            "md": make_markdown(pages).encode("utf-8"),
+        }
+        try:
+            documents["docx"] = make_docx([line for page in pages for line in page.split("\n")])
+        except ImportError:
+            pass
+        for fmt, content in documents.items():
+            path = os.path.join(directory, f"synthetic-{count:04d}p.{fmt}")
+            with open(path, "wb") as handle:
+                handle.write(content)
+            corpus.append({"path": path, "format": fmt, "pages": count, "expected": "\n".join(pages)})
+    return corpus
@@ -0,0 +1,176 @@
+"""Speed, memory and correctness of every registered extraction backend.
+
+    cd backend
+    python -m benchmarks.extraction                  # synthetic corpus, 1-300 pages
+    python -m benchmarks.extraction --pages 10 500   # other synthetic sizes
+    python -m benchmarks.extraction --corpus ~/pdfs  # real documents (no recall)
+
+For each document it runs every backend of the document's format, and the
+configured fallback chain, in a fresh process. It reports pages/sec, the
+peak RSS that parsing added on top of the imported library, and word recall
+against the generated ground truth. Non-paged formats count every
+PAGE_EQUIVALENT_CHARS characters as a page. Paged formats also get a
+`pool` row: the same file streamed through ExtractionPool page ranges,
+i.e. what an upload sees with EXTRACTION_WORKERS processes.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import multiprocessing
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from benchmarks.corpus import PAGE_EQUIVALENT_CHARS, build_corpus
+from services import extractors
+from services.extractors import FORMATS, resolve_format
+
+# Imported before timing, so measurements exclude library start-up
+_BACKEND_MODULES = {"pypdf2": "PyPDF2", "pdfplumber": "pdfplumber", "python-docx": "docx"}
+
+
+def _parse(path: str, format_name: str, backends: Sequence[str]) -> List[str]:
+    fmt = resolve_format(format_name)
+    if fmt.paged:
+        return extractors.extract_page_range(path, 0, fmt.page_count(path), backends)
+    return [extractors.extract_document(path, backends)]
+
+
+def _measure(path: str, format_name: str, backends: Sequence[str], repeat: int) -> Dict:
+    """Runs in a fresh process, so ru_maxrss belongs to this measurement alone"""
+    for name in backends:
+        module = _BACKEND_MODULES.get(name)
+        if module:
+            __import__(module)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for _ in range(repeat):
+        pages = _parse(path, format_name, backends)
+    seconds = (time.perf_counter() - started) / repeat
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"pages": pages, "seconds": seconds, "peak_mb": peak_kb / 1024, "parse_mb": (peak_kb - baseline_kb) / 1024}
+
+
+def _measure_pool(path: str, format_name: str, workers: int) -> Dict:
+    from services.extraction import ExtractionPool, iter_document_pages
+
+    pool = ExtractionPool(enabled=True, workers=workers)
+
+    async def run():
+        # Start the workers first so the timing excludes process start-up
+        await asyncio.gather(*[pool.run(os.getpid) for _ in range(workers)])
+        started = time.perf_counter()
+        pages = [text async for _, text in iter_document_pages(path, resolve_format(format_name), pool=pool)]
+        return pages, time.perf_counter() - started
+
+    try:
+        pages, seconds = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    return {"pages": pages, "seconds": seconds, "peak_mb": None, "parse_mb": None}
+
+
+def _recall(expected: Optional[str], pages: List[str]) -> Optional[float]:
+    if expected is None:
+        return None
+    want = Counter(expected.split())
+    got = Counter(" ".join(pages).split())
+    return sum((want & got).values()) / max(1, sum(want.values()))
+
+
+def _candidates(format_name: str) -> List[Sequence[str]]:
+    fmt = resolve_format(format_name)
+    available = extractors.PAGED_BACKENDS if fmt.paged else extractors.DOCUMENT_BACKENDS
+    singles = [(name,) for name in available if name in fmt.backends]
+    return singles + ([fmt.backends] if len(fmt.backends) > 1 else [])
+
+
+def _real_corpus(directory: str) -> List[Dict]:
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        try:
+            fmt = resolve_format(filename=name)
+        except ValueError:
+            continue
+        path = os.path.join(directory, name)
+        corpus.append({"path": path, "format": fmt.name, "pages": None, "expected": None})
+    return corpus
+
+
+def run(corpus: List[Dict], repeat: int, workers: int) -> List[Dict]:
+    spawn = multiprocessing.get_context("spawn")
+    results = []
+    for document in corpus:
+        paged = resolve_format(document["format"]).paged
+        runs = [("+".join(backends), _measure, (document["path"], document["format"], backends, repeat))
+                for backends in _candidates(document["format"])]
+        if paged:
+            runs.append(("pool", _measure_pool, (document["path"], document["format"], workers)))
+        for label, fn, args in runs:
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                    measured = executor.submit(fn, *args).result()
+            except Exception as e:
+                results.append({"document": os.path.basename(document["path"]), "backend": label, "error": str(e)})
+                continue
+            pages = measured["pages"]
+            chars = sum(len(page) for page in pages)
+            page_count = len(pages) if paged else max(1, chars / PAGE_EQUIVALENT_CHARS)
+            results.append({
+                "document": os.path.basename(document["path"]),
+                "backend": label,
+                "pages": page_count,
+                "seconds": measured["seconds"],
+                "pages_per_sec": page_count / measured["seconds"] if measured["seconds"] else float("inf"),
+                "peak_mb": measured["peak_mb"],
+                "parse_mb": measured["parse_mb"],
+                "recall": _recall(document["expected"], pages),
+            })
+    return results
+
+
+def _cell(value: Optional[float], width: int, precision: int) -> str:
+    return f"{value:>{width}.{precision}f}" if value is not None else f"{'-':>{width}}"
+
+
+def _print_table(results: List[Dict]):
+    header = f"{'document':<26} {'backend':<20} {'pages':>7} {'pages/s':>9} {'peak MB':>8} {'parse MB':>9} {'recall':>7}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        if "error" in row:
+            print(f"{row['document']:<26} {row['backend']:<20} error: {row['error']}")
+            continue
+        print(
+            f"{row['document']:<26} {row['backend']:<20} {row['pages']:>7.0f} {row['pages_per_sec']:>9.1f} "
+            f"{_cell(row['peak_mb'], 8, 1)} {_cell(row['parse_mb'], 9, 1)} {_cell(row['recall'], 7, 3)}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100, 300], help="synthetic document sizes")
+    parser.add_argument("--corpus", help="directory of real documents to benchmark instead")
+    parser.add_argument("--formats", nargs="+", default=[fmt.name for fmt in FORMATS])
+    parser.add_argument("--repeat", type=int, default=1, help="parses per measurement (averaged)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes for the pool rows")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="extraction-bench-") as scratch:
+        corpus = _real_corpus(args.corpus) if args.corpus else build_corpus(scratch, args.pages)
+        corpus = [document for document in corpus if document["format"] in args.formats]
+        results = run(corpus, args.repeat, args.workers)
+
+    _print_table(results)
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
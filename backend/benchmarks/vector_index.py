@@ -0,0 +1,77 @@
+"""Query latency of the local vector index backends.
+
+    cd backend
+    python -m benchmarks.vector_index                      # 100 documents of 200 chunks
+    python -m benchmarks.vector_index --documents 500 --chunks 400 --dim 1536
+
+Loads random unit vectors for N documents into InMemoryIndex and
+LocalVectorIndex (in a temporary directory), then times single-document
+queries, the shape of every note Q&A request. It also reports upsert
+throughput and the size of the local store on disk.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from services.vector_index import InMemoryIndex, LocalVectorIndex
+
+
+def _percentiles(samples: List[float]) -> str:
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f"p50 {p50 * 1000:8.3f}ms  p99 {p99 * 1000:8.3f}ms"
+
+
+def measure(name: str, index, documents: int, chunks: int, dim: int, queries: int,
+            describe: Callable[[], str] = lambda: ""):
+    rng = np.random.default_rng(0)
+    started = time.perf_counter()
+    for document in range(documents):
+        vectors = rng.standard_normal((chunks, dim), dtype=np.float32)
+        index.upsert([
+            (f"doc{document}-{i}", vector.tolist(), {"document_hash": f"doc{document}", "chunk": "", "page": 1})
+            for i, vector in enumerate(vectors)
+        ])
+    upsert_seconds = time.perf_counter() - started
+
+    samples = []
+    picker = random.Random(1)
+    for _ in range(queries):
+        vector = rng.standard_normal(dim, dtype=np.float32).tolist()
+        filter = {"document_hash": f"doc{picker.randrange(documents)}"}
+        started = time.perf_counter()
+        index.query(vector=vector, top_k=3, include_metadata=True, filter=filter)
+        samples.append(time.perf_counter() - started)
+    print(f"{name:<8} upsert {documents * chunks / upsert_seconds:9.0f} vectors/s  query {_percentiles(samples)}  {describe()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--chunks", type=int, default=200, help="chunks per document")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--skip-memory", action="store_true", help="the pure-Python index is slow on large loads")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        local = LocalVectorIndex(path)
+
+        def disk_size() -> str:
+            size = sum(os.path.getsize(os.path.join(path, entry)) for entry in os.listdir(path))
+            return f"{size / 1048576:.1f}MB on disk"
+
+        measure("local", local, args.documents, args.chunks, args.dim, args.queries, disk_size)
+    if not args.skip_memory:
+        measure("memory", InMemoryIndex(), args.documents, args.chunks, args.dim, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -47,27 +47,114 @@ class Settings(BaseSettings):
     OPENAI_MODEL: str = "gpt-4o-mini"
     OPENAI_MAX_TOKENS: int = 2000
     OPENAI_TEMPERATURE: float = 0.7
-    
+    # Async client connection pool and per-call timeouts (seconds). Batch
+    # timeouts cover whole-document jobs: summaries, quizzes, audio scripts.
+    OPENAI_TIMEOUT_SECONDS: float = 30.0
+    OPENAI_BATCH_TIMEOUT_SECONDS: float = 120.0
+    OPENAI_MAX_RETRIES: int = 2
+    OPENAI_MAX_CONNECTIONS: int = 100
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    # "openai", or "fake" for offline load tests (deterministic synthetic output)
+    AI_PROVIDER: str = "openai"
+    FAKE_AI_LATENCY_MS: float = 300.0
+    FAKE_AI_LATENCY_JITTER_MS: float = 100.0
+    FAKE_AI_COMPLETION_TOKENS: int = 200
+    FAKE_AI_COMPLETION_TOKENS_JITTER: int = 50
+    FAKE_AI_EMBEDDING_LATENCY_MS: float = 50.0
+    FAKE_AI_EMBEDDING_DIMENSIONS: int = 1536
+    # Stream @chatbot answers to the topic as ai_delta frames while they generate
+    AI_CHAT_STREAMING: bool = True
+    # Content-addressed cache for document summaries, quizzes and audio scripts
+    AI_CACHE_ENABLED: bool = True
+    AI_CACHE_MAX_ENTRIES: int = 256  # in-process LRU tier
+    AI_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    AI_CACHE_PERSISTENT_MAX_ENTRIES: int = 10000  # MongoDB tier
+    # Map-reduce summarization for documents larger than one prompt (tokens)
+    SUMMARY_SINGLE_PASS_TOKENS: int = 12000
+    SUMMARY_SECTION_TOKENS: int = 3000
+    SUMMARY_MAX_PARALLEL: int = 4
+    # Per-worker OpenAI admission control; keep RPM/TPM at or below the account tier
+    AI_SCHEDULER_RPM: int = 500
+    AI_SCHEDULER_TPM: int = 200000
+    AI_SCHEDULER_MAX_CONCURRENCY: int = 32
+    AI_SCHEDULER_MIN_CONCURRENCY: int = 1
+    AI_SCHEDULER_INTERACTIVE_RESERVE: int = 2  # slots batch jobs never take
+    # Group-chat AI context: last K messages verbatim plus a running summary of older ones
+    TOPIC_CONTEXT_RECENT_MESSAGES: int = 20
+    TOPIC_CONTEXT_TOKEN_BUDGET: int = 1500  # recent messages + summary per request
+    TOPIC_CONTEXT_SUMMARY_BATCH: int = 10  # evicted messages folded into the summary at once
+    TOPIC_CONTEXT_MAX_CATCHUP: int = 200  # unsummarized backlog read when a topic is first loaded
+    TOPIC_CONTEXT_MAX_TOPICS: int = 1000  # topics kept in memory per worker
+    # AI usage accounting; daily token quotas per worker (0 disables a limit)
+    AI_USAGE_FLUSH_BATCH_SIZE: int = 100
+    AI_USAGE_FLUSH_INTERVAL_SECONDS: float = 10.0
+    AI_QUOTA_USER_SOFT_TOKENS: int = 200000
+    AI_QUOTA_USER_HARD_TOKENS: int = 500000
+    AI_QUOTA_ROOM_SOFT_TOKENS: int = 500000
+    AI_QUOTA_ROOM_HARD_TOKENS: int = 1500000
+
     # Encryption Settings - From .env
     ENCRYPTION_KEY: str = os.getenv("ENCRYPTION_KEY", "")  # From .env
     CHAT_ENCRYPTION_ENABLED: bool = True
     
     # Vector Database for RAG - From .env
-    VECTOR_DB_TYPE: str = "pinecone"
+    VECTOR_DB_TYPE: str = "pinecone"  # "local" (memory-mapped files, one worker) or "memory" (per-process, for local/load testing)
+    VECTOR_DB_LOCAL_PATH: str = os.getenv("VECTOR_DB_LOCAL_PATH", "vector_store")  # directory for VECTOR_DB_TYPE="local"
     VECTOR_DB_REGION: str = "us-east-1-aws"
     VECTOR_DB_URL: str = os.getenv("VECTOR_DB_URL", "")  # From .env
     VECTOR_DB_API_KEY: str = os.getenv("VECTOR_DB_API_KEY", "")  # From .env
     VECTOR_DB_INDEX_NAME: str = "ai-learning-notes"
+    # RAG chunks pack whole sentences into windows of about this many tokens, sharing some overlap
+    RAG_CHUNK_TOKENS: int = 300
+    RAG_CHUNK_OVERLAP_TOKENS: int = 50
+    # Note Q&A fuses BM25 keyword matches with vector matches by reciprocal-rank fusion
+    RAG_HYBRID_SEARCH: bool = True
+    RAG_HYBRID_CANDIDATES: int = 20  # taken from each retriever before fusing
+    RAG_RRF_K: int = 60
+    RAG_KEYWORD_MIN_SCORE_RATIO: float = 0.1  # keyword hits below this share of the best one only matched common words; not fused
+    RAG_KEYWORD_INDEX_CACHE_SIZE: int = 64  # documents' keyword indexes kept in memory per worker
+    # Repeated note questions reuse the question's embedding and the answer given about the same document
+    RAG_ANSWER_CACHE_ENABLED: bool = True
+    RAG_ANSWER_CACHE_SIZE: int = 5000  # answers kept in memory per worker
+    RAG_QUESTION_EMBEDDING_CACHE_SIZE: int = 2000
+    # Embedding requests are batched by estimated tokens and run concurrently
+    EMBEDDING_BATCH_MAX_TOKENS: int = 8000  # per request; the API rejects oversized inputs
+    EMBEDDING_BATCH_MAX_INPUTS: int = 2048  # API limit on inputs per request
+    EMBEDDING_MAX_CONCURRENT_BATCHES: int = 4  # per worker, for document ingestion
+    # Local SQLite cache of chunk embeddings, shared by the workers on a host ("" disables)
+    EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+    EMBEDDING_CACHE_MAX_MB: int = 1024  # least recently used vectors are evicted beyond this
     
     # File Upload - Hardcoded values
     MAX_FILE_SIZE: int = 10485760  # 10MB
     ALLOWED_FILE_TYPES: List[str] = ["pdf", "doc", "docx", "txt", "md"]
+    # Uploads are copied, hashed and size-checked in pieces of this size
+    UPLOAD_READ_CHUNK_SIZE: int = 1048576  # 1MB
+    # Extracted document text is kept zlib-compressed in Postgres (1 fastest .. 9 smallest)
+    DOCUMENT_TEXT_COMPRESSION_LEVEL: int = 6
+    # PDF/Word parsing runs in worker processes off the event loop (False: threadpool)
+    EXTRACTION_PROCESS_POOL: bool = True
+    EXTRACTION_WORKERS: int = 0  # 0 = one per CPU
+    EXTRACTION_TIMEOUT_SECONDS: float = 60.0
+    EXTRACTION_MEMORY_LIMIT_MB: int = 1024  # address space cap per worker (0 disables)
+    EXTRACTION_MAX_TASKS_PER_CHILD: int = 50  # replace workers periodically to bound leaks
+    EXTRACTION_PAGES_PER_JOB: int = 16  # PDF pages parsed per worker job
+    # PDF backend chain: fast text layer first, blank pages retried layout-aware
+    EXTRACTION_PDF_BACKENDS: List[str] = ["pypdf2", "pdfplumber"]
+    # Uploads are processed in the background (store, extract, chunk, embed, summarize, analyze)
+    INGESTION_MAX_CONCURRENT_JOBS: int = 4  # per app process; further uploads wait as "queued"
+    INGESTION_PROGRESS_INTERVAL_SECONDS: float = 1.0  # min gap between persisted page/chunk counts
+    INGESTION_POLL_INTERVAL_SECONDS: float = 0.5  # how often the progress stream re-reads the job
+    INGESTION_STALE_JOB_SECONDS: int = 900  # an unfinished job with no progress for this long is failed (its process died)
 
     # AWS S3 - From .env (used for note file uploads and generated audio)
     AWS_ACCESS_KEY_ID: str = os.getenv("AWS_ACCESS_KEY_ID", "")
     AWS_SECRET_ACCESS_KEY: str = os.getenv("AWS_SECRET_ACCESS_KEY", "")
     AWS_S3_BUCKET: str = os.getenv("AWS_S3_BUCKET", "")
     AWS_REGION: str = os.getenv("AWS_REGION", "us-east-1")
+    # Files above this size go to S3 as a multipart upload of parts this size (S3 minimum is 5MB)
+    S3_MULTIPART_CHUNK_SIZE: int = 8388608  # 8MB
 
     # Audio Generation - From .env
     ELEVENLABS_API_KEY: str = os.getenv("ELEVENLABS_API_KEY", "")  # From .env
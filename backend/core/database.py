@@ -62,6 +62,8 @@ def init_db():
         from models.postgresql.topic import Topic
         from models.postgresql.note import Note
         from models.postgresql.chat_log import ChatLog
+        from models.postgresql.document_text import DocumentText, NoteDocument, DocumentChunk, DocumentKeywordIndex
+        from models.postgresql.ingestion_job import IngestionJob
         
         # Create all tables
         Base.metadata.create_all(bind=engine)
@@ -1,13 +1,17 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict
+from typing import Dict, Tuple
 import json
 import logging
 import re
 from datetime import datetime
+from core.config import settings
 from core.database import get_mongo_db, SessionLocal
 from models.mongodb.chat_log import ChatLog, ChatMessage
 from models.postgresql.room import RoomParticipant
 from services.encryption_service import encryption_service
+from services.single_flight import SingleFlight
+from services.topic_context import topic_context_store
+from services.ai_usage import ai_usage, usage_scope, AIQuotaExceeded
 from middleware.websocket_auth import get_user_from_token
 
 logger = logging.getLogger(__name__)
@@ -113,6 +117,7 @@ class ConnectionManager:
             await self.broadcast_to_topic(room_id, topic_id, sender_id, message)
 
 manager = ConnectionManager()
+ai_stream_flight = SingleFlight()
 
 class ChatWebSocket:
     def __init__(self, websocket: WebSocket, room_id: str, topic_id: str, user_id: str):
@@ -167,6 +172,10 @@ class ChatWebSocket:
             
             # Save to database
             await self.save_message_to_db(chat_message)
+            topic_context_store.record(
+                self.room_id, self.topic_id, chat_message.message_id,
+                chat_message.user_name, content
+            )
             
             # Prepare message for broadcasting
             broadcast_message = {
@@ -202,7 +211,17 @@ class ChatWebSocket:
                 await self.send_error("Please include a question after @chatbot.")
                 return
             
+            try:
+                ai_usage.check_quota(user_id=self.user_id, room_id=self.room_id)
+            except AIQuotaExceeded as e:
+                await self.send_error(e.detail)
+                return
+            
+            # Conversation so far (taken before this question is recorded)
+            context_summary, chat_history = await self.get_topic_context()
+            
             # Create AI message placeholder
+            user_name = message_data.get("user_name", "Unknown")
             ai_message = ChatMessage(
                 message_id=f"ai_{datetime.utcnow().timestamp()}",
                 user_id="ai_bot",
@@ -211,11 +230,15 @@ class ChatWebSocket:
                 content=question,
                 message_type="ai",
                 timestamp=datetime.utcnow(),
-                is_ai=True
+                is_ai=True,
+                metadata={"requested_by": self.user_id, "requester_name": user_name}
             )
             
             # Save AI request to database
             await self.save_message_to_db(ai_message)
+            topic_context_store.record(
+                self.room_id, self.topic_id, ai_message.message_id, user_name, question
+            )
             
             # Send typing indicator
             await manager.broadcast_to_topic(
@@ -226,12 +249,24 @@ class ChatWebSocket:
                 }
             )
             
-            # Get AI response
-            ai_response = await self.get_ai_response(question)
+            # Get AI response, streamed to the topic as ai_delta frames unless
+            # the client (or config) asks for a single complete message
+            response_id = f"ai_resp_{datetime.utcnow().timestamp()}"
+            with usage_scope(user_id=self.user_id, room_id=self.room_id, topic_id=self.topic_id):
+                if message_data.get("stream", settings.AI_CHAT_STREAMING):
+                    streamed_id, ai_response = await self.stream_ai_response(
+                        question, response_id, chat_history, context_summary
+                    )
+                    if streamed_id != response_id:
+                        # Coalesced onto another request's stream: that request
+                        # saves and broadcasts the one shared answer
+                        return
+                else:
+                    ai_response = await self.get_ai_response(question, chat_history, context_summary)
             
             # Create AI response message
             ai_response_message = ChatMessage(
-                message_id=f"ai_resp_{datetime.utcnow().timestamp()}",
+                message_id=response_id,
                 user_id="ai_bot",
                 user_name="AI Assistant",
                 user_picture=None,
@@ -243,8 +278,12 @@ class ChatWebSocket:
             
             # Save AI response to database
             await self.save_message_to_db(ai_response_message)
+            topic_context_store.record(
+                self.room_id, self.topic_id, response_id, "AI Assistant", ai_response, is_ai=True
+            )
             
-            # Broadcast AI response
+            # Broadcast AI response (for streamed answers this carries the same
+            # message_id as the deltas, so clients replace the partial text)
             broadcast_message = {
                 "type": "chat_message",
                 "message_id": ai_response_message.message_id,
@@ -342,7 +381,15 @@ class ChatWebSocket:
         except Exception as e:
             logger.error(f"Error saving message to database: {e}")
     
-    async def get_ai_response(self, question: str) -> str:
+    async def get_topic_context(self):
+        """Running summary and recent messages of this topic for the AI prompt"""
+        try:
+            return await topic_context_store.get_context(self.room_id, self.topic_id)
+        except Exception as e:
+            logger.error(f"Error loading topic context: {e}")
+            return "", []
+    
+    async def get_ai_response(self, question: str, chat_history: list = None, context_summary: str = None) -> str:
         """Get AI response for a question"""
         try:
             # Import AI service
@@ -351,9 +398,10 @@ class ChatWebSocket:
             # Get AI response using the AI service
             response = await ai_service.generate_group_chat_response(
                 message=question,
-                chat_history=[],  # Could be enhanced to include recent context
+                chat_history=chat_history,
                 room_id=self.room_id,
-                user_id=self.user_id
+                user_id=self.user_id,
+                context_summary=context_summary
             )
             
             return response.get("response", "Sorry, I couldn't generate a response at this time.")
@@ -362,6 +410,46 @@ class ChatWebSocket:
             logger.error(f"Error getting AI response: {e}")
             return "Sorry, I'm having trouble processing your request right now."
     
+    async def stream_ai_response(self, question: str, message_id: str, chat_history: list = None, context_summary: str = None) -> Tuple[str, str]:
+        """Fan an AI answer out to the topic as ai_delta frames.
+
+        Returns (message_id, full text). If the same question was already
+        being streamed to this topic, the answer is that stream's, under its
+        message_id rather than the one passed in.
+        """
+        try:
+            flight_key = f"{self.room_id}:{self.topic_id}:{' '.join(question.lower().split())}"
+            return await ai_stream_flight.do(
+                flight_key, lambda: self._stream_to_topic(question, message_id, chat_history, context_summary)
+            )
+        except Exception as e:
+            logger.error(f"Error streaming AI response: {e}")
+            return message_id, "Sorry, I'm having trouble processing your request right now."
+    
+    async def _stream_to_topic(self, question: str, message_id: str, chat_history: list = None, context_summary: str = None) -> Tuple[str, str]:
+        from services.ai_service import ai_service
+        
+        parts = []
+        async for delta in ai_service.stream_group_chat_response(
+            message=question,
+            chat_history=chat_history,
+            room_id=self.room_id,
+            user_id=self.user_id,
+            context_summary=context_summary
+        ):
+            parts.append(delta)
+            await manager.broadcast_to_topic(
+                self.room_id, self.topic_id, "ai_bot",
+                {
+                    "type": "ai_delta",
+                    "message_id": message_id,
+                    "delta": delta
+                }
+            )
+        
+        response = "".join(parts).strip()
+        return message_id, response or "Sorry, I couldn't generate a response at this time."
+    
     async def send_error(self, error_message: str):
         """Send error message to the client"""
         try:
@@ -20,6 +20,12 @@ from api import auth, user, room, topic, notes, chat, quiz, audio
 from core.config import settings
 from core.database import init_db, connect_to_mongo, close_mongo_connection
 from core.websocket import websocket_endpoint
+from services.ai_cache import ai_response_cache
+from services.ai_service import ai_service
+from services.ai_usage import ai_usage
+from services.embedding_cache import embedding_cache
+from services.extraction import extraction_pool
+from services.ingestion import ingestion_pipeline
 
 # Configure logging for production
 logging.basicConfig(
@@ -43,10 +49,13 @@ async def lifespan(app: FastAPI):
         # Initialize database
         init_db()
         logger.info("Database initialized successfully")
+        ingestion_pipeline.start()
         
         # Connect to MongoDB
         await connect_to_mongo()
         logger.info("MongoDB connected successfully")
+        await ai_response_cache.ensure_indexes()
+        ai_usage.start()
         
         logger.info("Application startup completed")
         yield
@@ -58,8 +67,13 @@ async def lifespan(app: FastAPI):
         # Shutdown
         logger.info("Shutting down application...")
         try:
+            await ingestion_pipeline.stop()
+            await ai_usage.stop()
             await close_mongo_connection()
             logger.info("MongoDB connection closed")
+            await ai_service.close()
+            extraction_pool.shutdown()
+            embedding_cache.close()
         except Exception as e:
             logger.error(f"Shutdown error: {e}")
 
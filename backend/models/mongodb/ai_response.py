@@ -30,7 +30,7 @@ class PyObjectId(ObjectId):
         return {"type": "string", "format": "objectid"}
     
     def __str__(self) -> str:
-        return str(super())
+        return super().__str__()
     
     def __repr__(self) -> str:
         return f"PyObjectId('{str(self)}')"
@@ -0,0 +1,103 @@
+from sqlalchemy import Column, String, DateTime, Integer, Text, LargeBinary, ForeignKey
+from sqlalchemy.sql import func
+from core.database import Base
+from bisect import bisect_right
+import json
+import zlib
+
+class DocumentText(Base):
+    """An uploaded file, stored once per distinct content however many notes use it.
+
+    Keyed by the sha256 of the file bytes: identical uploads share the S3
+    object, the extracted text, the summary and the chunk embeddings.
+    """
+    __tablename__ = "document_texts"
+
+    content_hash = Column(String(64), primary_key=True)  # sha256 of the uploaded bytes
+    storage_path = Column(String(500), nullable=True)  # S3 key of the shared object
+    file_type = Column(String(50), nullable=True)
+    file_size = Column(Integer, nullable=True)
+    compressed_text = Column(LargeBinary, nullable=False)  # zlib-compressed UTF-8
+    page_offsets = Column(Text, nullable=False, default="[0]")  # JSON list: character offset where each page starts
+    char_count = Column(Integer, nullable=False, default=0)
+    page_count = Column(Integer, nullable=False, default=1)
+    summary = Column(Text, nullable=True)
+    chunk_count = Column(Integer, nullable=True)  # chunks embedded as "{content_hash}-{i}"; None until embedded
+    ref_count = Column(Integer, nullable=False, default=0)  # notes currently attached
+    extracted_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<DocumentText(content_hash={self.content_hash}, refs={self.ref_count}, pages={self.page_count})>"
+
+    @property
+    def text(self) -> str:
+        return zlib.decompress(self.compressed_text).decode("utf-8")
+
+    @property
+    def offsets(self) -> list:
+        return json.loads(self.page_offsets or "[0]")
+
+    def page_at(self, offset: int) -> int:
+        """1-based page number containing the given character offset"""
+        return max(1, bisect_right(self.offsets, offset))
+
+    def chunk_ids(self) -> list:
+        return [f"{self.content_hash}-{i}" for i in range(self.chunk_count or 0)]
+
+    def to_dict(self):
+        return {
+            "content_hash": self.content_hash,
+            "file_type": self.file_type,
+            "file_size": self.file_size,
+            "char_count": self.char_count,
+            "page_count": self.page_count,
+            "chunk_count": self.chunk_count,
+            "ref_count": self.ref_count,
+            "compressed_size": len(self.compressed_text or b""),
+            "extracted_at": self.extracted_at.isoformat() if self.extracted_at else None
+        }
+
+
+class NoteDocument(Base):
+    """Which stored document a note's uploaded file is"""
+    __tablename__ = "note_documents"
+
+    note_id = Column(String, ForeignKey("notes.id"), primary_key=True)
+    content_hash = Column(String(64), ForeignKey("document_texts.content_hash"), nullable=False, index=True)
+    attached_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<NoteDocument(note_id={self.note_id}, content_hash={self.content_hash})>"
+
+
+class DocumentChunk(Base):
+    """The text of one embedded chunk, so the vector index only holds ids and filter fields"""
+    __tablename__ = "document_chunks"
+
+    chunk_id = Column(String(80), primary_key=True)  # the vector id, "{content_hash}-{position}"
+    content_hash = Column(String(64), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    page = Column(Integer, nullable=False, default=1)
+    start_offset = Column(Integer, nullable=False)  # character span in the document text
+    end_offset = Column(Integer, nullable=False)
+    compressed_text = Column(LargeBinary, nullable=False)  # zlib-compressed UTF-8
+
+    def __repr__(self):
+        return f"<DocumentChunk(chunk_id={self.chunk_id}, page={self.page})>"
+
+    @property
+    def text(self) -> str:
+        return zlib.decompress(self.compressed_text).decode("utf-8")
+
+
+class DocumentKeywordIndex(Base):
+    """A document's BM25 index over its embedded chunks (services/keyword_index.py)"""
+    __tablename__ = "document_keyword_indexes"
+
+    content_hash = Column(String(64), primary_key=True)
+    chunk_count = Column(Integer, nullable=False, default=0)
+    data = Column(LargeBinary, nullable=False)  # np.savez_compressed postings
+    built_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<DocumentKeywordIndex(content_hash={self.content_hash}, chunks={self.chunk_count})>"
@@ -0,0 +1,75 @@
+from sqlalchemy import Column, String, DateTime, Integer, Text, ForeignKey
+from sqlalchemy.sql import func
+from core.database import Base
+import json
+import uuid
+
+# Pipeline stages, in order; extract, chunk and embed overlap, as do embed,
+# summarize and analyze
+INGESTION_STAGES = ("store", "extract", "chunk", "embed", "summarize", "analyze")
+
+class IngestionJob(Base):
+    """Background processing of one file uploaded to a note, with its progress.
+
+    Kept in its own table rather than on notes (tables are created, never
+    migrated); a note's latest job is its current ingestion state.
+    """
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    note_id = Column(String, ForeignKey("notes.id"), nullable=False, index=True)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    content_hash = Column(String(64), nullable=True)
+    file_name = Column(String(255), nullable=True)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, completed, failed
+    stage_states = Column(Text, nullable=False, default="{}")  # JSON: stage -> pending/running/done/skipped/failed
+    pages_extracted = Column(Integer, nullable=False, default=0)
+    chunks_created = Column(Integer, nullable=False, default=0)
+    chunks_embedded = Column(Integer, nullable=False, default=0)
+    analysis = Column(Text, nullable=True)  # JSON from analyze_document_for_quiz
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<IngestionJob(id={self.id}, note_id={self.note_id}, status={self.status})>"
+
+    @property
+    def stages(self) -> dict:
+        states = json.loads(self.stage_states or "{}")
+        return {stage: states.get(stage, "pending") for stage in INGESTION_STAGES}
+
+    def set_stage(self, stage: str, state: str):
+        states = self.stages
+        states[stage] = state
+        self.stage_states = json.dumps(states)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    @property
+    def progress(self) -> int:
+        """Percent of stages finished (done, skipped or failed)"""
+        finished = sum(state in ("done", "skipped", "failed") for state in self.stages.values())
+        return round(100 * finished / len(INGESTION_STAGES))
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "note_id": self.note_id,
+            "content_hash": self.content_hash,
+            "file_name": self.file_name,
+            "status": self.status,
+            "progress": self.progress,
+            "stages": self.stages,
+            "pages_extracted": self.pages_extracted,
+            "chunks_created": self.chunks_created,
+            "chunks_embedded": self.chunks_embedded,
+            "analysis": json.loads(self.analysis) if self.analysis else None,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,166 @@
+"""Content-addressed cache for whole-document LLM results.
+
+Summaries, quizzes, audio scripts and quiz analyses are pure functions of
+(model, prompt template, document text, parameters), so the result is stored
+under a SHA-256 of exactly those inputs. Lookups hit an in-process LRU first
+and fall back to a MongoDB collection shared by every worker; the Mongo tier
+expires entries through a TTL index and is trimmed to a maximum size. The
+index is set up once at startup (ensure_indexes); a changed TTL setting is
+applied to the existing index with collMod.
+"""
+import copy
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pymongo.errors import OperationFailure
+
+from core.config import settings
+from core.database import get_mongo_db
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "ai_response_cache"
+# Size-based eviction of the Mongo tier runs every N writes rather than on
+# each one, since it needs a count and a sorted scan.
+TRIM_EVERY_N_WRITES = 50
+# MongoDB error code for an existing index with the same keys but other options
+INDEX_OPTIONS_CONFLICT = 85
+
+
+class AIResponseCache:
+    def __init__(
+        self,
+        max_entries: int = settings.AI_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = settings.AI_CACHE_TTL_SECONDS,
+        persistent_max_entries: int = settings.AI_CACHE_PERSISTENT_MAX_ENTRIES,
+        enabled: bool = settings.AI_CACHE_ENABLED,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persistent_max_entries = persistent_max_entries
+        self.enabled = enabled
+        # key -> (stored_at monotonic seconds, value)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._writes_since_trim = 0
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, template: str, document: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """Hash the exact inputs that determine an LLM result"""
+        payload = json.dumps(
+            {"model": model, "template": template, "document": document, "params": params or {}},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _collection(self):
+        mongo_db = get_mongo_db()
+        return mongo_db[COLLECTION_NAME] if mongo_db is not None else None
+
+    async def ensure_indexes(self):
+        """Create the TTL index, or update its expiry if the setting changed (called on app startup)"""
+        mongo_db = get_mongo_db()
+        if mongo_db is None or not self.enabled:
+            return
+        try:
+            try:
+                await mongo_db[COLLECTION_NAME].create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+            except OperationFailure as e:
+                if e.code != INDEX_OPTIONS_CONFLICT:
+                    raise
+                await mongo_db.command(
+                    "collMod", COLLECTION_NAME,
+                    index={"keyPattern": {"created_at": 1}, "expireAfterSeconds": self.ttl_seconds},
+                )
+                logger.info(f"AI cache TTL changed to {self.ttl_seconds}s")
+        except Exception as e:
+            # Entries still get written; they just won't expire until this succeeds
+            logger.warning(f"Could not set up the AI cache TTL index: {e}")
+
+    def _remember(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Return a cached result, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            if time.monotonic() - stored_at < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return copy.deepcopy(value)
+            del self._entries[key]
+
+        collection = self._collection()
+        if collection is not None:
+            try:
+                doc = await collection.find_one({"_id": key})
+                if doc is not None:
+                    self.persistent_hits += 1
+                    self._remember(key, doc["value"])
+                    return copy.deepcopy(doc["value"])
+            except Exception as e:
+                logger.warning(f"AI cache lookup failed: {e}")
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any):
+        """Store a successful result in both tiers"""
+        if not self.enabled or value is None:
+            return
+
+        self._remember(key, copy.deepcopy(value))
+
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            await collection.replace_one(
+                {"_id": key},
+                {"_id": key, "value": value, "created_at": datetime.utcnow()},
+                upsert=True,
+            )
+            self._writes_since_trim += 1
+            if self._writes_since_trim >= TRIM_EVERY_N_WRITES:
+                self._writes_since_trim = 0
+                await self._trim(collection)
+        except Exception as e:
+            logger.warning(f"AI cache write failed: {e}")
+
+    async def _trim(self, collection):
+        """Drop the oldest persistent entries beyond the size cap"""
+        overflow = await collection.count_documents({}) - self.persistent_max_entries
+        if overflow <= 0:
+            return
+        oldest = await collection.find({}, {"_id": 1}).sort("created_at", 1).limit(overflow).to_list(length=overflow)
+        await collection.delete_many({"_id": {"$in": [doc["_id"] for doc in oldest]}})
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.persistent_hits + self.misses
+        hits = self.memory_hits + self.persistent_hits
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+ai_response_cache = AIResponseCache()
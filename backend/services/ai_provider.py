@@ -0,0 +1,308 @@
+"""LLM/embedding backends behind AIService and RAGService.
+
+`AI_PROVIDER` selects the backend once per worker:
+
+- "openai": the real API, through one pooled AsyncOpenAI client
+- "fake": an offline backend for load tests and CI. Output is a pure
+  function of the prompt: free-text completions, quiz JSON, audio-script
+  JSON and analysis JSON shaped like the real prompts ask for, plus
+  feature-hashed embeddings (texts sharing words land close together, so
+  retrieval still behaves). Latency and completion length are drawn from
+  configurable normal distributions, seeded by the prompt so a run is
+  reproducible.
+
+Both expose the same three coroutines (`complete`, `stream`, `embed`) and
+report token usage, so scheduling, caching and accounting upstream are
+exercised identically.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+import openai
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Usage:
+    __slots__ = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+    def __init__(self, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = (prompt_tokens or 0) + (completion_tokens or 0)
+
+
+class Completion:
+    __slots__ = ("text", "usage")
+
+    def __init__(self, text: str, usage: Optional[Usage]):
+        self.text = text
+        self.usage = usage
+
+
+class StreamDelta:
+    """A piece of streamed text; the last one carries usage for the whole stream"""
+    __slots__ = ("text", "usage")
+
+    def __init__(self, text: str = "", usage: Optional[Usage] = None):
+        self.text = text
+        self.usage = usage
+
+
+class Embeddings:
+    __slots__ = ("vectors", "usage")
+
+    def __init__(self, vectors: List[List[float]], usage: Optional[Usage]):
+        self.vectors = vectors
+        self.usage = usage
+
+
+def _usage_from(response_usage) -> Optional[Usage]:
+    if response_usage is None:
+        return None
+    return Usage(
+        getattr(response_usage, "prompt_tokens", None),
+        getattr(response_usage, "completion_tokens", None),
+    )
+
+
+class OpenAIProvider:
+    name = "openai"
+
+    def __init__(self):
+        if not settings.OPENAI_KEY:
+            logger.warning("OpenAI API key not configured")
+            self.client = None
+        else:
+            # One async client (and so one keep-alive connection pool) per worker,
+            # shared by every request. Awaiting it never blocks the event loop, so
+            # many LLM calls can be in flight alongside websocket/REST traffic.
+            self.client = openai.AsyncOpenAI(
+                api_key=settings.OPENAI_KEY,
+                timeout=settings.OPENAI_TIMEOUT_SECONDS,
+                # Retries (with rate-limit backoff) are owned by the scheduler
+                max_retries=0,
+                http_client=openai.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+                    )
+                ),
+            )
+
+    @property
+    def configured(self) -> bool:
+        return self.client is not None
+
+    async def complete(self, model: str, messages: List[Dict], max_tokens: int, temperature: float,
+                       timeout: float, request_type: str = "chat") -> Completion:
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout=timeout,
+        )
+        return Completion(response.choices[0].message.content, _usage_from(getattr(response, "usage", None)))
+
+    async def stream(self, model: str, messages: List[Dict], max_tokens: int, temperature: float,
+                     timeout: float, request_type: str = "chat") -> AsyncIterator[StreamDelta]:
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout=timeout,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            # The final chunk carries usage for the whole stream and no choices
+            usage = _usage_from(getattr(chunk, "usage", None))
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta or usage:
+                yield StreamDelta(delta or "", usage)
+
+    async def embed(self, model: str, texts: List[str]) -> Embeddings:
+        response = await self.client.embeddings.create(input=texts, model=model)
+        return Embeddings([d.embedding for d in response.data], _usage_from(getattr(response, "usage", None)))
+
+    async def close(self):
+        if self.client:
+            await self.client.close()
+
+
+_WORD = re.compile(r"[A-Za-z][A-Za-z'-]{2,}")
+_STOPWORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has have this that with from "
+    "they will would there their what about which when your said into than them then these some "
+    "could other more very been only also such like just over most make each made after".split()
+)
+
+
+class FakeProvider:
+    name = "fake"
+    configured = True
+
+    def __init__(
+        self,
+        latency_ms: float = settings.FAKE_AI_LATENCY_MS,
+        latency_jitter_ms: float = settings.FAKE_AI_LATENCY_JITTER_MS,
+        completion_tokens: int = settings.FAKE_AI_COMPLETION_TOKENS,
+        completion_tokens_jitter: int = settings.FAKE_AI_COMPLETION_TOKENS_JITTER,
+        embedding_latency_ms: float = settings.FAKE_AI_EMBEDDING_LATENCY_MS,
+        embedding_dimensions: int = settings.FAKE_AI_EMBEDDING_DIMENSIONS,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.completion_tokens = completion_tokens
+        self.completion_tokens_jitter = completion_tokens_jitter
+        self.embedding_latency_ms = embedding_latency_ms
+        self.embedding_dimensions = embedding_dimensions
+
+    # -- helpers -----------------------------------------------------------
+
+    @staticmethod
+    def _rng(*parts) -> random.Random:
+        digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    @staticmethod
+    def _tokens(text: str) -> int:
+        # Same heuristic AIService budgets with (ai_service.estimate_tokens)
+        return len(text) // 4 + 1
+
+    def _latency(self, rng: random.Random, mean_ms: float) -> float:
+        return max(0.0, rng.gauss(mean_ms, self.latency_jitter_ms)) / 1000.0
+
+    @staticmethod
+    def _keywords(text: str, limit: int = 12) -> List[str]:
+        counts: Dict[str, int] = {}
+        for word in _WORD.findall(text.lower()):
+            if word not in _STOPWORDS:
+                counts[word] = counts.get(word, 0) + 1
+        ranked = sorted(counts, key=lambda w: (-counts[w], w))
+        return ranked[:limit] or ["topic", "concept", "idea", "detail"]
+
+    def _prose(self, rng: random.Random, words: List[str], tokens: int) -> str:
+        out, length = [], 0
+        while length < tokens * 4:
+            word = rng.choice(words)
+            out.append(word)
+            length += len(word) + 1
+        sentences = [" ".join(out[i:i + 12]) for i in range(0, len(out), 12)]
+        return ". ".join(s.capitalize() for s in sentences) + "."
+
+    def _respond(self, messages: List[Dict], max_tokens: int, request_type: str, rng: random.Random) -> str:
+        system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        prompt = "\n".join(m["content"] for m in messages if m["role"] != "system")
+        keywords = self._keywords(prompt)
+
+        if request_type == "quiz":
+            match = re.search(r"Create (\d+) questions", system)
+            count = int(match.group(1)) if match else 5
+            difficulty = re.search(r"Difficulty level: (\w+)", system)
+            questions = []
+            for i in range(count):
+                subject = keywords[i % len(keywords)]
+                options = [subject] + rng.sample(keywords, min(3, len(keywords)))
+                options = (options + ["none of the above"] * 4)[:4]
+                correct = rng.randrange(4)
+                options[0], options[correct] = options[correct], options[0]
+                questions.append({
+                    "question": f"Which term does the document associate with {subject}?",
+                    "options": options,
+                    "correct_answer": correct,
+                    "explanation": f"The document discusses {subject} in this context.",
+                    "difficulty": difficulty.group(1) if difficulty else "medium",
+                })
+            return json.dumps(questions)
+
+        if request_type == "audio":
+            return json.dumps({
+                "host_script": "Welcome to the overview. " + self._prose(rng, keywords, max_tokens // 4),
+                "expert_script": "Thanks for having me. " + self._prose(rng, keywords, max_tokens // 4),
+            })
+
+        if request_type == "analysis":
+            return json.dumps({
+                "topics": keywords[:3],
+                "suggested_difficulty": rng.choice(["easy", "medium", "hard"]),
+                "estimated_questions": 5 + rng.randrange(10),
+                "key_concepts": keywords[3:8],
+            })
+
+        tokens = int(rng.gauss(self.completion_tokens, self.completion_tokens_jitter))
+        return self._prose(rng, keywords, max(1, min(tokens, max_tokens)))
+
+    # -- provider API ------------------------------------------------------
+
+    async def complete(self, model: str, messages: List[Dict], max_tokens: int, temperature: float,
+                       timeout: float, request_type: str = "chat") -> Completion:
+        rng = self._rng(model, messages, max_tokens, request_type)
+        text = self._respond(messages, max_tokens, request_type, rng)
+        await asyncio.sleep(self._latency(rng, self.latency_ms))
+        prompt_tokens = sum(self._tokens(m["content"]) for m in messages)
+        return Completion(text, Usage(prompt_tokens, self._tokens(text)))
+
+    async def stream(self, model: str, messages: List[Dict], max_tokens: int, temperature: float,
+                     timeout: float, request_type: str = "chat") -> AsyncIterator[StreamDelta]:
+        rng = self._rng(model, messages, max_tokens, request_type)
+        text = self._respond(messages, max_tokens, request_type, rng)
+        pieces = re.findall(r"\S+\s*", text)
+        # Time to first token is the sampled latency; the rest trickles out over the same span
+        await asyncio.sleep(self._latency(rng, self.latency_ms))
+        per_piece = self._latency(rng, self.latency_ms) / max(1, len(pieces))
+        for piece in pieces:
+            yield StreamDelta(piece)
+            await asyncio.sleep(per_piece)
+        prompt_tokens = sum(self._tokens(m["content"]) for m in messages)
+        yield StreamDelta("", Usage(prompt_tokens, self._tokens(text)))
+
+    def _embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.embedding_dimensions
+        for word in _WORD.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "big") % self.embedding_dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector))
+        if not norm:
+            vector[0], norm = 1.0, 1.0
+        return [v / norm for v in vector]
+
+    async def embed(self, model: str, texts: List[str]) -> Embeddings:
+        rng = self._rng(model, texts)
+        await asyncio.sleep(self._latency(rng, self.embedding_latency_ms))
+        return Embeddings(
+            [self._embed_one(text) for text in texts],
+            Usage(sum(self._tokens(text) for text in texts), 0),
+        )
+
+    async def close(self):
+        pass
+
+
+PROVIDERS = {
+    OpenAIProvider.name: OpenAIProvider,
+    FakeProvider.name: FakeProvider,
+}
+
+
+def create_provider(name: str = settings.AI_PROVIDER):
+    try:
+        provider_class = PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown AI_PROVIDER {name!r}; expected one of {sorted(PROVIDERS)}")
+    if provider_class is FakeProvider:
+        logger.warning("Using the fake AI provider: responses are synthetic")
+    return provider_class()
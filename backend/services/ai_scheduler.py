@@ -0,0 +1,257 @@
+"""Central admission control for OpenAI traffic.
+
+Every AIService and RAGService call is admitted through one scheduler per
+worker so interactive work (@chatbot replies, note Q&A) is never stuck behind
+bulk jobs (quizzes, audio scripts, summaries, embeddings):
+
+- two priority lanes; batch work only runs when no interactive request is
+  waiting, and always leaves a few concurrency slots free for interactive work
+- token buckets pace requests and tokens to the configured RPM/TPM limits
+- an AIMD concurrency window grows by ~1 per window of successes and halves
+  on a 429, pausing admissions for the server's Retry-After
+- rate-limit, timeout and 5xx failures are retried with jittered backoff
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import openai
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class TokenBucket:
+    """Refills continuously at `per_minute / 60` units per second up to `per_minute`"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (0 if they are now)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount: float):
+        self.available -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("future", "tokens")
+
+    def __init__(self, future: asyncio.Future, tokens: int):
+        self.future = future
+        self.tokens = tokens
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, from Retry-After(-ms) headers"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class AIScheduler:
+    def __init__(
+        self,
+        requests_per_minute: int = settings.AI_SCHEDULER_RPM,
+        tokens_per_minute: int = settings.AI_SCHEDULER_TPM,
+        max_concurrency: int = settings.AI_SCHEDULER_MAX_CONCURRENCY,
+        min_concurrency: int = settings.AI_SCHEDULER_MIN_CONCURRENCY,
+        interactive_reserve: int = settings.AI_SCHEDULER_INTERACTIVE_RESERVE,
+        max_retries: int = settings.OPENAI_MAX_RETRIES,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ):
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.interactive_reserve = interactive_reserve
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._window = float(max(min_concurrency, max_concurrency // 2))
+        self._in_flight = 0
+        self._queues: Dict[str, deque] = {INTERACTIVE: deque(), BATCH: deque()}
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._wakeup_at = 0.0
+
+        self.rate_limited = 0
+        self.retries = 0
+        self.completed = 0
+
+    # -- admission ---------------------------------------------------------
+
+    def _limit_for(self, priority: str) -> int:
+        window = max(1, int(self._window))
+        if priority == BATCH:
+            return max(1, window - self.interactive_reserve)
+        return window
+
+    def _schedule_wakeup(self, delay: float):
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        if self._wakeup is not None and not self._wakeup.cancelled() and self._wakeup_at <= when:
+            return
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup_at = when
+        self._wakeup = loop.call_at(when, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grant slots to waiters in priority order while limits allow"""
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                self._schedule_wakeup(self._paused_until - now)
+                return
+
+            priority = None
+            for lane in (INTERACTIVE, BATCH):
+                queue = self._queues[lane]
+                while queue and queue[0].future.done():
+                    queue.popleft()  # cancelled while waiting
+                if queue:
+                    priority = lane
+                    break
+            if priority is None:
+                return
+            if self._in_flight >= self._limit_for(priority):
+                return
+
+            waiter = self._queues[priority][0]
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(waiter.tokens, now))
+            if wait > 0:
+                self._schedule_wakeup(wait)
+                return
+
+            self._queues[priority].popleft()
+            self._requests.take(1)
+            self._tokens.take(waiter.tokens)
+            self._in_flight += 1
+            waiter.future.set_result(None)
+
+    async def _acquire(self, priority: str, tokens: int):
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].append(_Waiter(future, tokens))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: give the slot back
+                self._release()
+            raise
+
+    def _release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    # -- feedback ----------------------------------------------------------
+
+    def _on_success(self):
+        self.completed += 1
+        self._window = min(float(self.max_concurrency), self._window + 1.0 / self._window)
+
+    def _on_rate_limited(self, retry_after: Optional[float]):
+        self.rate_limited += 1
+        now = time.monotonic()
+        # A burst of 429s from one overload should only halve the window once
+        if now - self._last_decrease > 1.0:
+            self._window = max(float(self.min_concurrency), self._window / 2)
+            self._last_decrease = now
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+        logger.warning(f"OpenAI rate limited; concurrency window now {self._window:.1f}")
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        # Full jitter so retries from many callers don't synchronise
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, _retry_after(error) or 0.0)
+
+    # -- public API --------------------------------------------------------
+
+    @asynccontextmanager
+    async def slot(self, priority: str = INTERACTIVE, estimated_tokens: int = 0):
+        """Hold one admission slot for the duration of the block (used for streams)"""
+        await self._acquire(priority, estimated_tokens)
+        try:
+            yield
+        except openai.RateLimitError as e:
+            self._on_rate_limited(_retry_after(e))
+            raise
+        else:
+            self._on_success()
+        finally:
+            self._release()
+
+    async def run(self, fn: Callable[[], Awaitable[Any]], priority: str = INTERACTIVE, estimated_tokens: int = 0) -> Any:
+        """Admit, run and (on transient failures) retry one OpenAI call"""
+        attempt = 0
+        while True:
+            try:
+                async with self.slot(priority, estimated_tokens):
+                    return await fn()
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                attempt += 1
+                self.retries += 1
+                logger.info(f"Retrying {priority} OpenAI call in {delay:.2f}s after {type(e).__name__}")
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency_window": round(self._window, 2),
+            "in_flight": self._in_flight,
+            "waiting": {lane: len(queue) for lane, queue in self._queues.items()},
+            "completed": self.completed,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+        }
+
+
+ai_scheduler = AIScheduler()
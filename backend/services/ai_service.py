@@ -1,29 +1,194 @@
-import openai
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 from core.config import settings
+from services.ai_cache import ai_response_cache
+from services.single_flight import SingleFlight
+from services.ai_scheduler import ai_scheduler, INTERACTIVE, BATCH
+from services.ai_usage import ai_usage, AIQuotaExceeded
+from services.ai_provider import create_provider
+from services.extraction import extract_document_pages, iter_document_pages
+from services.extractors import UnsupportedDocument, resolve_format
+import asyncio
 import logging
 import json
 import re
+import time
+import zlib
 
 logger = logging.getLogger(__name__)
 
+# Rough chars-per-token ratio for English prose; good enough for budgeting
+# prompt sizes without pulling in a tokenizer.
+CHARS_PER_TOKEN = 4
+
+# generate_document_summary returns these instead of raising; they are not summaries
+SUMMARY_NOT_CONFIGURED = "AI service is not configured. Please set OPENAI_KEY in environment."
+SUMMARY_UNAVAILABLE = "Unable to generate summary at this time."
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used to size prompts"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def split_into_sections(text: str, budget_tokens: int) -> List[str]:
+    """Split text into sections of at most ~budget_tokens on paragraph boundaries.
+
+    Boundaries are content-defined: once a section is at least half full, it
+    also closes after any paragraph whose checksum hits a fixed pattern. An
+    edit therefore only reshapes the sections around it, and the rest keep
+    the same text (and so the same cached section summary).
+    """
+    budget_chars = budget_tokens * CHARS_PER_TOKEN
+    paragraphs = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        # Hard-split paragraphs that are bigger than a whole section
+        while len(paragraph) > budget_chars:
+            paragraphs.append(paragraph[:budget_chars])
+            paragraph = paragraph[budget_chars:]
+        if paragraph:
+            paragraphs.append(paragraph)
+
+    sections = []
+    current = []
+    size = 0
+    for paragraph in paragraphs:
+        if current and size + len(paragraph) > budget_chars:
+            sections.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += len(paragraph) + 2
+        if size >= budget_chars // 2 and zlib.crc32(paragraph.encode("utf-8")) % 4 == 0:
+            sections.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        sections.append("\n\n".join(current))
+    return sections
+
 class AIService:
     def __init__(self):
-        if not settings.OPENAI_KEY:
-            logger.warning("OpenAI API key not configured")
-            self.client = None
-        else:
-            self.client = openai.OpenAI(api_key=settings.OPENAI_KEY)
+        # OpenAI, or the offline fake backend for load tests (AI_PROVIDER)
+        self.provider = create_provider()
         self.model = settings.OPENAI_MODEL
         self.max_tokens = settings.OPENAI_MAX_TOKENS
         self.temperature = settings.OPENAI_TEMPERATURE
+        self.timeout = settings.OPENAI_TIMEOUT_SECONDS
+        self.batch_timeout = settings.OPENAI_BATCH_TIMEOUT_SECONDS
+        self.cache = ai_response_cache
+        self.flight = SingleFlight()
+        self.scheduler = ai_scheduler
+        self.usage = ai_usage
     
     def _check_configured(self):
         """Check if AI service is properly configured"""
-        if not self.client or not settings.OPENAI_KEY:
+        if not self.provider.configured:
             logger.error("AI service is not configured")
             return False
         return True
+
+    async def _chat_completion(self, messages: List[Dict], **kwargs) -> str:
+        """Run one chat completion through the scheduler and return the stripped text"""
+        text, _usage = await self._chat_completion_with_usage(messages, **kwargs)
+        return text
+
+    async def _chat_completion_with_usage(
+        self,
+        messages: List[Dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        timeout: Optional[float] = None,
+        priority: str = INTERACTIVE,
+        request_type: str = "chat",
+    ) -> tuple:
+        """Like _chat_completion, also returning tokens_used/processing_time/model_used"""
+        self.usage.check_quota()
+        max_tokens = max_tokens or self.max_tokens
+        started = time.perf_counter()
+        completion = await self.scheduler.run(
+            lambda: self.provider.complete(
+                self.model,
+                messages,
+                max_tokens=max_tokens,
+                temperature=self.temperature if temperature is None else temperature,
+                timeout=timeout or self.timeout,
+                request_type=request_type,
+            ),
+            priority=priority,
+            estimated_tokens=self._estimate_request_tokens(messages, max_tokens),
+        )
+        elapsed = time.perf_counter() - started
+        self.usage.record_completion(
+            self.provider.name, self.model, request_type, completion.usage, elapsed,
+            estimated_prompt_tokens=self._estimate_request_tokens(messages, 0),
+        )
+        usage = {
+            "tokens_used": completion.usage.total_tokens if completion.usage else None,
+            "processing_time": round(elapsed, 3),
+            "model_used": self.model,
+        }
+        return completion.text.strip(), usage
+
+    async def _stream_chat_completion(
+        self,
+        messages: List[Dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        timeout: Optional[float] = None,
+        request_type: str = "chat",
+    ) -> AsyncIterator[str]:
+        """Run one streaming chat completion, yielding text deltas as they arrive"""
+        self.usage.check_quota()
+        max_tokens = max_tokens or self.max_tokens
+        started = time.perf_counter()
+        usage = None
+        completion_chars = 0
+        # The slot is held until the stream finishes, since the request is still
+        # occupying capacity at OpenAI while tokens arrive
+        async with self.scheduler.slot(INTERACTIVE, self._estimate_request_tokens(messages, max_tokens)):
+            async for delta in self.provider.stream(
+                self.model,
+                messages,
+                max_tokens=max_tokens,
+                temperature=self.temperature if temperature is None else temperature,
+                timeout=timeout or self.timeout,
+                request_type=request_type,
+            ):
+                usage = delta.usage or usage
+                if delta.text:
+                    completion_chars += len(delta.text)
+                    yield delta.text
+        self.usage.record_completion(
+            self.provider.name, self.model, request_type, usage, time.perf_counter() - started,
+            estimated_prompt_tokens=self._estimate_request_tokens(messages, 0),
+            estimated_completion_tokens=completion_chars // CHARS_PER_TOKEN,
+        )
+
+    async def embed(self, texts: List[str], model: str, priority: str = BATCH) -> List[List[float]]:
+        """Embed texts through the scheduler, recording usage"""
+        self.usage.check_quota()
+        estimated = sum(estimate_tokens(text) for text in texts)
+        started = time.perf_counter()
+        embeddings = await self.scheduler.run(
+            lambda: self.provider.embed(model, texts),
+            priority=priority,
+            estimated_tokens=estimated,
+        )
+        self.usage.record_completion(
+            self.provider.name, model, "embedding", embeddings.usage, time.perf_counter() - started,
+            estimated_prompt_tokens=estimated,
+        )
+        return embeddings.vectors
+
+    @staticmethod
+    def _estimate_request_tokens(messages: List[Dict], max_tokens: int) -> int:
+        """Prompt estimate plus the completion allowance, for TPM pacing"""
+        return sum(estimate_tokens(m.get("content", "")) for m in messages) + max_tokens
+
+    def _cache_key(self, kind: str, system_message: str, document_content: str, **params) -> str:
+        """Content-addressed key for a document job: model, template, text and parameters"""
+        return self.cache.make_key(self.model, f"{kind}:{system_message}", document_content, params)
+
+    async def close(self):
+        """Release the pooled HTTP connections (called on app shutdown)"""
+        await self.provider.close()
     
     async def get_chatbot_response(self, question: str, context: str = "", chat_history: List[Dict] = None) -> str:
         """Get AI chatbot response for a question"""
@@ -54,14 +219,7 @@ class AIService:
             messages.append({"role": "user", "content": question})
             
             # Get response from OpenAI
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
-            )
-            
-            return response.choices[0].message.content.strip()
+            return await self._chat_completion(messages)
             
         except Exception as e:
             logger.error(f"Error getting chatbot response: {e}")
@@ -71,34 +229,116 @@ class AIService:
         """Generate a summary of uploaded document"""
         try:
             if not self._check_configured():
-                return "AI service is not configured. Please set OPENAI_KEY in environment."
+                return SUMMARY_NOT_CONFIGURED
             
             system_message = """You are an expert at summarizing documents. 
             Provide a clear, concise summary of the key points and main ideas from the document.
             Focus on the most important information that would be useful for learning and discussion."""
             
-            messages = [
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": f"Please summarize this document:\n\n{document_content}"}
-            ]
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=self.max_tokens,
-                temperature=0.3  # Lower temperature for more focused summaries
-            )
-            
-            return response.choices[0].message.content.strip()
+            cache_key = self._cache_key("summary", system_message, document_content, temperature=0.3, max_tokens=self.max_tokens)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
+            async def run():
+                # Documents too large for one prompt go through map-reduce
+                if estimate_tokens(document_content) > settings.SUMMARY_SINGLE_PASS_TOKENS:
+                    summary = await self._map_reduce_summary(document_content)
+                    await self.cache.set(cache_key, summary)
+                    return summary
+                
+                messages = [
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": f"Please summarize this document:\n\n{document_content}"}
+                ]
+                
+                summary = await self._chat_completion(
+                    messages,
+                    temperature=0.3,  # Lower temperature for more focused summaries
+                    timeout=self.batch_timeout,
+                    priority=BATCH,
+                    request_type="summary"
+                )
+                await self.cache.set(cache_key, summary)
+                return summary
+            
+            # Identical concurrent jobs share one in-flight call
+            return await self.flight.do(cache_key, run)
             
         except Exception as e:
             logger.error(f"Error generating document summary: {e}")
-            return "Unable to generate summary at this time."
+            return SUMMARY_UNAVAILABLE
+    
+    async def _summarize_part(self, kind: str, system_message: str, text: str, semaphore: asyncio.Semaphore) -> str:
+        """Summarize one section (or group of partial summaries), reusing a stored result for unchanged text"""
+        cache_key = self._cache_key(kind, system_message, text, temperature=0.3, max_tokens=self.max_tokens)
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        async with semaphore:
+            summary = await self._chat_completion(
+                [
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": text}
+                ],
+                temperature=0.3,
+                timeout=self.batch_timeout,
+                priority=BATCH,
+                request_type="summary"
+            )
+        await self.cache.set(cache_key, summary)
+        return summary
+    
+    @staticmethod
+    async def _pass_through(summary: str) -> str:
+        return summary
+    
+    async def _map_reduce_summary(self, document_content: str) -> str:
+        """Summarize a document larger than one prompt: sections in parallel, then a reduction tree"""
+        section_prompt = """You are summarizing one section of a longer document.
+        Capture the key points, definitions and facts in this section as a dense summary.
+        Do not add an introduction or refer to "this section"."""
+        reduce_prompt = """You are combining summaries of consecutive sections of one document.
+        Merge them into a single clear, concise summary of the key points and main ideas,
+        keeping the information that would be useful for learning and discussion."""
+        
+        budget = settings.SUMMARY_SECTION_TOKENS
+        semaphore = asyncio.Semaphore(settings.SUMMARY_MAX_PARALLEL)
+        
+        sections = split_into_sections(document_content, budget)
+        logger.info(f"Map-reduce summary over {len(sections)} sections")
+        partials = await asyncio.gather(*[
+            self._summarize_part("section_summary", section_prompt, section, semaphore)
+            for section in sections
+        ])
+        
+        # Reduce level by level, packing as many partial summaries into each
+        # prompt as the budget allows (always at least two, so the tree shrinks)
+        while len(partials) > 1:
+            groups = []
+            current = []
+            size = 0
+            for partial in partials:
+                tokens = estimate_tokens(partial)
+                if len(current) >= 2 and size + tokens > budget:
+                    groups.append(current)
+                    current, size = [], 0
+                current.append(partial)
+                size += tokens
+            groups.append(current)
+            partials = await asyncio.gather(*[
+                self._summarize_part("reduce_summary", reduce_prompt, "\n\n".join(group), semaphore)
+                if len(group) > 1 else self._pass_through(group[0])
+                for group in groups
+            ])
+        
+        return partials[0]
     
     async def generate_quiz_questions(self, document_content: str, num_questions: int = 10, difficulty: str = "medium") -> List[Dict]:
         """Generate MCQ quiz questions from document content"""
         try:
-            if not settings.OPENAI_KEY:
+            if not self._check_configured():
                 return []
             
             system_message = f"""You are an expert at creating multiple choice questions for educational purposes.
@@ -118,45 +358,57 @@ class AIService:
             - explanation: brief explanation
             - difficulty: the difficulty level"""
             
-            messages = [
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": f"Generate quiz questions from this document:\n\n{document_content}"}
-            ]
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=self.max_tokens * 2,  # More tokens for quiz generation
-                temperature=0.7
-            )
+            cache_key = self._cache_key("quiz", system_message, document_content, temperature=0.7, max_tokens=self.max_tokens * 2)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                return cached
             
-            # Parse JSON response
-            try:
-                content = response.choices[0].message.content.strip()
-                # Extract JSON from response (in case there's extra text)
-                json_match = re.search(r'\[.*\]', content, re.DOTALL)
-                if json_match:
-                    questions = json.loads(json_match.group())
-                else:
-                    questions = json.loads(content)
-                
-                # Validate and clean questions
-                cleaned_questions = []
-                for q in questions:
-                    if isinstance(q, dict) and 'question' in q and 'options' in q and 'correct_answer' in q:
-                        cleaned_questions.append({
-                            'question': q['question'],
-                            'options': q['options'][:4],  # Ensure exactly 4 options
-                            'correct_answer': min(q['correct_answer'], 3),  # Ensure valid index
-                            'explanation': q.get('explanation', ''),
-                            'difficulty': q.get('difficulty', difficulty)
-                        })
+            async def run():
+                messages = [
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": f"Generate quiz questions from this document:\n\n{document_content}"}
+                ]
                 
-                return cleaned_questions[:num_questions]  # Ensure correct number
+                content = await self._chat_completion(
+                    messages,
+                    max_tokens=self.max_tokens * 2,  # More tokens for quiz generation
+                    temperature=0.7,
+                    timeout=self.batch_timeout,
+                    priority=BATCH,
+                    request_type="quiz"
+                )
                 
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing quiz JSON: {e}")
-                return []
+                # Parse JSON response
+                try:
+                    # Extract JSON from response (in case there's extra text)
+                    json_match = re.search(r'\[.*\]', content, re.DOTALL)
+                    if json_match:
+                        questions = json.loads(json_match.group())
+                    else:
+                        questions = json.loads(content)
+                    
+                    # Validate and clean questions
+                    cleaned_questions = []
+                    for q in questions:
+                        if isinstance(q, dict) and 'question' in q and 'options' in q and 'correct_answer' in q:
+                            cleaned_questions.append({
+                                'question': q['question'],
+                                'options': q['options'][:4],  # Ensure exactly 4 options
+                                'correct_answer': min(q['correct_answer'], 3),  # Ensure valid index
+                                'explanation': q.get('explanation', ''),
+                                'difficulty': q.get('difficulty', difficulty)
+                            })
+                    
+                    cleaned_questions = cleaned_questions[:num_questions]  # Ensure correct number
+                    if cleaned_questions:
+                        await self.cache.set(cache_key, cleaned_questions)
+                    return cleaned_questions
+                    
+                except json.JSONDecodeError as e:
+                    logger.error(f"Error parsing quiz JSON: {e}")
+                    return []
+            
+            return await self.flight.do(cache_key, run)
             
         except Exception as e:
             logger.error(f"Error generating quiz questions: {e}")
@@ -165,7 +417,7 @@ class AIService:
     async def generate_audio_overview_script(self, document_content: str) -> Dict[str, str]:
         """Generate a podcast-style audio overview script"""
         try:
-            if not settings.OPENAI_KEY:
+            if not self._check_configured():
                 return {
                     "host_script": "AI service is not configured.",
                     "expert_script": "Please set OPENAI_KEY in environment."
@@ -190,38 +442,50 @@ class AIService:
             
             Make it engaging, educational, and conversational."""
             
-            messages = [
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": f"Create a podcast overview of this document:\n\n{document_content}"}
-            ]
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=self.max_tokens * 2,
-                temperature=0.8
-            )
+            cache_key = self._cache_key("audio_script", system_message, document_content, temperature=0.8, max_tokens=self.max_tokens * 2)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                return cached
             
-            # Parse JSON response
-            try:
-                content = response.choices[0].message.content.strip()
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    script = json.loads(json_match.group())
-                else:
-                    script = json.loads(content)
+            async def run():
+                messages = [
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": f"Create a podcast overview of this document:\n\n{document_content}"}
+                ]
                 
-                return {
-                    "host_script": script.get("host_script", "Host script not generated."),
-                    "expert_script": script.get("expert_script", "Expert script not generated.")
-                }
+                content = await self._chat_completion(
+                    messages,
+                    max_tokens=self.max_tokens * 2,
+                    temperature=0.8,
+                    timeout=self.batch_timeout,
+                    priority=BATCH,
+                    request_type="audio"
+                )
                 
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing audio script JSON: {e}")
-                return {
-                    "host_script": "Error generating host script.",
-                    "expert_script": "Error generating expert script."
-                }
+                # Parse JSON response
+                try:
+                    json_match = re.search(r'\{.*\}', content, re.DOTALL)
+                    if json_match:
+                        script = json.loads(json_match.group())
+                    else:
+                        script = json.loads(content)
+                    
+                    result = {
+                        "host_script": script.get("host_script", "Host script not generated."),
+                        "expert_script": script.get("expert_script", "Expert script not generated.")
+                    }
+                    if "host_script" in script and "expert_script" in script:
+                        await self.cache.set(cache_key, result)
+                    return result
+                    
+                except json.JSONDecodeError as e:
+                    logger.error(f"Error parsing audio script JSON: {e}")
+                    return {
+                        "host_script": "Error generating host script.",
+                        "expert_script": "Error generating expert script."
+                    }
+            
+            return await self.flight.do(cache_key, run)
             
         except Exception as e:
             logger.error(f"Error generating audio overview script: {e}")
@@ -230,56 +494,110 @@ class AIService:
                 "expert_script": "Please try again later."
             }
     
-    async def generate_group_chat_response(self, message: str, chat_history: List[Dict] = None, room_id: str = None, user_id: str = None) -> Dict[str, str]:
+    def _build_group_chat_messages(self, message: str, chat_history: List[Dict] = None, room_id: str = None, context_summary: str = None) -> List[Dict]:
+        """Build the prompt shared by the blocking and streaming group chat paths"""
+        # Prepare system message for group chat context
+        system_message = """You are an AI assistant in a collaborative learning environment. 
+        You help users with their questions and discussions in group chats.
+        Be helpful, educational, and engaging. Keep responses concise but informative.
+        If you don't know something, say so and suggest where they might find the information."""
+        
+        # Add room context if available
+        if room_id:
+            system_message += f"\n\nYou are in room: {room_id}"
+        
+        # Older conversation arrives pre-condensed from the topic context store
+        if context_summary:
+            system_message += f"\n\nSummary of the earlier conversation in this topic:\n{context_summary}"
+        
+        # Prepare messages
+        messages = [{"role": "system", "content": system_message}]
+        
+        # Add recent chat history for context
+        if chat_history:
+            for msg in chat_history[-settings.TOPIC_CONTEXT_RECENT_MESSAGES:]:
+                if msg.get("is_ai"):
+                    messages.append({"role": "assistant", "content": msg.get("content", "")})
+                elif msg.get("user_name"):
+                    messages.append({"role": "user", "content": f"{msg['user_name']}: {msg.get('content', '')}"})
+                else:
+                    messages.append({"role": "user", "content": msg.get("content", "")})
+        
+        # Add current message
+        messages.append({"role": "user", "content": message})
+        return messages
+    
+    async def generate_group_chat_response(self, message: str, chat_history: List[Dict] = None, room_id: str = None, user_id: str = None, context_summary: str = None) -> Dict[str, str]:
         """Generate AI response for group chat messages"""
         try:
-            if not settings.OPENAI_KEY:
+            if not self._check_configured():
                 return {"response": "AI service is not configured. Please set OPENAI_KEY in environment."}
             
-            # Prepare system message for group chat context
-            system_message = """You are an AI assistant in a collaborative learning environment. 
-            You help users with their questions and discussions in group chats.
-            Be helpful, educational, and engaging. Keep responses concise but informative.
-            If you don't know something, say so and suggest where they might find the information."""
+            messages = self._build_group_chat_messages(message, chat_history, room_id, context_summary)
             
-            # Add room context if available
-            if room_id:
-                system_message += f"\n\nYou are in room: {room_id}"
-            
-            # Prepare messages
-            messages = [{"role": "system", "content": system_message}]
-            
-            # Add recent chat history for context (last 5 messages)
-            if chat_history:
-                for msg in chat_history[-5:]:
-                    if msg.get("is_ai"):
-                        messages.append({"role": "assistant", "content": msg.get("content", "")})
-                    else:
-                        messages.append({"role": "user", "content": msg.get("content", "")})
-            
-            # Add current message
-            messages.append({"role": "user", "content": message})
-            
-            # Get response from OpenAI
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
+            # Several members asking the same thing at once share one completion
+            flight_key = self.cache.make_key(self.model, "group_chat", json.dumps(messages))
+            ai_response, usage = await self.flight.do(
+                flight_key, lambda: self._chat_completion_with_usage(messages)
             )
             
-            ai_response = response.choices[0].message.content.strip()
-            
-            return {"response": ai_response}
+            return {"response": ai_response, **usage}
             
+        except AIQuotaExceeded as e:
+            return {"response": e.detail}
         except Exception as e:
             logger.error(f"Error generating group chat response: {e}")
             return {"response": "Sorry, I'm having trouble processing your request right now."}
     
+    async def stream_group_chat_response(self, message: str, chat_history: List[Dict] = None, room_id: str = None, user_id: str = None, context_summary: str = None) -> AsyncIterator[str]:
+        """Yield the group chat answer piece by piece as the model generates it"""
+        if not self._check_configured():
+            yield "AI service is not configured. Please set OPENAI_KEY in environment."
+            return
+        
+        produced = False
+        try:
+            messages = self._build_group_chat_messages(message, chat_history, room_id, context_summary)
+            async for delta in self._stream_chat_completion(messages):
+                produced = True
+                yield delta
+        except AIQuotaExceeded as e:
+            yield e.detail
+        except Exception as e:
+            logger.error(f"Error streaming group chat response: {e}")
+            # Only apologise if nothing reached the room yet; otherwise keep the partial answer
+            if not produced:
+                yield "Sorry, I'm having trouble processing your request right now."
+    
+    async def summarize_chat_context(self, previous_summary: str, messages: List[Dict]) -> str:
+        """Fold a batch of older chat messages into the running summary of a topic"""
+        if not self._check_configured():
+            raise RuntimeError("AI service is not configured")
+        
+        system_message = """You maintain a running summary of a group study chat so an assistant can follow the conversation.
+        Merge the new messages into the existing summary. Keep who asked or decided what, open questions,
+        and key facts. Drop greetings and small talk. Write at most 150 words of plain prose."""
+        
+        transcript = "\n".join(
+            f"{'AI Assistant' if msg.get('is_ai') else msg.get('user_name') or 'User'}: {msg.get('content', '')}"
+            for msg in messages
+        )
+        return await self._chat_completion(
+            [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": f"Existing summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"}
+            ],
+            max_tokens=300,
+            temperature=0.2,
+            timeout=self.batch_timeout,
+            priority=BATCH,
+            request_type="chat_summary"
+        )
+    
     async def analyze_document_for_quiz(self, document_content: str) -> Dict[str, Any]:
         """Analyze document to determine suitable quiz topics and difficulty"""
         try:
-            if not settings.OPENAI_KEY:
+            if not self._check_configured():
                 return {"topics": [], "suggested_difficulty": "medium", "estimated_questions": 5}
             
             system_message = """Analyze this document to determine:
@@ -293,37 +611,47 @@ class AIService:
             - estimated_questions: number of questions that can be generated
             - key_concepts: array of important concepts"""
             
-            messages = [
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": f"Analyze this document:\n\n{document_content}"}
-            ]
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=self.max_tokens,
-                temperature=0.3
-            )
+            cache_key = self._cache_key("quiz_analysis", system_message, document_content, temperature=0.3, max_tokens=self.max_tokens)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                return cached
             
-            # Parse JSON response
-            try:
-                content = response.choices[0].message.content.strip()
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    analysis = json.loads(json_match.group())
-                else:
-                    analysis = json.loads(content)
+            async def run():
+                messages = [
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": f"Analyze this document:\n\n{document_content}"}
+                ]
                 
-                return {
-                    "topics": analysis.get("topics", []),
-                    "suggested_difficulty": analysis.get("suggested_difficulty", "medium"),
-                    "estimated_questions": analysis.get("estimated_questions", 5),
-                    "key_concepts": analysis.get("key_concepts", [])
-                }
+                content = await self._chat_completion(
+                    messages,
+                    temperature=0.3,
+                    timeout=self.batch_timeout,
+                    priority=BATCH,
+                    request_type="analysis"
+                )
                 
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing document analysis JSON: {e}")
-                return {"topics": [], "suggested_difficulty": "medium", "estimated_questions": 5}
+                # Parse JSON response
+                try:
+                    json_match = re.search(r'\{.*\}', content, re.DOTALL)
+                    if json_match:
+                        analysis = json.loads(json_match.group())
+                    else:
+                        analysis = json.loads(content)
+                    
+                    result = {
+                        "topics": analysis.get("topics", []),
+                        "suggested_difficulty": analysis.get("suggested_difficulty", "medium"),
+                        "estimated_questions": analysis.get("estimated_questions", 5),
+                        "key_concepts": analysis.get("key_concepts", [])
+                    }
+                    await self.cache.set(cache_key, result)
+                    return result
+                    
+                except json.JSONDecodeError as e:
+                    logger.error(f"Error parsing document analysis JSON: {e}")
+                    return {"topics": [], "suggested_difficulty": "medium", "estimated_questions": 5}
+            
+            return await self.flight.do(cache_key, run)
             
         except Exception as e:
             logger.error(f"Error analyzing document: {e}")
@@ -332,56 +660,26 @@ class AIService:
     async def extract_text_from_document(self, file_content: bytes, file_type: str) -> str:
         """Extract text content from uploaded document"""
         try:
-            if file_type.lower() == "pdf":
-                return await self._extract_text_from_pdf(file_content)
-            elif file_type.lower() in ["doc", "docx"]:
-                return await self._extract_text_from_word(file_content)
-            elif file_type.lower() == "txt":
-                return file_content.decode('utf-8', errors='ignore')
-            else:
-                return "Unsupported file type for text extraction."
-                
+            return "\n".join(await self.extract_pages_from_document(file_content, file_type)).strip()
+        except UnsupportedDocument:
+            return "Unsupported file type for text extraction."
         except Exception as e:
             logger.error(f"Error extracting text from document: {e}")
             return "Error extracting text from document."
-    
-    async def _extract_text_from_pdf(self, file_content: bytes) -> str:
-        """Extract text from PDF file"""
-        try:
-            import PyPDF2
-            from io import BytesIO
-            
-            pdf_file = BytesIO(file_content)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            
-            return text.strip()
-            
-        except Exception as e:
-            logger.error(f"Error extracting text from PDF: {e}")
-            return "Error extracting text from PDF file."
-    
-    async def _extract_text_from_word(self, file_content: bytes) -> str:
-        """Extract text from Word document"""
-        try:
-            from docx import Document
-            from io import BytesIO
-            
-            doc_file = BytesIO(file_content)
-            doc = Document(doc_file)
-            
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            
-            return text.strip()
-            
-        except Exception as e:
-            logger.error(f"Error extracting text from Word document: {e}")
-            return "Error extracting text from Word document."
+
+    async def extract_pages_from_document(self, file_content: bytes, file_type: str) -> List[str]:
+        """Extract text per page (PDF) or as a single page (Word, plain text, Markdown).
+
+        Raises UnsupportedDocument (a ValueError) for unknown types and lets
+        parser errors propagate, so callers that persist the result never
+        store an error message as document text.
+        """
+        return await extract_document_pages(file_content, resolve_format(file_type))
+
+    async def iter_document_pages(self, file_path: str, file_type: str) -> AsyncIterator[Tuple[int, str]]:
+        """Yield `(page_no, text)` as pages are parsed"""
+        async for page in iter_document_pages(file_path, resolve_format(file_type)):
+            yield page
 
 # Global AI service instance
 ai_service = AIService() 
\ No newline at end of file
@@ -0,0 +1,323 @@
+"""Token, latency and quota accounting for all AI traffic.
+
+Every OpenAI and ElevenLabs call reports its usage here. Recording only
+touches in-process counters; one AIResponse document per call is buffered
+and written to Mongo in batches by a background flusher, so accounting adds
+no database round trip to the request path.
+
+Who a call is attributed to comes from `usage_scope()`, a context variable
+set by the endpoint that triggered the work, so services don't have to
+thread user/room ids through every signature. Per-user and per-room daily
+token quotas are enforced from the same counters (per worker, reset at UTC
+midnight).
+"""
+import asyncio
+import contextvars
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, status
+
+from core.config import settings
+from core.database import get_mongo_db
+from models.mongodb.ai_response import AIResponse
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "ai_responses"
+
+_scope: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("ai_usage_scope", default={})
+
+
+class AIQuotaExceeded(HTTPException):
+    """Raised when a user or room is over its hard daily AI token quota"""
+
+    def __init__(self, kind: str, used: int, limit: int):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Daily AI usage limit reached for this {kind} ({used}/{limit} tokens)",
+        )
+        self.kind = kind
+
+
+@contextmanager
+def usage_scope(**attributes):
+    """Attribute AI calls made inside the block to a user/room/topic/document
+
+    Attributes merge over the enclosing scope; pass None to clear one.
+    """
+    token = _scope.set({**_scope.get(), **attributes})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_scope() -> Dict[str, Any]:
+    return _scope.get()
+
+
+class _Totals:
+    __slots__ = ("calls", "prompt_tokens", "completion_tokens", "characters", "latency_total", "latency_max")
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.characters = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def add(self, prompt_tokens: int, completion_tokens: int, characters: int, latency: float):
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.characters += characters
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "characters": self.characters,
+            "avg_latency": round(self.latency_total / self.calls, 3) if self.calls else 0.0,
+            "max_latency": round(self.latency_max, 3),
+        }
+
+
+class AIUsageTracker:
+    def __init__(
+        self,
+        user_soft_limit: int = settings.AI_QUOTA_USER_SOFT_TOKENS,
+        user_hard_limit: int = settings.AI_QUOTA_USER_HARD_TOKENS,
+        room_soft_limit: int = settings.AI_QUOTA_ROOM_SOFT_TOKENS,
+        room_hard_limit: int = settings.AI_QUOTA_ROOM_HARD_TOKENS,
+        flush_batch_size: int = settings.AI_USAGE_FLUSH_BATCH_SIZE,
+        flush_interval: float = settings.AI_USAGE_FLUSH_INTERVAL_SECONDS,
+    ):
+        self.limits = {
+            "user": (user_soft_limit, user_hard_limit),
+            "room": (room_soft_limit, room_hard_limit),
+        }
+        self.flush_batch_size = flush_batch_size
+        self.flush_interval = flush_interval
+
+        # (provider, model, request_type) -> totals since startup
+        self._totals: Dict[tuple, _Totals] = defaultdict(_Totals)
+        # Tokens spent today, for quotas
+        self._day = self._today()
+        self._daily: Dict[str, Dict[str, int]] = {"user": defaultdict(int), "room": defaultdict(int)}
+        self._soft_warned: set = set()
+
+        self._buffer: List[Dict[str, Any]] = []
+        self._flushing: Optional[asyncio.Task] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self.flushed = 0
+        self.dropped = 0
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.utcnow().strftime("%Y-%m-%d")
+
+    def _roll_day(self):
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._daily = {"user": defaultdict(int), "room": defaultdict(int)}
+            self._soft_warned.clear()
+
+    # -- quotas ------------------------------------------------------------
+
+    def check_quota(self, user_id: Optional[str] = None, room_id: Optional[str] = None) -> bool:
+        """Raise AIQuotaExceeded past a hard limit; return True if only over a soft one"""
+        scope = _scope.get()
+        user_id = user_id or scope.get("user_id")
+        room_id = room_id or scope.get("room_id")
+        self._roll_day()
+
+        over_soft = False
+        for kind, key in (("user", user_id), ("room", room_id)):
+            if not key:
+                continue
+            soft, hard = self.limits[kind]
+            used = self._daily[kind].get(key, 0)
+            if hard and used >= hard:
+                raise AIQuotaExceeded(kind, used, hard)
+            if soft and used >= soft:
+                over_soft = True
+                if (kind, key) not in self._soft_warned:
+                    self._soft_warned.add((kind, key))
+                    logger.warning(f"AI usage for {kind} {key} passed the soft quota ({used}/{soft} tokens)")
+        return over_soft
+
+    # -- recording ---------------------------------------------------------
+
+    def record(
+        self,
+        provider: str,
+        model: str,
+        request_type: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        latency: float = 0.0,
+        characters: int = 0,
+    ):
+        """Count one finished call and queue its AIResponse document"""
+        scope = _scope.get()
+        self._totals[(provider, model, request_type)].add(prompt_tokens, completion_tokens, characters, latency)
+
+        self._roll_day()
+        tokens = prompt_tokens + completion_tokens
+        if scope.get("user_id"):
+            self._daily["user"][scope["user_id"]] += tokens
+        if scope.get("room_id"):
+            self._daily["room"][scope["room_id"]] += tokens
+
+        # Prompts and responses stay out of the usage log (they may be private
+        # chat content); the collection is for accounting only
+        self._buffer.append(AIResponse(
+            user_id=scope.get("user_id") or "system",
+            request_type=request_type,
+            prompt="",
+            response="",
+            room_id=scope.get("room_id"),
+            topic_id=scope.get("topic_id"),
+            document_id=scope.get("document_id"),
+            model_used=model,
+            tokens_used=tokens,
+            processing_time=round(latency, 4),
+            metadata={
+                "provider": provider,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "characters": characters,
+            },
+        ).to_dict())
+        if len(self._buffer) >= self.flush_batch_size:
+            self._schedule_flush()
+
+    def record_completion(
+        self,
+        provider: str,
+        model: str,
+        request_type: str,
+        usage: Any,
+        latency: float,
+        estimated_prompt_tokens: int = 0,
+        estimated_completion_tokens: int = 0,
+    ):
+        """Record an LLM/embedding call from its reported usage, or estimates when there is none"""
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        self.record(
+            provider, model, request_type,
+            estimated_prompt_tokens if prompt_tokens is None else prompt_tokens,
+            estimated_completion_tokens if completion_tokens is None else completion_tokens,
+            latency,
+        )
+
+    # -- persistence -------------------------------------------------------
+
+    def _schedule_flush(self):
+        if self._flushing is not None and not self._flushing.done():
+            return
+        try:
+            self._flushing = asyncio.get_running_loop().create_task(self.flush())
+        except RuntimeError:
+            pass  # no loop (sync caller outside the app); the periodic flusher will pick it up
+
+    async def flush(self):
+        """Write buffered usage documents to Mongo in one insert"""
+        if not self._buffer:
+            return
+        mongo_db = get_mongo_db()
+        if mongo_db is None:
+            self._trim_buffer()
+            return
+        batch, self._buffer = self._buffer, []
+        try:
+            await mongo_db[COLLECTION_NAME].insert_many(batch, ordered=False)
+            self.flushed += len(batch)
+        except Exception as e:
+            logger.warning(f"Could not flush {len(batch)} AI usage records: {e}")
+            self._buffer = batch + self._buffer
+            self._trim_buffer()
+
+    def _trim_buffer(self):
+        """Keep memory bounded while records can't be written: drop the oldest"""
+        overflow = len(self._buffer) - self.flush_batch_size * 10
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.dropped += overflow
+            logger.warning(f"Dropped {overflow} unwritten AI usage records")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        """Start the background flusher (called on app startup)"""
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Stop the flusher and write whatever is still buffered"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    # -- reporting ---------------------------------------------------------
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        self._roll_day()
+        by_call = [
+            {"provider": provider, "model": model, "request_type": request_type, **totals.to_dict()}
+            for (provider, model, request_type), totals in self._totals.items()
+        ]
+
+        def heaviest(kind: str):
+            usage = sorted(self._daily[kind].items(), key=lambda item: item[1], reverse=True)[:top]
+            return [{"id": key, "tokens": tokens} for key, tokens in usage]
+
+        return {
+            "since_startup": by_call,
+            "today": {
+                "date": self._day,
+                "top_users": heaviest("user"),
+                "top_rooms": heaviest("room"),
+            },
+            "quotas": {
+                kind: {"soft": soft, "hard": hard} for kind, (soft, hard) in self.limits.items()
+            },
+            "buffered": len(self._buffer),
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+        }
+
+    async def persisted_stats(self, hours: int = 24) -> List[Dict[str, Any]]:
+        """Totals across all workers from the flushed usage log"""
+        mongo_db = get_mongo_db()
+        if mongo_db is None:
+            return []
+        since = datetime.utcnow() - timedelta(hours=hours)
+        rows = await mongo_db[COLLECTION_NAME].aggregate([
+            {"$match": {"created_at": {"$gte": since}}},
+            {"$group": {
+                "_id": {"request_type": "$request_type", "model": "$model_used"},
+                "calls": {"$sum": 1},
+                "tokens": {"$sum": "$tokens_used"},
+                "avg_latency": {"$avg": "$processing_time"},
+            }},
+            {"$sort": {"tokens": -1}},
+        ]).to_list(length=None)
+        return [{**row.pop("_id"), **row} for row in rows]
+
+
+ai_usage = AIUsageTracker()
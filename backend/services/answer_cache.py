@@ -0,0 +1,157 @@
+"""Cache for repeated note questions.
+
+Students ask the same things about the same document over and over ("what
+is the main idea?"). Two in-process LRUs short-circuit that:
+
+- question embeddings, by normalized question text, so retrieval skips the
+  embeddings call (and the embedding cache's SQLite lookup)
+- answers, by (document content hash, normalized question), so a repeat
+  skips retrieval and the completion altogether
+
+Answers are keyed by the content hash of the document they were built from,
+so a note whose file is replaced never sees answers about the old file, and
+answers are shared by every note that uploaded the same file. The first
+lookup for a document seeds its answers from ChatLog: questions asked on
+notes attached to it since they were attached. invalidate() drops a
+document's answers when it is released. Only documents embedded by content
+hash are cached; older per-note uploads always go to the model.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.postgresql.chat_log import ChatLog
+from models.postgresql.document_text import NoteDocument
+
+logger = logging.getLogger(__name__)
+
+# Answers the model gives when retrieval found nothing useful; never reused
+UNANSWERED = "This information is not present in the uploaded file."
+
+
+def normalize_question(question: str) -> str:
+    """Case, spacing and trailing punctuation don't change what is being asked"""
+    return " ".join(question.lower().split()).rstrip(" ?!.")
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        max_embeddings: int = settings.RAG_QUESTION_EMBEDDING_CACHE_SIZE,
+        max_answers: int = settings.RAG_ANSWER_CACHE_SIZE,
+        enabled: bool = settings.RAG_ANSWER_CACHE_ENABLED,
+    ):
+        self.max_embeddings = max_embeddings
+        self.max_answers = max_answers
+        self.enabled = enabled
+        self._embeddings: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._answers: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._seeded: "OrderedDict[str, None]" = OrderedDict()  # documents loaded from ChatLog
+        # Seeding runs in the request's thread; lookups on the event loop
+        self._lock = threading.Lock()
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+        self.answer_hits = 0
+        self.answer_misses = 0
+        self.seeded_answers = 0
+
+    @staticmethod
+    def _put(entries: OrderedDict, key, value, limit: int):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > limit:
+            entries.popitem(last=False)
+
+    # -- level 1: question embeddings --------------------------------------
+
+    def get_embedding(self, question: str) -> Optional[List[float]]:
+        if not self.enabled:
+            return None
+        key = normalize_question(question)
+        with self._lock:
+            vector = self._embeddings.get(key)
+            if vector is None:
+                self.embedding_misses += 1
+                return None
+            self._embeddings.move_to_end(key)
+            self.embedding_hits += 1
+            return vector
+
+    def set_embedding(self, question: str, vector: List[float]):
+        if self.enabled:
+            with self._lock:
+                self._put(self._embeddings, normalize_question(question), vector, self.max_embeddings)
+
+    # -- level 2: answers --------------------------------------------------
+
+    def get_answer(self, db: Session, document_hash: str, question: str) -> Optional[str]:
+        """A cached answer for this document, seeding it from ChatLog on first use"""
+        if not self.enabled:
+            return None
+        if document_hash not in self._seeded:
+            self._seed(db, document_hash)
+        key = (document_hash, normalize_question(question))
+        with self._lock:
+            answer = self._answers.get(key)
+            if answer is None:
+                self.answer_misses += 1
+                return None
+            self._answers.move_to_end(key)
+            self.answer_hits += 1
+            return answer
+
+    def set_answer(self, document_hash: str, question: str, answer: str):
+        if self.enabled and answer and answer != UNANSWERED:
+            with self._lock:
+                self._put(self._answers, (document_hash, normalize_question(question)), answer, self.max_answers)
+
+    def _seed(self, db: Session, document_hash: str):
+        """Load answers given about this document since each note was attached to it"""
+        try:
+            rows = (
+                db.query(ChatLog.question, ChatLog.answer)
+                .join(NoteDocument, NoteDocument.note_id == ChatLog.note_id)
+                .filter(NoteDocument.content_hash == document_hash, ChatLog.created_at >= NoteDocument.attached_at)
+                .order_by(ChatLog.created_at.desc())
+                .limit(self.max_answers)
+                .all()
+            )
+        except Exception as e:
+            logger.warning(f"Could not seed cached answers for document {document_hash}: {e}")
+            return
+        with self._lock:
+            # Oldest first, so the latest answer to a question wins
+            for question, answer in reversed(rows):
+                if answer and answer != UNANSWERED:
+                    self._put(self._answers, (document_hash, normalize_question(question)), answer, self.max_answers)
+            self.seeded_answers += len(rows)
+            self._put(self._seeded, document_hash, None, self.max_answers)
+
+    def invalidate(self, document_hash: str):
+        """Forget a document's answers, e.g. once no note uses it any more"""
+        with self._lock:
+            for key in [key for key in self._answers if key[0] == document_hash]:
+                del self._answers[key]
+            self._seeded.pop(document_hash, None)
+
+    def stats(self) -> Dict[str, Any]:
+        answer_lookups = self.answer_hits + self.answer_misses
+        embedding_lookups = self.embedding_hits + self.embedding_misses
+        return {
+            "enabled": self.enabled,
+            "answers": len(self._answers),
+            "answer_hits": self.answer_hits,
+            "answer_misses": self.answer_misses,
+            "answer_hit_rate": self.answer_hits / answer_lookups if answer_lookups else 0.0,
+            "seeded_answers": self.seeded_answers,
+            "embeddings": len(self._embeddings),
+            "embedding_hit_rate": self.embedding_hits / embedding_lookups if embedding_lookups else 0.0,
+        }
+
+
+# Global answer cache instance
+answer_cache = AnswerCache()
@@ -0,0 +1,123 @@
+"""Text of embedded RAG chunks, kept next to the documents they come from.
+
+The vector index only gets each chunk's id and the fields queries filter
+on; the text, page and character span live in the `document_chunks` table,
+zlib-compressed. That keeps index metadata far below per-vector size limits
+and query responses small. Retrieval reads the matched chunks back with a
+single batched lookup by id.
+
+Document chunks are numbered "{content_hash}-{i}": a document never
+changes, so positions are stable. A note's own text does change, so its
+chunks are named by content instead (content_chunk_id), and an edit only
+has to embed the chunks whose text is new.
+
+Vectors written before the store existed still carry their text in
+metadata; RAGService falls back to it for ids the store does not have.
+"""
+import hashlib
+import logging
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.postgresql.document_text import DocumentChunk
+from services.chunking import Chunk
+
+logger = logging.getLogger(__name__)
+
+# Ids per IN (...) query, well under every backend's bound-parameter limit
+FETCH_BATCH_SIZE = 500
+
+
+def content_chunk_id(scope: str, text: str) -> str:
+    """A chunk id that stays the same as long as the chunk's text does"""
+    return f"{scope}-{hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]}"
+
+
+class StoredChunk:
+    __slots__ = ("chunk_id", "text", "page", "start", "end")
+
+    def __init__(self, chunk_id: str, text: str, page: int, start: int, end: int):
+        self.chunk_id = chunk_id
+        self.text = text
+        self.page = page
+        self.start = start
+        self.end = end
+
+
+class ChunkStore:
+    def __init__(self, compression_level: int = settings.DOCUMENT_TEXT_COMPRESSION_LEVEL):
+        self.compression_level = compression_level
+
+    def save(self, db: Session, document_hash: str, chunks: List[Chunk], first_index: int = 0,
+             chunk_ids: Optional[List[str]] = None) -> List[str]:
+        """Store chunks as "{document_hash}-{i}" (or the given ids), replacing earlier copies; the caller commits"""
+        if chunk_ids is None:
+            chunk_ids = [f"{document_hash}-{i}" for i in range(first_index, first_index + len(chunks))]
+        self.delete(db, chunk_ids)
+        db.add_all([
+            DocumentChunk(
+                chunk_id=chunk_id,
+                content_hash=document_hash,
+                position=position,
+                page=chunk.page,
+                start_offset=chunk.start,
+                end_offset=chunk.end,
+                compressed_text=zlib.compress(chunk.text.encode("utf-8"), self.compression_level),
+            )
+            for position, (chunk_id, chunk) in enumerate(zip(chunk_ids, chunks), start=first_index)
+        ])
+        return chunk_ids
+
+    def fetch(self, db: Session, chunk_ids: Iterable[str]) -> Dict[str, StoredChunk]:
+        """The stored chunks among chunk_ids, by id"""
+        chunk_ids = list(dict.fromkeys(chunk_ids))
+        found: Dict[str, StoredChunk] = {}
+        for start in range(0, len(chunk_ids), FETCH_BATCH_SIZE):
+            rows = db.query(DocumentChunk).filter(
+                DocumentChunk.chunk_id.in_(chunk_ids[start:start + FETCH_BATCH_SIZE])
+            ).all()
+            for row in rows:
+                try:
+                    text = row.text
+                except zlib.error as e:
+                    logger.error(f"Stored chunk {row.chunk_id} is corrupt: {e}")
+                    continue
+                found[row.chunk_id] = StoredChunk(row.chunk_id, text, row.page, row.start_offset, row.end_offset)
+        return found
+
+    def texts(self, db: Session, document_hash: str) -> Tuple[List[str], List[str]]:
+        """A document's stored chunk ids and texts, in document order"""
+        rows = (
+            db.query(DocumentChunk)
+            .filter(DocumentChunk.content_hash == document_hash)
+            .order_by(DocumentChunk.position)
+            .all()
+        )
+        return [row.chunk_id for row in rows], [row.text for row in rows]
+
+    def chunk_ids(self, db: Session, document_hash: str) -> List[str]:
+        return [row.chunk_id for row in db.query(DocumentChunk.chunk_id).filter(DocumentChunk.content_hash == document_hash)]
+
+    def document_hashes(self, db: Session, chunk_ids: List[str]) -> List[str]:
+        """The documents the given chunks belong to"""
+        hashes = set()
+        for start in range(0, len(chunk_ids), FETCH_BATCH_SIZE):
+            rows = db.query(DocumentChunk.content_hash).filter(
+                DocumentChunk.chunk_id.in_(chunk_ids[start:start + FETCH_BATCH_SIZE])
+            ).distinct()
+            hashes.update(row.content_hash for row in rows)
+        return sorted(hashes)
+
+    def delete(self, db: Session, chunk_ids: List[str]):
+        """Drop chunks by id; the caller commits"""
+        for start in range(0, len(chunk_ids), FETCH_BATCH_SIZE):
+            db.query(DocumentChunk).filter(
+                DocumentChunk.chunk_id.in_(chunk_ids[start:start + FETCH_BATCH_SIZE])
+            ).delete(synchronize_session=False)
+
+
+# Global chunk store instance
+chunk_store = ChunkStore()
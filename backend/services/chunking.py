@@ -0,0 +1,180 @@
+"""Sentence-packing chunker for RAG embeddings.
+
+Text is cut where a sentence ends (., ! or ? followed by whitespace) and at
+paragraph breaks, and whole sentences are packed into windows of at most
+`chunk_tokens` tokens. Consecutive windows share up to `overlap_tokens` of
+trailing sentences, so a fact near a boundary is retrievable from either
+side. A sentence longer than a whole window is cut at whitespace.
+
+Tokens are estimated with ai_service's CHARS_PER_TOKEN, so no tokenizer is
+loaded. The text is scanned once by one regex, and each chunk records its
+page and its character span in the document text (pages joined by
+newlines, as document_store keeps it). SentenceChunker.feed takes pages
+one at a time and yields exactly the chunks that chunking the joined text
+would. benchmarks/chunking.py measures it.
+
+With content_defined=True, a chunk may also end after any sentence once it
+is half full, if a checksum of that sentence picks it (one in
+CONTENT_CUT_ONE_IN). Boundaries then depend on nearby text only, so an
+edit changes the chunks around it and the rest come out identical: this
+is how note text is chunked, so that an edit re-embeds only those.
+"""
+import re
+import zlib
+from bisect import bisect_right
+from collections import deque
+from typing import Deque, Iterator, List, Optional, Sequence, Tuple
+
+from core.config import settings
+from services.ai_service import CHARS_PER_TOKEN
+
+# A sentence end (with any closing quotes/brackets) or a blank line, plus the whitespace after it
+_BOUNDARY = re.compile(r"(?:([.!?]+[\"')\]]*)\s+|\n\s*\n)\s*")
+_NON_SPACE = re.compile(r"\S")
+# With content-defined boundaries, the share of sentences that may end a half-full chunk
+CONTENT_CUT_ONE_IN = 4
+
+
+class Chunk:
+    __slots__ = ("text", "start", "end", "page", "tokens")
+
+    def __init__(self, text: str, start: int, end: int, page: int, tokens: int):
+        self.text = text
+        self.start = start  # character span in the document text
+        self.end = end
+        self.page = page  # 1-based page the chunk starts on
+        self.tokens = tokens  # estimated
+
+    def __repr__(self):
+        return f"<Chunk(page={self.page}, span={self.start}:{self.end}, tokens={self.tokens})>"
+
+
+class SentenceChunker:
+    def __init__(
+        self,
+        chunk_tokens: int = settings.RAG_CHUNK_TOKENS,
+        overlap_tokens: int = settings.RAG_CHUNK_OVERLAP_TOKENS,
+        content_defined: bool = False,
+    ):
+        if not 0 <= overlap_tokens < chunk_tokens:
+            raise ValueError("overlap_tokens must be at least 0 and smaller than chunk_tokens")
+        self.max_chars = chunk_tokens * CHARS_PER_TOKEN
+        self.overlap_chars = overlap_tokens * CHARS_PER_TOKEN
+        self.content_defined = content_defined
+        self._reset()
+
+    def _reset(self):
+        self._text = ""  # buffered document text, starting at document offset _base
+        self._base = 0
+        self._length = 0  # characters fed so far
+        self._scanned = 0  # document offset where the next sentence starts
+        self._started = False  # past any leading whitespace
+        self._page_offsets: List[int] = []
+        self._window: Deque[Tuple[int, int]] = deque()  # sentence spans of the open chunk
+        self._carried = 0  # leading sentences of the window already emitted (the overlap)
+
+    def chunk(self, text: str, page_offsets: Optional[Sequence[int]] = None) -> List[Chunk]:
+        """All chunks of a document's text; page_offsets are where each page starts"""
+        self._reset()
+        self._text = text
+        self._length = len(text)
+        self._page_offsets = list(page_offsets or [0])
+        chunks = list(self._scan(final=True))
+        self._reset()
+        return chunks
+
+    def feed(self, page: str) -> Iterator[Chunk]:
+        """Add the next page, yielding the chunks it completes"""
+        if self._page_offsets:
+            self._text += "\n"
+            self._length += 1
+        self._page_offsets.append(self._length)
+        self._text += page
+        self._length += len(page)
+        return self._scan(final=False)
+
+    def finish(self) -> Iterator[Chunk]:
+        """Yield the chunks still open after the last page, and start over"""
+        yield from self._scan(final=True)
+        self._reset()
+
+    # -- scanning ----------------------------------------------------------
+
+    def _scan(self, final: bool) -> Iterator[Chunk]:
+        text, base = self._text, self._base
+        position = self._scanned - base
+        if not self._started:
+            first = _NON_SPACE.search(text, position)
+            if first is None:
+                return
+            position = first.start()
+            self._scanned = base + position
+            self._started = True
+        for match in _BOUNDARY.finditer(text, position):
+            if not final and match.end() == len(text):
+                # The boundary's whitespace may continue on the next page
+                break
+            end = match.end(1) if match.group(1) else match.start()
+            yield from self._add_sentence(self._scanned, base + end)
+            self._scanned = base + match.end()
+        if final:
+            end = base + len(text.rstrip())
+            if end > self._scanned:
+                yield from self._add_sentence(self._scanned, end)
+                self._scanned = end
+            if len(self._window) > self._carried:
+                yield self._emit()
+            self._window.clear()
+            return
+        # Only text from the open chunk onward can still end up in a chunk
+        keep_from = min(self._window[0][0], self._scanned) if self._window else self._scanned
+        if keep_from > base:
+            self._text = text[keep_from - base:]
+            self._base = keep_from
+
+    def _add_sentence(self, start: int, end: int) -> Iterator[Chunk]:
+        text, base = self._text, self._base
+        while end - start > self.max_chars:
+            # Cut overlong sentences at the last whitespace that fits a window
+            limit = start + self.max_chars
+            cut = max(text.rfind(" ", start - base, limit - base), text.rfind("\n", start - base, limit - base)) + base
+            if cut <= start:
+                cut = limit
+            yield from self._pack(start, cut)
+            following = _NON_SPACE.search(text, cut - base)
+            start = base + following.start() if following else end
+        if end > start:
+            yield from self._pack(start, end)
+
+    def _pack(self, start: int, end: int) -> Iterator[Chunk]:
+        window = self._window
+        if window and end - window[0][0] > self.max_chars:
+            yield self._emit()
+            self._carry_overlap()
+            while window and end - window[0][0] > self.max_chars:
+                window.popleft()
+            self._carried = len(window)
+        window.append((start, end))
+        if (self.content_defined and end - window[0][0] >= self.max_chars // 2
+                and zlib.crc32(self._text[start - self._base:end - self._base].encode("utf-8")) % CONTENT_CUT_ONE_IN == 0):
+            yield self._emit()
+            self._carry_overlap()
+
+    def _carry_overlap(self):
+        """Keep the trailing sentences that fit in the overlap, to start the next chunk"""
+        window = self._window
+        last_end = window[-1][1]
+        keep = 0
+        for sentence_start, _ in reversed(window):
+            if last_end - sentence_start > self.overlap_chars:
+                break
+            keep += 1
+        for _ in range(len(window) - keep):
+            window.popleft()
+        self._carried = len(window)
+
+    def _emit(self) -> Chunk:
+        start, end = self._window[0][0], self._window[-1][1]
+        text = self._text[start - self._base:end - self._base]
+        page = max(1, bisect_right(self._page_offsets, start))
+        return Chunk(text, start, end, page, len(text) // CHARS_PER_TOKEN + 1)
@@ -0,0 +1,182 @@
+"""Content-addressed store for uploaded note documents.
+
+Every distinct file is kept once, keyed by the sha256 of its bytes, in the
+`document_texts` table: the S3 key of the single stored object, the
+extracted text (zlib-compressed, with the character offset where each
+page starts), the summary, and how many chunks were embedded under
+`{content_hash}-{i}` vector IDs. Notes point at a document through
+`note_documents`, and the document counts those references, plus one per
+ingestion job still working on it (hold/unhold). When the last reference
+goes, the caller deletes the S3 object and the vectors.
+
+Uploading a file that is already stored therefore costs one lookup. No S3
+write, parse, summary or embedding is repeated, and summary, quiz and audio
+generation read the stored text instead of downloading and re-parsing.
+"""
+import hashlib
+import json
+import logging
+import zlib
+from typing import List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.postgresql.document_text import DocumentText, NoteDocument
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(file_content: bytes) -> str:
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def join_pages(pages: List[str]) -> Tuple[str, List[int]]:
+    """Join page texts with newlines, returning the text and each page's start offset"""
+    offsets, position = [], 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page) + 1
+    return "\n".join(pages), offsets or [0]
+
+
+class ReleasedDocument:
+    """What to clean up after a document lost its last reference"""
+    __slots__ = ("content_hash", "storage_path", "chunk_ids")
+
+    def __init__(self, content_hash: str, storage_path: Optional[str], chunk_ids: List[str]):
+        self.content_hash = content_hash
+        self.storage_path = storage_path
+        self.chunk_ids = chunk_ids
+
+
+class DocumentTextStore:
+    def __init__(self, compression_level: int = settings.DOCUMENT_TEXT_COMPRESSION_LEVEL):
+        self.compression_level = compression_level
+
+    def find(self, db: Session, file_hash: str) -> Optional[DocumentText]:
+        return db.get(DocumentText, file_hash)
+
+    def get(self, db: Session, note_id: str) -> Optional[DocumentText]:
+        """The document attached to a note, if any"""
+        return (
+            db.query(DocumentText)
+            .join(NoteDocument, NoteDocument.content_hash == DocumentText.content_hash)
+            .filter(NoteDocument.note_id == note_id)
+            .first()
+        )
+
+    def get_text(self, db: Session, note_id: str) -> Optional[str]:
+        record = self.get(db, note_id)
+        if record is None:
+            return None
+        try:
+            return record.text
+        except zlib.error as e:
+            logger.error(f"Stored text for note {note_id} is corrupt: {e}")
+            return None
+
+    def embedded_hash(self, db: Session, note_id: str) -> Optional[str]:
+        """Content hash to filter vectors by, if the note's document was embedded by hash"""
+        record = self.get(db, note_id)
+        return record.content_hash if record is not None and record.chunk_count is not None else None
+
+    def save(self, db: Session, file_hash: str, pages: List[str], storage_path: Optional[str] = None,
+             file_type: Optional[str] = None, file_size: Optional[int] = None) -> DocumentText:
+        """Store a newly extracted document; the caller commits.
+
+        If the content is already stored, including by a concurrent upload
+        that got there first, that record is returned instead.
+        """
+        existing = self.find(db, file_hash)
+        if existing is not None:
+            return existing
+        text, offsets = join_pages(pages)
+        record = DocumentText(
+            content_hash=file_hash,
+            storage_path=storage_path,
+            file_type=file_type,
+            file_size=file_size,
+            compressed_text=zlib.compress(text.encode("utf-8"), self.compression_level),
+            page_offsets=json.dumps(offsets),
+            char_count=len(text),
+            page_count=len(offsets),
+            ref_count=0,
+        )
+        try:
+            with db.begin_nested():
+                db.add(record)
+        except IntegrityError:
+            record = self.find(db, file_hash)
+        return record
+
+    def hold(self, db: Session, record: DocumentText) -> bool:
+        """Take a reference for a job still working on a document; the caller commits.
+
+        False if the document was released in the meantime.
+        """
+        held = db.query(DocumentText).filter(DocumentText.content_hash == record.content_hash).update(
+            {DocumentText.ref_count: DocumentText.ref_count + 1}, synchronize_session=False
+        )
+        db.flush()
+        if not held:
+            db.expunge(record)
+            return False
+        db.refresh(record)
+        return True
+
+    def unhold(self, db: Session, file_hash: str) -> Optional[ReleasedDocument]:
+        """Drop a job's reference; the caller commits, then cleans up a returned document as for detach"""
+        return self._drop_reference(db, file_hash)
+
+    def attach(self, db: Session, note_id: str, record: DocumentText) -> Optional[ReleasedDocument]:
+        """Point a note at a document; the caller commits.
+
+        Returns the note's previous document if that lost its last reference.
+        """
+        link = db.get(NoteDocument, note_id)
+        if link is not None and link.content_hash == record.content_hash:
+            return None
+        released = self.detach(db, note_id) if link is not None else None
+        db.add(NoteDocument(note_id=note_id, content_hash=record.content_hash))
+        # Count in SQL, not in Python, so concurrent uploads never lose an increment
+        db.query(DocumentText).filter(DocumentText.content_hash == record.content_hash).update(
+            {DocumentText.ref_count: DocumentText.ref_count + 1}, synchronize_session=False
+        )
+        db.flush()
+        db.refresh(record)
+        return released
+
+    def detach(self, db: Session, note_id: str) -> Optional[ReleasedDocument]:
+        """Unlink a note from its document; the caller commits.
+
+        Returns the document if this was its last reference: its row is
+        deleted, and the caller removes the S3 object and vectors after
+        committing.
+        """
+        link = db.get(NoteDocument, note_id)
+        if link is None:
+            return None
+        file_hash = link.content_hash
+        db.delete(link)
+        return self._drop_reference(db, file_hash)
+
+    def _drop_reference(self, db: Session, file_hash: str) -> Optional[ReleasedDocument]:
+        query = db.query(DocumentText).filter(DocumentText.content_hash == file_hash)
+        query.update({DocumentText.ref_count: DocumentText.ref_count - 1}, synchronize_session=False)
+        db.flush()
+        record = self.find(db, file_hash)
+        if record is None:
+            return None
+        db.refresh(record)
+        if record.ref_count > 0:
+            return None
+        released = ReleasedDocument(record.content_hash, record.storage_path, record.chunk_ids())
+        db.delete(record)
+        db.flush()
+        return released
+
+
+# Global document text store instance
+document_text_store = DocumentTextStore()
@@ -1,5 +1,9 @@
 import os
+import time
 import requests
+from services.ai_usage import ai_usage
+
+MODEL_ID = "eleven_monolingual_v1"
 
 class ElevenLabsService:
     def __init__(self, api_key=None):
@@ -8,6 +12,7 @@ class ElevenLabsService:
 
     def synthesize(self, text, voice_id):
         url = f"{self.base_url}/{voice_id}"
+        started = time.perf_counter()
         response = requests.post(
             url,
             headers={
@@ -16,7 +21,7 @@ class ElevenLabsService:
             },
             json={
                 "text": text,
-                "model_id": "eleven_monolingual_v1",
+                "model_id": MODEL_ID,
                 "voice_settings": {
                     "stability": 0.75,
                     "similarity_boost": 0.85
@@ -24,6 +29,12 @@ class ElevenLabsService:
             }
         )
         if response.status_code == 200:
+            # ElevenLabs bills by character, so that is what gets counted
+            ai_usage.record(
+                "elevenlabs", MODEL_ID, "tts",
+                latency=time.perf_counter() - started,
+                characters=len(text),
+            )
             return response.content  # MP3 bytes
         else:
             raise Exception(f"ElevenLabs error: {response.text}")
@@ -0,0 +1,144 @@
+"""Token-sized, concurrent embedding batches.
+
+The embeddings endpoint caps the inputs and tokens of one request. A large
+document sent as one call therefore fails outright, and one slow call
+holds up the whole ingest. EmbeddingBatcher packs texts, in order, into
+batches of at most EMBEDDING_BATCH_MAX_TOKENS estimated tokens and
+EMBEDDING_BATCH_MAX_INPUTS inputs. It runs up to
+EMBEDDING_MAX_CONCURRENT_BATCHES of them at once; interactive calls (a
+question being asked) bypass that cap.
+
+Every call still goes through ai_service.embed, so the scheduler's pacing
+and transient-error retries apply; a batch that fails past those is not
+sent again here. One the API rejects as invalid (too long) is split in
+half, so one oversized batch never fails the rest of the document.
+Throughput in chunks per second is logged per call and kept in stats().
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import openai
+
+from core.config import settings
+from services.ai_scheduler import BATCH, INTERACTIVE
+from services.ai_service import estimate_tokens
+from services.ai_usage import AIQuotaExceeded
+
+logger = logging.getLogger(__name__)
+
+# (texts, priority) -> one vector per text
+EmbedFn = Callable[[List[str], str], Awaitable[List[List[float]]]]
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        embed_fn: EmbedFn,
+        max_batch_tokens: int = settings.EMBEDDING_BATCH_MAX_TOKENS,
+        max_batch_inputs: int = settings.EMBEDDING_BATCH_MAX_INPUTS,
+        max_concurrency: int = settings.EMBEDDING_MAX_CONCURRENT_BATCHES,
+    ):
+        self.embed_fn = embed_fn
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_inputs = max_batch_inputs
+        self._slots = asyncio.Semaphore(max_concurrency)
+        # Counters for stats(); busy time counts wall time with any batch in flight
+        self.chunks = 0
+        self.requests = 0
+        self.splits = 0
+        self.failed = 0
+        self._active = 0
+        self._busy_since = 0.0
+        self._busy_seconds = 0.0
+
+    def fits(self, batch_tokens: int, batch_inputs: int, tokens: int) -> bool:
+        """Whether one more text of `tokens` still fits a batch (an empty batch takes anything)"""
+        if batch_inputs == 0:
+            return True
+        return batch_inputs < self.max_batch_inputs and batch_tokens + tokens <= self.max_batch_tokens
+
+    def batches(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """Consecutive [start, stop) ranges of texts, one per request"""
+        ranges = []
+        start, tokens = 0, 0
+        for i, text in enumerate(texts):
+            size = estimate_tokens(text)
+            if not self.fits(tokens, i - start, size):
+                ranges.append((start, i))
+                start, tokens = i, 0
+            tokens += size
+        if start < len(texts):
+            ranges.append((start, len(texts)))
+        return ranges
+
+    async def embed(self, texts: List[str], priority: str = BATCH) -> List[List[float]]:
+        """Embed any number of texts, in concurrent batches; vectors come back in order"""
+        if not texts:
+            return []
+        started = time.perf_counter()
+        ranges = self.batches(texts)
+        results = await asyncio.gather(
+            *[self.embed_batch(texts[start:stop], priority) for start, stop in ranges]
+        )
+        if len(texts) > 1:
+            seconds = time.perf_counter() - started
+            logger.info(
+                f"Embedded {len(texts)} chunks in {len(ranges)} batches in {seconds:.2f}s "
+                f"({len(texts) / max(seconds, 1e-9):.1f} chunks/s)"
+            )
+        return [vector for vectors in results for vector in vectors]
+
+    async def embed_batch(self, texts: List[str], priority: str = BATCH) -> List[List[float]]:
+        """One batch, split in half if the API rejects it"""
+        try:
+            return await self._call(texts, priority)
+        except AIQuotaExceeded:
+            raise
+        except openai.BadRequestError:
+            if len(texts) < 2:
+                self.failed += 1
+                raise
+            self.splits += 1
+            middle = len(texts) // 2
+            halves = await asyncio.gather(
+                self.embed_batch(texts[:middle], priority),
+                self.embed_batch(texts[middle:], priority),
+            )
+            return halves[0] + halves[1]
+        except Exception:
+            self.failed += 1
+            raise
+
+    async def _call(self, texts: List[str], priority: str) -> List[List[float]]:
+        if priority == INTERACTIVE:
+            return await self._timed(texts, priority)
+        async with self._slots:
+            return await self._timed(texts, priority)
+
+    async def _timed(self, texts: List[str], priority: str) -> List[List[float]]:
+        if self._active == 0:
+            self._busy_since = time.perf_counter()
+        self._active += 1
+        try:
+            vectors = await self.embed_fn(texts, priority)
+        finally:
+            self._active -= 1
+            if self._active == 0:
+                self._busy_seconds += time.perf_counter() - self._busy_since
+        self.chunks += len(texts)
+        self.requests += 1
+        return vectors
+
+    def stats(self) -> Dict[str, Any]:
+        busy = self._busy_seconds + (time.perf_counter() - self._busy_since if self._active else 0.0)
+        return {
+            "chunks": self.chunks,
+            "batches": self.requests,
+            "in_flight": self._active,
+            "splits": self.splits,
+            "failed_batches": self.failed,
+            "busy_seconds": round(busy, 3),
+            "chunks_per_second": round(self.chunks / busy, 1) if busy else None,
+        }
@@ -0,0 +1,169 @@
+"""Persistent cache of chunk embeddings.
+
+An embedding is a pure function of (model, text). Re-uploading an edited
+document, re-indexing, or re-embedding after a chunker change therefore
+only needs the API for chunks it has not seen before. Vectors are kept in a
+local SQLite file (EMBEDDING_CACHE_PATH), shared by every worker on the
+host. Each row is keyed by the SHA-256 of the model and the chunk text with
+whitespace collapsed, and holds the vector as a float32 blob: 6KB for a
+1536-dimension embedding, a quarter of its JSON size.
+
+The file is bounded by EMBEDDING_CACHE_MAX_MB. Lookups mark rows as used,
+and once the vectors outgrow the bound the least recently used are evicted
+down to EVICT_TO_FRACTION of it. SQLite is synchronous, so callers run the
+cache in the threadpool. A broken or unwritable cache file is logged and
+treated as a miss; it never fails an embedding.
+"""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Sequence
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Eviction trims this far below the size bound, so it does not run on every write
+EVICT_TO_FRACTION = 0.9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key BLOB PRIMARY KEY,
+    vector BLOB NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_embeddings_used_at ON embeddings (used_at);
+"""
+
+
+def normalize_chunk(text: str) -> str:
+    return " ".join(text.split())
+
+
+def cache_key(model: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{normalize_chunk(text)}".encode("utf-8")).digest()
+
+
+def pack_vector(vector: Sequence[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(blob: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        path: str = settings.EMBEDDING_CACHE_PATH,
+        max_bytes: int = settings.EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = bool(path)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._bytes = 0  # vector bytes stored, as last counted by this process
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached vectors for texts, in order, with None for each miss"""
+        if not self.enabled or not texts:
+            return [None] * len(texts)
+        keys = [cache_key(model, text) for text in texts]
+        found: Dict[bytes, bytes] = {}
+        try:
+            with self._lock:
+                conn = self._connect()
+                unique = list(dict.fromkeys(keys))
+                # Stay under SQLite's bound-parameter limit
+                for start in range(0, len(unique), 500):
+                    batch = unique[start:start + 500]
+                    rows = conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall()
+                    found.update(rows)
+                if found:
+                    now = time.time()
+                    with conn:
+                        conn.executemany("UPDATE embeddings SET used_at = ? WHERE key = ?", [(now, key) for key in found])
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            found = {}
+        vectors = [unpack_vector(found[key]) if key in found else None for key in keys]
+        hits = sum(vector is not None for vector in vectors)
+        self.hits += hits
+        self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        if not self.enabled or not texts:
+            return
+        now = time.time()
+        rows = [(cache_key(model, text), pack_vector(vector), now) for text, vector in zip(texts, vectors)]
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, used_at) VALUES (?, ?, ?)", rows)
+                self._bytes += sum(len(row[1]) for row in rows)
+                if self._bytes > self.max_bytes:
+                    self._evict(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Drop the least recently used vectors until the cache is back under its bound"""
+        # Other workers write to the same file, so recount before deciding
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        self._bytes = total
+        target = int(self.max_bytes * EVICT_TO_FRACTION)
+        if total <= self.max_bytes or not count:
+            return
+        overflow = -(-(total - target) * count // total)  # rows, at the average row size, rounded up
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used_at LIMIT ?)",
+                (overflow,),
+            ).rowcount
+        self.evicted += deleted
+        self._bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        logger.info(f"Evicted {deleted} cached embeddings; {self._bytes / 1048576:.1f}MB left")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "megabytes": round(self._bytes / 1048576, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# Global embedding cache instance
+embedding_cache = EmbeddingCache()
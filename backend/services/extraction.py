@@ -0,0 +1,238 @@
+"""Document text extraction in a bounded pool of worker processes.
+
+PDF and Word parsing is pure-Python CPU work: run on the event loop (or
+in the threadpool, where it still holds the GIL) a large upload stalls
+every websocket and request on the worker for seconds. Parsers here run
+in separate processes instead, so they use every core and the event loop
+only awaits the result.
+
+Formats and their parser backends are registered in services/extractors.py.
+PDFs are parsed page range by page range (`iter_document_pages`), so one
+large document spreads over several workers and its pages stream back to
+the caller in order.
+
+Each job gets a wall-clock timeout and each worker process an address
+space cap (RLIMIT_AS), so a malformed or hostile file cannot hang or
+exhaust the host. A job that times out is killed by recycling the pool;
+jobs that were running alongside it are retried once on the fresh pool.
+A job whose caller is cancelled is not killed, since that would take the
+other callers' jobs down too: it runs on (up to its timeout) holding its
+worker slot, and its result is dropped. Worker processes are also
+replaced after a fixed number of jobs, which bounds parser memory leaks.
+
+Parsers take a file path rather than bytes, so a document is never
+copied through the pool's pipes.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from concurrent.futures import Future
+from typing import AsyncIterator, Callable, Deque, Iterator, List, Optional, Sequence, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from core.config import settings
+from services.extractors import DocumentFormat, extract_document, extract_page_range, limit_worker_memory
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionError(Exception):
+    """Raised when a document could not be parsed"""
+
+
+class ExtractionTimeout(ExtractionError):
+    """Raised when parsing took longer than the per-job timeout"""
+
+
+@contextmanager
+def temporary_document(file_content: bytes, suffix: str = "") -> Iterator[str]:
+    """Write document bytes to a temp file worker processes can open by path"""
+    with tempfile.NamedTemporaryFile(suffix=suffix) as handle:
+        handle.write(file_content)
+        handle.flush()
+        yield handle.name
+
+
+# -- pool -------------------------------------------------------------------
+
+class ExtractionPool:
+    def __init__(
+        self,
+        enabled: bool = settings.EXTRACTION_PROCESS_POOL,
+        workers: int = settings.EXTRACTION_WORKERS,
+        timeout: float = settings.EXTRACTION_TIMEOUT_SECONDS,
+        memory_limit_mb: int = settings.EXTRACTION_MEMORY_LIMIT_MB,
+        max_tasks_per_child: int = settings.EXTRACTION_MAX_TASKS_PER_CHILD,
+    ):
+        self.enabled = enabled
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Admit no more jobs than there are workers, so every submitted job is
+        # running (never queued inside the executor) and recycling the pool
+        # only ever touches jobs that were actually executing.
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._abandoned: Set[asyncio.Task] = set()  # jobs whose caller was cancelled, still running
+        self._jobs = 0
+        self._timeouts = 0
+        self._recycles = 0
+
+    def _start(self) -> ProcessPoolExecutor:
+        # The server process runs threads (event loop, threadpool, DB pools),
+        # so never plain-fork it; forkserver children start from a clean image.
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=limit_worker_memory,
+            initargs=(self.memory_limit,),
+            max_tasks_per_child=self.max_tasks_per_child,
+        )
+        return self._executor
+
+    def _recycle(self, executor: ProcessPoolExecutor):
+        """Kill every process of a pool (the only way to stop a running job) and forget it"""
+        if self._executor is executor:
+            self._executor = None
+            self._recycles += 1
+        # ProcessPoolExecutor has no public way to terminate a running task
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None):
+        """Run a parser in a worker process and return its result.
+
+        Raises ExtractionTimeout, or ExtractionError for crashes and memory
+        cap hits; other parser exceptions propagate unchanged.
+        """
+        if not self.enabled:
+            return await run_in_threadpool(fn, *args)
+
+        timeout = self.timeout if timeout is None else timeout
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        await self._slots.acquire()
+        release = True
+        try:
+            self._jobs += 1
+            for attempt in range(2):
+                executor = self._executor or self._start()
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + timeout
+                submitted = executor.submit(fn, *args)
+                try:
+                    return await asyncio.wait_for(asyncio.wrap_future(submitted), timeout)
+                except BrokenProcessPool:
+                    # Another job's timeout (or the OOM killer) took the pool down
+                    self._recycle(executor)
+                    if attempt:
+                        raise ExtractionError("Extraction worker crashed")
+                    logger.warning("Extraction pool was recycled mid-job; retrying")
+                except asyncio.TimeoutError:
+                    self._timeouts += 1
+                    self._recycle(executor)
+                    raise ExtractionTimeout(f"Document extraction took longer than {timeout:.0f}s")
+                except asyncio.CancelledError:
+                    # The slot is handed to the abandoned job and freed when it ends
+                    release = False
+                    self._abandon(executor, submitted, deadline)
+                    raise
+                except MemoryError:
+                    raise ExtractionError("Document extraction exceeded the worker memory limit")
+        finally:
+            if release:
+                self._slots.release()
+
+    def _abandon(self, executor: ProcessPoolExecutor, submitted: Future, deadline: float):
+        """Let a job whose caller was cancelled finish in the background, still bound by its timeout"""
+        async def finish():
+            try:
+                remaining = max(0.0, deadline - asyncio.get_running_loop().time())
+                await asyncio.wait_for(asyncio.wrap_future(submitted), remaining)
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                self._recycle(executor)
+            except Exception:
+                pass  # nobody wants the result, or the error
+            finally:
+                self._slots.release()
+
+        task = asyncio.get_running_loop().create_task(finish())
+        self._abandoned.add(task)
+        task.add_done_callback(self._abandoned.discard)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "jobs": self._jobs,
+            "timeouts": self._timeouts,
+            "recycles": self._recycles,
+            "abandoned": len(self._abandoned),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._recycle(self._executor)
+
+
+# Global extraction pool instance
+extraction_pool = ExtractionPool()
+
+
+def _backends(document_format: DocumentFormat) -> Sequence[str]:
+    if document_format.name == "pdf":
+        return settings.EXTRACTION_PDF_BACKENDS
+    return document_format.backends
+
+
+async def iter_document_pages(file_path: str, document_format: DocumentFormat, pool: Optional[ExtractionPool] = None,
+                              pages_per_job: int = settings.EXTRACTION_PAGES_PER_JOB) -> AsyncIterator[Tuple[int, str]]:
+    """Yield `(page_no, text)` for a document in page order, 1-based, as pages are parsed.
+
+    Paged formats (PDF) are split into page ranges parsed by separate
+    workers, with at most one range per worker in flight. The caller can
+    chunk and embed early pages while later ones are still being parsed,
+    and only the in-flight ranges are ever held in memory. The timeout
+    applies per range. Other formats come back as a single page.
+    """
+    pool = pool or extraction_pool
+    backends = _backends(document_format)
+    if not document_format.paged:
+        yield 1, await pool.run(extract_document, file_path, backends)
+        return
+
+    page_count = await pool.run(document_format.page_count, file_path)
+    ranges = deque((start, min(start + pages_per_job, page_count)) for start in range(0, page_count, pages_per_job))
+    in_flight: Deque[Tuple[int, asyncio.Future]] = deque()
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < pool.workers:
+                start, stop = ranges.popleft()
+                job = pool.run(extract_page_range, file_path, start, stop, backends)
+                in_flight.append((start, asyncio.ensure_future(job)))
+            start, job = in_flight.popleft()
+            for offset, text in enumerate(await job):
+                yield start + offset + 1, text
+    finally:
+        # The consumer stopped early (or a range failed): stop waiting for the rest
+        for _, job in in_flight:
+            job.cancel()
+        await asyncio.gather(*(job for _, job in in_flight), return_exceptions=True)
+
+
+async def extract_document_pages(file_content: bytes, document_format: DocumentFormat) -> List[str]:
+    """Text of every page of an in-memory document"""
+    with temporary_document(file_content, suffix=document_format.extensions[0]) as file_path:
+        return [text async for _, text in iter_document_pages(file_path, document_format)]
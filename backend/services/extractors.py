@@ -0,0 +1,192 @@
+"""Registry of document formats and the text-extraction backends for each.
+
+Every supported upload format is described once, by extension and MIME
+type, with an ordered backend chain: a fast path first, then fallbacks.
+For PDFs the fast path is PyPDF2's text layer; pages it returns blank (or
+ranges it fails on) are re-parsed with pdfplumber's layout-aware
+extraction. Backends for other formats are tried in order until one
+succeeds.
+
+This module runs inside extraction worker processes (see
+services/extraction.py), so it imports nothing from the app and loads
+parser libraries lazily. benchmarks/extraction.py measures the backends
+against each other.
+"""
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class UnsupportedDocument(ValueError):
+    """Raised for files no registered format handles"""
+
+
+# -- PDF backends: (file_path, page indices) -> text per page ---------------
+
+def pypdf2_pages(file_path: str, pages: Sequence[int]) -> List[str]:
+    import PyPDF2
+
+    pdf_reader = PyPDF2.PdfReader(file_path)
+    return [(pdf_reader.pages[i].extract_text() or "").strip() for i in pages]
+
+
+def pdfplumber_pages(file_path: str, pages: Sequence[int]) -> List[str]:
+    try:
+        import pdfplumber
+    except ImportError:
+        raise ImportError('pdfplumber is required for layout-aware PDF extraction')
+    # pdfplumber numbers pages from 1 and returns them in document order
+    wanted = sorted(set(pages))
+    with pdfplumber.open(file_path, pages=[i + 1 for i in wanted]) as pdf:
+        by_index = {i: (page.extract_text() or "").strip() for i, page in zip(wanted, pdf.pages)}
+    return [by_index[i] for i in pages]
+
+
+def pdf_page_count(file_path: str) -> int:
+    import PyPDF2
+
+    return len(PyPDF2.PdfReader(file_path).pages)
+
+
+# -- single-page backends: file_path -> text --------------------------------
+
+def docx_text(file_path: str) -> str:
+    """Paragraph text of a Word document"""
+    try:
+        from docx import Document
+    except ImportError:
+        raise ImportError('python-docx is required for DOCX extraction')
+    doc = Document(file_path)
+    return "\n".join(paragraph.text for paragraph in doc.paragraphs).strip()
+
+
+def plain_text(file_path: str) -> str:
+    with open(file_path, "rb") as handle:
+        return handle.read().decode("utf-8-sig", errors="ignore")
+
+
+PAGED_BACKENDS: Dict[str, Callable[[str, Sequence[int]], List[str]]] = {
+    "pypdf2": pypdf2_pages,
+    "pdfplumber": pdfplumber_pages,
+}
+
+DOCUMENT_BACKENDS: Dict[str, Callable[[str], str]] = {
+    "python-docx": docx_text,
+    "text": plain_text,
+}
+
+
+class DocumentFormat:
+    __slots__ = ("name", "extensions", "mime_types", "backends", "page_count")
+
+    def __init__(self, name: str, extensions: Sequence[str], mime_types: Sequence[str],
+                 backends: Sequence[str], page_count: Optional[Callable[[str], int]] = None):
+        self.name = name
+        self.extensions = tuple(extensions)
+        self.mime_types = tuple(mime_types)
+        self.backends = tuple(backends)
+        # Paged formats are parsed in page ranges; the rest as one page
+        self.page_count = page_count
+
+    @property
+    def paged(self) -> bool:
+        return self.page_count is not None
+
+    def __repr__(self):
+        return f"<DocumentFormat({self.name}, backends={list(self.backends)})>"
+
+
+FORMATS: List[DocumentFormat] = [
+    DocumentFormat("pdf", [".pdf"], ["application/pdf"], ["pypdf2", "pdfplumber"], page_count=pdf_page_count),
+    # Legacy .doc uploads are accepted as before; python-docx only reads them
+    # when they are really OOXML files with the old extension.
+    DocumentFormat(
+        "docx", [".docx", ".doc"],
+        ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/msword"],
+        ["python-docx"],
+    ),
+    DocumentFormat("txt", [".txt"], ["text/plain"], ["text"]),
+    DocumentFormat("md", [".md", ".markdown"], ["text/markdown", "text/x-markdown"], ["text"]),
+]
+
+_BY_EXTENSION = {extension: fmt for fmt in FORMATS for extension in fmt.extensions}
+_BY_MIME_TYPE = {mime_type: fmt for fmt in FORMATS for mime_type in fmt.mime_types}
+
+
+def supported_extensions() -> List[str]:
+    return list(_BY_EXTENSION)
+
+
+def resolve_format(file_type: Optional[str] = None, filename: Optional[str] = None,
+                   mime_type: Optional[str] = None) -> DocumentFormat:
+    """Look a format up by file type ("pdf"), filename extension, then MIME type"""
+    candidates = []
+    if file_type:
+        candidates.append("." + file_type.lower().lstrip("."))
+    if filename:
+        candidates.append(os.path.splitext(filename)[1].lower())
+    for extension in candidates:
+        if extension in _BY_EXTENSION:
+            return _BY_EXTENSION[extension]
+    if mime_type:
+        fmt = _BY_MIME_TYPE.get(mime_type.split(";")[0].strip().lower())
+        if fmt:
+            return fmt
+    raise UnsupportedDocument(
+        f"Unsupported file type for text extraction: {file_type or filename or mime_type}"
+    )
+
+
+def limit_worker_memory(max_bytes: int):
+    """Pool initializer: cap the worker's address space so runaway parses raise MemoryError"""
+    if not max_bytes:
+        return
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning(f"Could not cap extraction worker memory: {e}")
+
+
+def extract_page_range(file_path: str, start: int, stop: int, backends: Sequence[str]) -> List[str]:
+    """Text of pages [start, stop) of a paged document, through a backend chain.
+
+    The first backend parses the whole range. Each later one re-parses only
+    the pages still blank, or the whole range if every earlier backend
+    failed. Each call opens its own reader, so a worker only ever holds the
+    parsed objects of one range.
+    """
+    pages: Optional[List[str]] = None
+    error: Optional[Exception] = None
+    for name in backends:
+        wanted = list(range(start, stop)) if pages is None else [
+            start + i for i, text in enumerate(pages) if not text
+        ]
+        if not wanted:
+            break
+        try:
+            texts = PAGED_BACKENDS[name](file_path, wanted)
+        except Exception as e:
+            error = error or e
+            continue
+        if pages is None:
+            pages = texts
+        else:
+            for index, text in zip(wanted, texts):
+                pages[index - start] = text
+    if pages is None:
+        raise error or UnsupportedDocument("No extraction backend configured")
+    return pages
+
+
+def extract_document(file_path: str, backends: Sequence[str]) -> str:
+    """Text of a single-page document from the first backend that succeeds"""
+    error: Optional[Exception] = None
+    for name in backends:
+        try:
+            return DOCUMENT_BACKENDS[name](file_path)
+        except Exception as e:
+            error = error or e
+    raise error or UnsupportedDocument("No extraction backend configured")
@@ -0,0 +1,502 @@
+"""Background ingestion of files uploaded to notes.
+
+The upload endpoint only spools the file (services/uploads.py), records an
+IngestionJob and returns its ID. The job then runs here, off the request:
+
+    store -> extract -> chunk -> embed -> summarize -> analyze
+
+Stages overlap wherever their inputs allow. The S3 upload runs alongside
+extraction, and pages stream from the extraction workers into chunking
+and embedding as they are parsed. Once the last page is in, the text is
+saved, and summarizing and analyzing run concurrently with whatever
+embedding is still in flight. A file whose content is already stored
+(services/document_store.py) skips to the stages its shared document
+still lacks.
+
+Stage states and page/chunk counts are persisted on the job as it goes, so
+clients can poll or subscribe from any app process. The note gets the file,
+summary and document link when the job finishes. A job whose process died
+stops making progress; fail_stale() marks it failed once it has been quiet
+for INGESTION_STALE_JOB_SECONDS, at startup and whenever it is looked up.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.database import SessionLocal
+from models.postgresql.document_text import DocumentText
+from models.postgresql.ingestion_job import IngestionJob
+from models.postgresql.note import Note
+from services.ai_service import ai_service, SUMMARY_NOT_CONFIGURED, SUMMARY_UNAVAILABLE
+from services.document_store import document_text_store, ReleasedDocument
+from services.rag_service import rag_service
+from services.storage_service import storage_service
+from services.uploads import SpooledUpload
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FAILED = "Failed to generate summary"
+INTERRUPTED = "Interrupted before it finished"
+_END_OF_PAGES = object()
+
+
+def document_storage_path(file_hash: str, file_extension: str) -> str:
+    return f"documents/{file_hash}{file_extension}"
+
+
+def note_upload_path(note_id: str, file_hash: str, file_extension: str) -> str:
+    """Key of a file kept for one note only, outside the reference-counted documents"""
+    return f"notes/{note_id}/{file_hash}{file_extension}"
+
+
+async def release_document(released: ReleasedDocument):
+    """Delete the S3 object and vectors of a document no note uses any more"""
+    if released.storage_path:
+        try:
+            await storage_service.delete_file(released.storage_path)
+        except Exception as e:
+            logger.error(f"Error deleting file from storage: {e}")
+    try:
+        await rag_service.delete_chunks(released.chunk_ids)
+    except Exception as e:
+        logger.warning(f"Error deleting vectors for document {released.content_hash}: {e}")
+
+
+class IngestionError(Exception):
+    """A stage failed in a way that fails the whole job"""
+
+
+class _Progress:
+    """Persists a running job: stage changes at once, counters at most every `interval` seconds"""
+    __slots__ = ("db", "job", "interval", "_saved_at")
+
+    def __init__(self, db: Session, job: IngestionJob, interval: float):
+        self.db = db
+        self.job = job
+        self.interval = interval
+        self._saved_at = 0.0
+
+    def stage(self, stage: str, state: str):
+        self.job.set_stage(stage, state)
+        self.save()
+
+    def count(self, **counters):
+        for name, value in counters.items():
+            setattr(self.job, name, value)
+        self.save(force=False)
+
+    def save(self, force: bool = True):
+        now = time.monotonic()
+        if force or now - self._saved_at >= self.interval:
+            self.db.commit()
+            self._saved_at = now
+
+
+class IngestionPipeline:
+    def __init__(
+        self,
+        max_concurrent_jobs: int = settings.INGESTION_MAX_CONCURRENT_JOBS,
+        progress_interval: float = settings.INGESTION_PROGRESS_INTERVAL_SECONDS,
+        stale_after: float = settings.INGESTION_STALE_JOB_SECONDS,
+    ):
+        self.progress_interval = progress_interval
+        self.stale_after = stale_after
+        self._slots = asyncio.Semaphore(max_concurrent_jobs)
+        self._tasks: Set[asyncio.Task] = set()
+        self._job_ids: Set[str] = set()  # jobs running in this process, never stale
+
+    def submit(self, db: Session, note: Note, user_id: str, upload: SpooledUpload, file_name: str,
+               file_extension: str, content_type: Optional[str] = None) -> IngestionJob:
+        """Record a job for a spooled upload and start it in the background.
+
+        The job owns the spooled file from here on. Call inside the
+        request's usage_scope so AI usage is attributed to the uploader.
+        """
+        try:
+            job = IngestionJob(
+                note_id=note.id,
+                user_id=user_id,
+                content_hash=upload.content_hash,
+                file_name=file_name,
+                status="queued",
+            )
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+            task = asyncio.get_running_loop().create_task(
+                self.run(job.id, upload, file_extension, content_type)
+            )
+        except BaseException:
+            upload.discard()
+            raise
+        self._tasks.add(task)
+        self._job_ids.add(job.id)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda _task: self._job_ids.discard(job.id))
+        return job
+
+    def latest(self, db: Session, note_id: str, job_id: Optional[str] = None) -> Optional[IngestionJob]:
+        """A note's job by ID, or its most recent one"""
+        query = db.query(IngestionJob).filter(IngestionJob.note_id == note_id)
+        if job_id:
+            job = query.filter(IngestionJob.id == job_id).first()
+        else:
+            job = query.order_by(IngestionJob.created_at.desc()).first()
+        if job is not None and not job.finished:
+            self.fail_stale(db, job.id)
+        return job
+
+    def fail_stale(self, db: Session, job_id: Optional[str] = None) -> int:
+        """Fail unfinished jobs (or the given one) that have made no progress for stale_after seconds.
+
+        Their process died with them, and with it their task and spooled
+        file, so they would otherwise stay queued or running forever.
+        Returns how many were failed.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        query = db.query(IngestionJob).filter(
+            IngestionJob.status.in_(("queued", "running")), IngestionJob.updated_at < cutoff
+        )
+        if job_id:
+            query = query.filter(IngestionJob.id == job_id)
+        stale = [job for job in query.all() if job.id not in self._job_ids]
+        for job in stale:
+            logger.warning(f"Ingestion job {job.id} made no progress for {self.stale_after}s; marking it failed")
+            self._mark_failed(job, INTERRUPTED)
+        if stale:
+            db.commit()
+        return len(stale)
+
+    async def run(self, job_id: str, upload: SpooledUpload, file_extension: str, content_type: Optional[str] = None):
+        try:
+            async with self._slots:
+                db = SessionLocal()
+                try:
+                    await self._run_job(db, job_id, upload, file_extension, content_type)
+                finally:
+                    db.close()
+        finally:
+            upload.discard()
+
+    async def _run_job(self, db: Session, job_id: str, upload: SpooledUpload, file_extension: str,
+                       content_type: Optional[str]):
+        job = db.get(IngestionJob, job_id)
+        job.status = "running"
+        progress = _Progress(db, job, self.progress_interval)
+        progress.save()
+        try:
+            await self._ingest(db, progress, upload, file_extension, content_type)
+        except asyncio.CancelledError:
+            self._fail(db, job_id, INTERRUPTED)
+            raise
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {e}")
+            self._fail(db, job_id, str(e))
+            return
+        job.status = "failed" if job.error else "completed"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+    def _fail(self, db: Session, job_id: str, error: str):
+        db.rollback()
+        self._mark_failed(db.get(IngestionJob, job_id), error)
+        db.commit()
+
+    @staticmethod
+    def _mark_failed(job: IngestionJob, error: str):
+        job.status = "failed"
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        for stage, state in job.stages.items():
+            if state == "running":
+                job.set_stage(stage, "failed")
+
+    # -- stages ------------------------------------------------------------
+
+    async def _ingest(self, db: Session, progress: _Progress, upload: SpooledUpload, file_extension: str,
+                      content_type: Optional[str]):
+        job = progress.job
+        embedding = None
+        # The job holds a reference to its document until the note is attached,
+        # so another note letting go of it can't release it in between
+        document = document_text_store.find(db, upload.content_hash)
+        if document is not None and not document_text_store.hold(db, document):
+            document = None
+        if document is None:
+            document, embedding = await self._store_and_extract(db, progress, upload, file_extension, content_type)
+        else:
+            for stage in ("store", "extract", "chunk"):
+                job.set_stage(stage, "skipped")
+            progress.save()
+
+        try:
+            note, previous_path, released = await self._finish(
+                db, progress, upload, document, embedding, file_extension, content_type
+            )
+            db.commit()
+        except BaseException:
+            if document is not None:
+                await self._drop_hold(db, document.content_hash)
+            raise
+
+        if released is not None:
+            await release_document(released)
+        if previous_path and previous_path != note.uploaded_file_path \
+                and previous_path.startswith(note_upload_path(note.id, "", "")):
+            # The replaced file was the note's own
+            try:
+                await storage_service.delete_file(previous_path)
+            except Exception as e:
+                logger.warning(f"Error deleting replaced file {previous_path}: {e}")
+        if document is not None:
+            # Q&A searches the document now, not the vectors of the note's own text
+            try:
+                await rag_service.sync_note_content(note.id, job.user_id)
+            except RuntimeError as e:
+                logger.debug(f"Not indexing note {note.id}: {e}")
+            except Exception as e:
+                logger.warning(f"Could not update vectors for note {note.id}: {e}")
+
+    async def _finish(self, db: Session, progress: _Progress, upload: SpooledUpload,
+                      document: Optional[DocumentText], embedding: Optional[asyncio.Task],
+                      file_extension: str, content_type: Optional[str]
+                      ) -> Tuple[Note, Optional[str], Optional[ReleasedDocument]]:
+        """Run the remaining stages and point the note at the file; the caller commits.
+
+        Returns the note, its previous file path and any document the note let go of.
+        """
+        job = progress.job
+        note = db.get(Note, job.note_id)
+        previous_path = note.uploaded_file_path
+        note.uploaded_file_name = job.file_name
+        note.uploaded_file_type = file_extension[1:]  # Remove the dot
+        note.uploaded_file_size = str(upload.size)
+        note.updated_at = datetime.utcnow()
+
+        if document is None:
+            # Nothing could be extracted: keep the file, without text or summary.
+            # No document counts references to it, so it moves to a key of the
+            # note's own that removing the file may delete.
+            for stage in ("embed", "summarize", "analyze"):
+                job.set_stage(stage, "skipped")
+            storage_path = note_upload_path(note.id, upload.content_hash, file_extension)
+            try:
+                await storage_service.upload_file(upload.path, storage_path, content_type=content_type)
+            except RuntimeError as e:
+                raise IngestionError(str(e))
+            await self._discard_unclaimed_upload(db, job, document_storage_path(upload.content_hash, file_extension))
+            released = document_text_store.detach(db, note.id)
+            note.uploaded_file_path = storage_path
+            note.document_summary = SUMMARY_FAILED
+        else:
+            text = document.text
+            await asyncio.gather(
+                self._embed(progress, document, embedding),
+                self._summarize(progress, document, text),
+                self._analyze(progress, text),
+            )
+            released = document_text_store.attach(db, note.id, document)
+            document_text_store.unhold(db, document.content_hash)
+            note.uploaded_file_path = document.storage_path
+            note.document_summary = document.summary or SUMMARY_FAILED
+        return note, previous_path, released
+
+    async def _drop_hold(self, db: Session, file_hash: str):
+        """Let go of the reference of a job that failed before attaching its document"""
+        db.rollback()
+        released = document_text_store.unhold(db, file_hash)
+        db.commit()
+        if released is not None:
+            await release_document(released)
+
+    async def _discard_unclaimed_upload(self, db: Session, job: IngestionJob, storage_path: str):
+        """Delete the shared object of a file nothing could be extracted from.
+
+        Kept while a stored document or another unfinished job with the same
+        content may still use it.
+        """
+        if document_text_store.find(db, job.content_hash) is not None:
+            return
+        pending = db.query(IngestionJob).filter(
+            IngestionJob.content_hash == job.content_hash,
+            IngestionJob.id != job.id,
+            IngestionJob.status.in_(("queued", "running")),
+        ).count()
+        if pending:
+            return
+        try:
+            await storage_service.delete_file(storage_path)
+        except Exception as e:
+            logger.warning(f"Error deleting unextracted upload {storage_path}: {e}")
+
+    async def _store_and_extract(self, db: Session, progress: _Progress, upload: SpooledUpload,
+                                 file_extension: str, content_type: Optional[str]
+                                 ) -> Tuple[Optional[DocumentText], Optional[asyncio.Task]]:
+        """Upload to S3 while extracting, chunking and embedding.
+
+        Returns the saved document, held for the job (None if no text could
+        be extracted), and the embedding task, which may still be running.
+        """
+        job = progress.job
+        file_hash = upload.content_hash
+        storage_path = document_storage_path(file_hash, file_extension)
+        pages: List[str] = []
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def queued_pages():
+            while True:
+                page = await queue.get()
+                if page is _END_OF_PAGES:
+                    return
+                yield page
+
+        async def chunks():
+            progress.stage("chunk", "running")
+            async for chunk in rag_service.chunk_pages(queued_pages()):
+                progress.count(chunks_created=job.chunks_created + 1)
+                yield chunk
+            progress.stage("chunk", "done")
+
+        progress.stage("store", "running")
+        store = asyncio.create_task(storage_service.upload_file(upload.path, storage_path, content_type=content_type))
+        embedding = None
+        try:
+            try:
+                rag_service._check_configured()
+            except RuntimeError:
+                job.set_stage("chunk", "skipped")
+                job.set_stage("embed", "skipped")
+            else:
+                progress.stage("embed", "running")
+                embedding = asyncio.create_task(rag_service.embed_and_store_chunk_stream(
+                    file_hash, chunks(), on_stored=lambda stored: progress.count(chunks_embedded=stored)
+                ))
+
+            progress.stage("extract", "running")
+            extraction_error = None
+            try:
+                async for _, page_text in ai_service.iter_document_pages(upload.path, file_extension[1:]):
+                    pages.append(page_text)
+                    queue.put_nowait(page_text)
+                    progress.count(pages_extracted=len(pages))
+            except Exception as e:
+                extraction_error = e
+            finally:
+                queue.put_nowait(_END_OF_PAGES)
+
+            try:
+                await store
+            except RuntimeError as e:
+                progress.stage("store", "failed")
+                await self._discard_embedding(embedding, file_hash)
+                raise IngestionError(str(e))
+            progress.stage("store", "done")
+        except BaseException:
+            store.cancel()
+            if embedding is not None:
+                embedding.cancel()
+            raise
+
+        if extraction_error is not None:
+            logger.error(f"Error extracting text from uploaded file: {extraction_error}")
+            await self._discard_embedding(embedding, file_hash)
+            job.error = "Could not extract text from the uploaded file"
+            progress.stage("extract", "failed")
+            return None, None
+
+        document = document_text_store.save(
+            db, file_hash, pages,
+            storage_path=storage_path,
+            file_type=file_extension[1:],
+            file_size=upload.size,
+        )
+        if not document_text_store.hold(db, document):
+            # A concurrent upload stored it first, and its note already let go
+            await self._discard_embedding(embedding, file_hash)
+            raise IngestionError("The document was removed while it was processed")
+        progress.stage("extract", "done")
+        return document, embedding
+
+    async def _discard_embedding(self, embedding: Optional[asyncio.Task], file_hash: str):
+        """Wait for an abandoned document's embedding and delete what it stored"""
+        if embedding is None:
+            return
+        chunk_ids = (await asyncio.gather(embedding, return_exceptions=True))[0]
+        if isinstance(chunk_ids, BaseException):
+            return
+        try:
+            await rag_service.delete_chunks(chunk_ids)
+        except Exception as e:
+            logger.warning(f"Error deleting vectors for document {file_hash}: {e}")
+
+    async def _embed(self, progress: _Progress, document: DocumentText, embedding: Optional[asyncio.Task]):
+        """Finish the streamed embedding, or embed a stored document an earlier upload could not"""
+        if embedding is None and document.chunk_count is not None:
+            if progress.job.stages["embed"] == "pending":
+                progress.stage("embed", "skipped")
+            return
+        try:
+            if embedding is not None:
+                chunk_ids = await embedding
+            else:
+                rag_service._check_configured()
+                progress.stage("embed", "running")
+                chunk_ids = await rag_service.embed_and_store_chunks(
+                    document.content_hash, document.text, document.offsets
+                )
+        except Exception as e:
+            logger.warning(f"Skipping RAG embedding for document {document.content_hash}: {e}")
+            progress.stage("embed", "skipped" if isinstance(e, RuntimeError) and embedding is None else "failed")
+            return
+        if document.chunk_count is None:
+            document.chunk_count = len(chunk_ids)
+        progress.count(chunks_embedded=len(chunk_ids))
+        progress.stage("embed", "done")
+
+    async def _summarize(self, progress: _Progress, document: DocumentText, text: str):
+        if document.summary is not None:
+            progress.stage("summarize", "skipped")
+            return
+        progress.stage("summarize", "running")
+        summary = await ai_service.generate_document_summary(text)
+        if summary in (SUMMARY_NOT_CONFIGURED, SUMMARY_UNAVAILABLE):
+            progress.stage("summarize", "failed")
+            return
+        document.summary = summary
+        progress.stage("summarize", "done")
+
+    async def _analyze(self, progress: _Progress, text: str):
+        progress.stage("analyze", "running")
+        analysis = await ai_service.analyze_document_for_quiz(text)
+        progress.job.analysis = json.dumps(analysis)
+        progress.stage("analyze", "done")
+
+    def start(self):
+        """Fail jobs a previous app process left unfinished (called on app startup)"""
+        db = SessionLocal()
+        try:
+            failed = self.fail_stale(db)
+        except Exception as e:
+            logger.error(f"Could not check for interrupted ingestion jobs: {e}")
+            return
+        finally:
+            db.close()
+        if failed:
+            logger.info(f"Marked {failed} interrupted ingestion job(s) failed")
+
+    async def stop(self):
+        """Cancel running jobs (called on app shutdown); they are recorded as failed"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Global ingestion pipeline instance
+ingestion_pipeline = IngestionPipeline()
@@ -0,0 +1,189 @@
+"""BM25 keyword search over a document's chunks, fused with vector search.
+
+Dense embeddings blur exact terms: a formula, a name or a rare word in the
+question often ranks below chunks that are merely on-topic. Each embedded
+document therefore also gets a small inverted index over the same chunks,
+built once at ingestion and stored in `document_keyword_indexes`.
+
+Postings are flat numpy arrays: for the i-th term (in sorted order),
+positions[offsets[i]:offsets[i + 1]] are the chunks containing it and
+freqs[...] how often. Scoring a question is a handful of vectorized
+updates to one score per chunk, and the index serializes with
+np.savez_compressed. Loaded indexes are kept in an in-process LRU.
+
+RAGService merges the BM25 ranking with the vector ranking through
+reciprocal_rank_fusion, so a chunk that either retriever ranks highly
+makes the top k.
+"""
+import io
+import logging
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.postgresql.document_text import DocumentKeywordIndex
+
+logger = logging.getLogger(__name__)
+
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = settings.RAG_RRF_K) -> List[Tuple[str, float]]:
+    """Merge ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda entry: entry[1], reverse=True)
+
+
+class KeywordIndex:
+    def __init__(self, chunk_ids: List[str], terms: List[str], offsets: np.ndarray,
+                 positions: np.ndarray, freqs: np.ndarray, lengths: np.ndarray):
+        self.chunk_ids = chunk_ids
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.positions = positions
+        self.freqs = freqs
+        self.lengths = lengths
+        self.average_length = float(lengths.mean()) if len(lengths) else 0.0
+
+    @classmethod
+    def build(cls, chunk_ids: List[str], texts: List[str]) -> "KeywordIndex":
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths = []
+        for position, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                chunks, freqs = postings.setdefault(term, ([], []))
+                chunks.append(position)
+                freqs.append(count)
+        terms = sorted(postings)
+        sizes = [len(postings[term][0]) for term in terms]
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        positions = np.fromiter((p for term in terms for p in postings[term][0]), dtype=np.int32, count=int(offsets[-1]))
+        freqs = np.fromiter((min(f, 65535) for term in terms for f in postings[term][1]), dtype=np.uint16, count=int(offsets[-1]))
+        return cls(list(chunk_ids), terms, offsets, positions, freqs, np.array(lengths, dtype=np.int32))
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """The top_k chunk ids by BM25 score, best first; chunks sharing no term with the query are left out"""
+        count = len(self.chunk_ids)
+        if not count or top_k <= 0:
+            return []
+        scores = np.zeros(count, dtype=np.float32)
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / max(self.average_length, 1e-9))
+        for term in set(tokenize(query)):
+            i = self.terms.get(term)
+            if i is None:
+                continue
+            start, stop = self.offsets[i], self.offsets[i + 1]
+            positions = self.positions[start:stop]
+            freqs = self.freqs[start:stop].astype(np.float32)
+            # Lucene's BM25 idf: always positive, so one- and two-chunk documents still rank,
+            # while a term in most chunks ("the") weighs little
+            idf = math.log(1 + (count - len(positions) + 0.5) / (len(positions) + 0.5))
+            # Each chunk appears once per term, so plain fancy-index addition is safe
+            scores[positions] += idf * freqs * (BM25_K1 + 1) / (freqs + norms[positions])
+        matched = np.flatnonzero(scores)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self.chunk_ids[position], float(scores[position])) for position in matched]
+
+    def to_bytes(self) -> bytes:
+        terms = sorted(self.terms, key=self.terms.get)
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            chunk_ids=np.array(self.chunk_ids, dtype=str),
+            terms=np.array(terms, dtype=str),
+            offsets=self.offsets,
+            positions=self.positions,
+            freqs=self.freqs,
+            lengths=self.lengths,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "KeywordIndex":
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls(
+                arrays["chunk_ids"].tolist(),
+                arrays["terms"].tolist(),
+                arrays["offsets"],
+                arrays["positions"],
+                arrays["freqs"],
+                arrays["lengths"],
+            )
+
+
+class KeywordIndexStore:
+    def __init__(self, cache_size: int = settings.RAG_KEYWORD_INDEX_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, KeywordIndex]" = OrderedDict()
+        # Loads and saves run in the threadpool
+        self._lock = threading.Lock()
+
+    def _remember(self, document_hash: str, index: KeywordIndex):
+        with self._lock:
+            self._cache[document_hash] = index
+            self._cache.move_to_end(document_hash)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def save(self, db: Session, document_hash: str, chunk_ids: List[str], texts: List[str]) -> KeywordIndex:
+        """Build and store a document's index, replacing any earlier one; the caller commits"""
+        index = KeywordIndex.build(chunk_ids, texts)
+        db.merge(DocumentKeywordIndex(content_hash=document_hash, chunk_count=len(chunk_ids), data=index.to_bytes()))
+        self._remember(document_hash, index)
+        return index
+
+    def get(self, db: Session, document_hash: str) -> Optional[KeywordIndex]:
+        with self._lock:
+            index = self._cache.get(document_hash)
+            if index is not None:
+                self._cache.move_to_end(document_hash)
+                return index
+        record = db.get(DocumentKeywordIndex, document_hash)
+        if record is None:
+            return None
+        try:
+            index = KeywordIndex.from_bytes(record.data)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Keyword index for document {document_hash} is corrupt: {e}")
+            return None
+        self._remember(document_hash, index)
+        return index
+
+    def delete(self, db: Session, document_hashes: List[str]):
+        """Drop documents' indexes; the caller commits"""
+        with self._lock:
+            for document_hash in document_hashes:
+                self._cache.pop(document_hash, None)
+        if document_hashes:
+            db.query(DocumentKeywordIndex).filter(
+                DocumentKeywordIndex.content_hash.in_(document_hashes)
+            ).delete(synchronize_session=False)
+
+
+# Global keyword index store instance
+keyword_index_store = KeywordIndexStore()
@@ -1,133 +1,497 @@
-import io
+import asyncio
 import logging
-from typing import List, Optional
+import weakref
+from typing import AsyncIterator, Callable, List, Optional, Tuple
 from uuid import uuid4
-import openai
-from pinecone import Pinecone
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from models.postgresql.note import Note
 from models.postgresql.user import User
 from models.postgresql.chat_log import ChatLog
 from core.config import settings
+from core.database import SessionLocal
+from services.ai_service import ai_service
+from services.single_flight import SingleFlight
+from services.ai_scheduler import INTERACTIVE, BATCH
+from services.vector_index import create_index
+from services.extraction import extract_document_pages
+from services.extractors import resolve_format
+from services.document_store import document_text_store, content_hash
+from services.chunking import Chunk, SentenceChunker
+from services.chunk_store import chunk_store, content_chunk_id
+from services.keyword_index import keyword_index_store, reciprocal_rank_fusion
+from services.answer_cache import UNANSWERED, answer_cache, normalize_question
+from services.embedding import EmbeddingBatcher
+from services.embedding_cache import embedding_cache
 
 logger = logging.getLogger(__name__)
 
-try:
-    import pdfplumber
-except ImportError:
-    pdfplumber = None
-try:
-    import docx
-except ImportError:
-    docx = None
-
-client = openai.OpenAI(api_key=settings.OPENAI_KEY) if settings.OPENAI_KEY else None
+EMBEDDING_MODEL = 'text-embedding-ada-002'
+ANSWER_MAX_TOKENS = 256
+ANSWER_TEMPERATURE = 0.2
 
-# Pinecone holds the document chunk embeddings used for RAG note Q&A. Init is
-# wrapped so a missing/invalid key disables RAG features instead of crashing
-# the whole app at import time (notes.py imports this module on startup).
+# The vector index (Pinecone by default, see VECTOR_DB_TYPE) holds the document
+# chunk embeddings used for RAG note Q&A. Init is wrapped so a missing/invalid
+# key disables RAG features instead of crashing the whole app at import time
+# (notes.py imports this module on startup).
 index = None
 try:
-    if settings.VECTOR_DB_API_KEY:
-        pc = Pinecone(api_key=settings.VECTOR_DB_API_KEY)
-        index = pc.Index(settings.VECTOR_DB_INDEX_NAME)
+    index = create_index()
 except Exception as e:
-    logger.warning(f"Pinecone init failed, RAG features disabled: {e}")
+    logger.warning(f"Vector index init failed, RAG features disabled: {e}")
 
 
 class RAGService:
     def __init__(self):
         self.index = index
+        self.flight = SingleFlight()
+        self.embedder = EmbeddingBatcher(
+            lambda texts, priority: ai_service.embed(texts, EMBEDDING_MODEL, priority=priority)
+        )
+        self.cache = embedding_cache
+        self.answers = answer_cache
+        # One content sync per note at a time; entries go away once unused
+        self._note_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
 
     def _check_configured(self):
-        if not client or not self.index:
+        if not ai_service.provider.configured or not self.index:
             raise RuntimeError("RAG is not configured (missing OPENAI_KEY or VECTOR_DB_API_KEY)")
 
-    def extract_text(self, file_bytes: bytes, filename: str) -> str:
-        if filename.lower().endswith('.pdf'):
-            if not pdfplumber:
-                raise ImportError('pdfplumber is required for PDF extraction')
-            with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-                return '\n'.join(page.extract_text() or '' for page in pdf.pages)
-        elif filename.lower().endswith('.docx'):
-            if not docx:
-                raise ImportError('python-docx is required for DOCX extraction')
-            doc = docx.Document(io.BytesIO(file_bytes))
-            return '\n'.join([para.text for para in doc.paragraphs])
-        else:
-            raise ValueError('Unsupported file type')
+    async def extract_text(self, file_bytes: bytes, filename: str) -> str:
+        pages = await extract_document_pages(file_bytes, resolve_format(filename=filename))
+        return '\n'.join(pages)
+
+    def chunk_text(self, text: str, page_offsets: Optional[List[int]] = None) -> List[Chunk]:
+        return SentenceChunker().chunk(text, page_offsets)
 
-    def chunk_text(self, text: str, chunk_size: int = 500) -> List[str]:
-        words = text.split()
-        return [' '.join(words[i:i + chunk_size]) for i in range(0, len(words), chunk_size)]
+    async def chunk_pages(self, pages: AsyncIterator[str]) -> AsyncIterator[Chunk]:
+        """chunk_text over a stream of pages: same chunks as for the joined text, emitted as soon as they fill"""
+        chunker = SentenceChunker()
+        async for page in pages:
+            for chunk in chunker.feed(page):
+                yield chunk
+        for chunk in chunker.finish():
+            yield chunk
 
-    def embed_chunks(self, chunks: List[str]) -> List[List[float]]:
-        response = client.embeddings.create(input=chunks, model='text-embedding-ada-002')
-        return [d.embedding for d in response.data]
+    async def embed_chunks(self, chunks: List[str], priority: str = BATCH) -> List[List[float]]:
+        """Embed texts, calling the API only for those not already in the embedding cache"""
+        vectors = await run_in_threadpool(self.cache.get_many, EMBEDDING_MODEL, chunks)
+        missing = list(dict.fromkeys(text for text, vector in zip(chunks, vectors) if vector is None))
+        if missing:
+            embedded = dict(zip(missing, await self.embedder.embed(missing, priority=priority)))
+            await run_in_threadpool(self.cache.put_many, EMBEDDING_MODEL, missing, list(embedded.values()))
+            vectors = [vector if vector is not None else embedded[text] for text, vector in zip(chunks, vectors)]
+        return vectors
 
-    def embed_and_store_chunks(self, note_id: str, user_id: str, text: str) -> List[str]:
-        """Chunk + embed + upsert text into Pinecone for an existing note. Returns chunk ids."""
+    def _save_chunk_texts(self, document_hash: str, chunks: List[Chunk], first_index: int) -> List[str]:
+        db = SessionLocal()
+        try:
+            chunk_ids = chunk_store.save(db, document_hash, chunks, first_index)
+            db.commit()
+            return chunk_ids
+        finally:
+            db.close()
+
+    async def _store_chunks(self, document_hash: str, chunks: List[Chunk], first_index: int = 0) -> List[str]:
+        """Embed chunks and store them: text in the chunk store, then only id and filter fields in the index"""
+        embeddings = await self.embed_chunks([chunk.text for chunk in chunks])
+        chunk_ids = await run_in_threadpool(self._save_chunk_texts, document_hash, chunks, first_index)
+        pinecone_vectors = [
+            (chunk_id, emb, {"document_hash": document_hash})
+            for chunk_id, emb in zip(chunk_ids, embeddings)
+        ]
+        await run_in_threadpool(self.index.upsert, vectors=pinecone_vectors)
+        return chunk_ids
+
+    async def embed_and_store_chunks(self, document_hash: str, text: str,
+                                     page_offsets: Optional[List[int]] = None) -> List[str]:
+        """Chunk + embed + upsert a stored document's text into Pinecone. Returns chunk ids.
+
+        Vectors are keyed by content hash, so every note sharing the document
+        shares them too.
+        """
         self._check_configured()
-        chunks = self.chunk_text(text)
+        chunks = self.chunk_text(text, page_offsets)
         if not chunks:
             return []
-        embeddings = self.embed_chunks(chunks)
-        chunk_ids = []
-        pinecone_vectors = []
-        for i, (chunk, emb) in enumerate(zip(chunks, embeddings)):
-            chunk_id = f"{note_id}-{i}"
-            chunk_ids.append(chunk_id)
-            pinecone_vectors.append((chunk_id, emb, {"note_id": note_id, "user_id": user_id, "chunk": chunk}))
-        self.index.upsert(vectors=pinecone_vectors)
+        chunk_ids = await self._store_chunks(document_hash, chunks)
+        await self._index_keywords(document_hash, chunk_ids, [chunk.text for chunk in chunks])
+        return chunk_ids
+
+    def _save_keyword_index(self, document_hash: str, chunk_ids: List[str], texts: List[str]):
+        db = SessionLocal()
+        try:
+            keyword_index_store.save(db, document_hash, chunk_ids, texts)
+            db.commit()
+        finally:
+            db.close()
+
+    async def _index_keywords(self, document_hash: str, chunk_ids: List[str], texts: List[str]):
+        """Build the document's BM25 index; without one, questions fall back to vector search alone"""
+        try:
+            await run_in_threadpool(self._save_keyword_index, document_hash, chunk_ids, texts)
+        except Exception as e:
+            logger.warning(f"Keyword index for document {document_hash} not built: {e}")
+
+    async def embed_and_store_chunk_stream(self, document_hash: str, chunks: AsyncIterator[Chunk],
+                                           on_stored: Optional[Callable[[int], None]] = None) -> List[str]:
+        """embed_and_store_chunks for a document still being extracted.
+
+        Chunks are embedded and upserted in batches as they arrive. Each
+        batch is sized by the embedder's token and input limits and is
+        stored as soon as it fills, while later chunks are still arriving;
+        the embedder caps how many run at once. `on_stored` is called with
+        the number of chunks stored so far after every batch.
+
+        The chunk stream is always consumed to the end, so a caller
+        collecting pages gets the whole document even when RAG is
+        unconfigured or embedding fails; that first error is raised once
+        the stream is exhausted.
+        """
+        error = None
+        try:
+            self._check_configured()
+        except RuntimeError as e:
+            error = e
+        stored = 0
+        pending: List[asyncio.Task] = []
+        batch: List[Chunk] = []
+        batch_tokens = 0
+        texts: List[str] = []
+
+        async def store(batch: List[Chunk], first_index: int):
+            nonlocal error, stored
+            try:
+                await self._store_chunks(document_hash, batch, first_index)
+            except Exception as e:
+                error = error or e
+                return
+            stored += len(batch)
+            if on_stored:
+                on_stored(stored)
+
+        def flush():
+            nonlocal batch, batch_tokens
+            pending.append(asyncio.create_task(store(batch, len(texts) - len(batch))))
+            batch, batch_tokens = [], 0
+
+        try:
+            async for chunk in chunks:
+                if error:
+                    continue
+                if not self.embedder.fits(batch_tokens, len(batch), chunk.tokens):
+                    flush()
+                batch.append(chunk)
+                batch_tokens += chunk.tokens
+                texts.append(chunk.text)
+            if batch and not error:
+                flush()
+            await asyncio.gather(*pending)
+        finally:
+            for task in pending:
+                task.cancel()
+        if error:
+            raise error
+        chunk_ids = [f"{document_hash}-{i}" for i in range(len(texts))]
+        await self._index_keywords(document_hash, chunk_ids, texts)
         return chunk_ids
 
-    def store_note(self, db: Session, user_id: str, file_bytes: bytes, filename: str, note_title: Optional[str] = None) -> str:
+    async def store_note(self, db: Session, user_id: str, file_bytes: bytes, filename: str, note_title: Optional[str] = None) -> str:
         self._check_configured()
-        text = self.extract_text(file_bytes, filename)
+        document_format = resolve_format(filename=filename)
+        pages = await extract_document_pages(file_bytes, document_format)
         note_id = str(uuid4())
-        note = Note(id=note_id, user_id=user_id, title=note_title or filename, content=text)
+        note = Note(id=note_id, user_id=user_id, title=note_title or filename, content='\n'.join(pages))
         db.add(note)
+        db.flush()
+        document = document_text_store.save(
+            db, content_hash(file_bytes), pages, file_type=document_format.name, file_size=len(file_bytes)
+        )
+        document_text_store.attach(db, note_id, document)
         db.commit()
-        db.refresh(note)
-        self.embed_and_store_chunks(note_id, user_id, text)
+        if document.chunk_count is None:
+            chunk_ids = await self.embed_and_store_chunks(document.content_hash, document.text, document.offsets)
+            document.chunk_count = len(chunk_ids)
+            db.commit()
         return note_id
 
-    def query(self, db: Session, note_id: str, question: str, user_id: str, top_k: int = 3) -> str:
+    def _note_content_state(self, note_id: str, scope: str) -> Tuple[Optional[str], List[str], bool]:
+        """(content, stored chunk ids, whether Q&A searches an attached document instead)"""
+        db = SessionLocal()
+        try:
+            note = db.query(Note).filter(Note.id == note_id, Note.is_active == True).first()
+            searches_document = note is not None and document_text_store.embedded_hash(db, note_id) is not None
+            return (note.content if note else None), chunk_store.chunk_ids(db, scope), searches_document
+        finally:
+            db.close()
+
+    def _apply_note_chunks(self, scope: str, chunk_ids: List[str], chunks: List[Chunk], removed: List[str]):
+        db = SessionLocal()
+        try:
+            chunk_store.delete(db, removed)
+            chunk_store.save(db, scope, chunks, chunk_ids=chunk_ids)
+            db.commit()
+        finally:
+            db.close()
+
+    async def sync_note_content(self, note_id: str, user_id: str) -> Tuple[int, int]:
+        """Bring the vectors of a note's own text in line with Note.content.
+
+        Chunk boundaries are content-defined and chunks are named by a hash
+        of their text, so after an edit only chunks with new text are
+        embedded, chunks that disappeared are deleted, and the rest are left
+        alone. They are searched with the note's (note_id, user_id) filter,
+        which Q&A uses for notes without an uploaded file. While a document
+        is attached Q&A never searches them, so, as for a deleted note, all
+        of them are deleted. Returns (embedded, deleted).
+        """
         self._check_configured()
+        scope = f"note-{note_id}"
+        lock = self._note_locks.setdefault(note_id, asyncio.Lock())
+        async with lock:
+            # Read the content under the lock, so back-to-back edits converge on the latest
+            content, existing, searches_document = await run_in_threadpool(self._note_content_state, note_id, scope)
+            if searches_document:
+                content = None
+            wanted = {}
+            for chunk in SentenceChunker(content_defined=True).chunk(content or ""):
+                wanted.setdefault(content_chunk_id(scope, chunk.text), chunk)
+            current = set(existing)
+            added = [chunk_id for chunk_id in wanted if chunk_id not in current]
+            removed = [chunk_id for chunk_id in existing if chunk_id not in wanted]
+            if not added and not removed:
+                return 0, 0
+            embeddings = await self.embed_chunks([wanted[chunk_id].text for chunk_id in added]) if added else []
+            # Rows first (unchanged chunks may have moved), then vectors, as for documents
+            await run_in_threadpool(self._apply_note_chunks, scope, list(wanted), list(wanted.values()), removed)
+            if added:
+                metadata = {"note_id": note_id, "user_id": user_id}
+                await run_in_threadpool(
+                    self.index.upsert, vectors=[(chunk_id, emb, metadata) for chunk_id, emb in zip(added, embeddings)]
+                )
+            if removed:
+                await run_in_threadpool(self.index.delete, ids=removed)
+            logger.info(f"Note {note_id} content synced: {len(added)} chunks embedded, {len(removed)} deleted, "
+                        f"{len(wanted) - len(added)} unchanged")
+            return len(added), len(removed)
+
+    async def _retrieve(self, note_id: str, question: str, user_id: str, top_k: int,
+                        document_hash: Optional[str] = None) -> List[dict]:
+        """Embed the question and return the closest stored chunks for this note.
+
+        Documents embedded by content hash are searched by hash; notes
+        uploaded before that keep their per-note vectors. With
+        RAG_HYBRID_SEARCH, a document's BM25 ranking is fused with the
+        vector ranking, so exact terms the embedding blurs still make the
+        top k.
+        """
         # RAG pipeline: embed the question, find the closest stored chunks for
         # this note via Pinecone similarity search, then ask the LLM to answer
-        # using only that retrieved context.
-        q_emb = self.embed_chunks([question])[0]
-        results = self.index.query(vector=q_emb, top_k=top_k, include_metadata=True, filter={"note_id": note_id, "user_id": user_id})
-        context = '\n'.join([match['metadata']['chunk'] for match in results['matches']])
+        # using only that retrieved context. The embedding goes through the
+        # shared async OpenAI pool; the Pinecone client is sync, so its query
+        # runs in the threadpool instead of on the event loop.
+        hybrid = settings.RAG_HYBRID_SEARCH and document_hash is not None
+        candidates = max(top_k, settings.RAG_HYBRID_CANDIDATES) if hybrid else top_k
+
+        async def vector_search() -> list:
+            q_emb = await self._question_embedding(question)
+            results = await run_in_threadpool(
+                self.index.query,
+                vector=q_emb,
+                top_k=candidates,
+                include_metadata=True,
+                filter={"document_hash": document_hash} if document_hash else {"note_id": note_id, "user_id": user_id},
+            )
+            return results['matches']
+
+        if hybrid:
+            matches, keyword_ids = await asyncio.gather(
+                vector_search(), run_in_threadpool(self._keyword_search, document_hash, question, candidates)
+            )
+            matches = self._fuse(matches, keyword_ids)
+        else:
+            matches = await vector_search()
+        return await run_in_threadpool(self._with_text, matches[:top_k])
+
+    async def _question_embedding(self, question: str) -> List[float]:
+        vector = self.answers.get_embedding(question)
+        if vector is None:
+            vector = (await self.embed_chunks([normalize_question(question)], priority=INTERACTIVE))[0]
+            self.answers.set_embedding(question, vector)
+        return vector
+
+    def _keyword_search(self, document_hash: str, question: str, top_k: int) -> List[str]:
+        """Chunk ids of the document ranked by BM25; documents without an index get one from the chunk store"""
+        db = SessionLocal()
+        try:
+            index = keyword_index_store.get(db, document_hash)
+            if index is None:
+                chunk_ids, texts = chunk_store.texts(db, document_hash)
+                if not chunk_ids:
+                    return []
+                index = keyword_index_store.save(db, document_hash, chunk_ids, texts)
+                db.commit()
+            hits = index.search(question, top_k)
+            # Chunks that only share common words with the question would otherwise
+            # get as much say in the fusion as an exact hit on a rare term
+            floor = hits[0][1] * settings.RAG_KEYWORD_MIN_SCORE_RATIO if hits else 0.0
+            return [chunk_id for chunk_id, score in hits if score >= floor]
+        except Exception as e:
+            logger.warning(f"Keyword search on document {document_hash} failed, using vectors only: {e}")
+            return []
+        finally:
+            db.close()
+
+    def _fuse(self, matches: list, keyword_ids: List[str]) -> list:
+        """Vector matches and BM25 ids merged by reciprocal-rank fusion, as matches scored by fused score"""
+        if not keyword_ids:
+            return matches
+        by_id = {match['id']: match for match in matches}
+        fused = reciprocal_rank_fusion([[match['id'] for match in matches], keyword_ids])
+        return [
+            {"id": chunk_id, "score": score, "metadata": by_id[chunk_id]['metadata'] if chunk_id in by_id else {}}
+            for chunk_id, score in fused
+        ]
+
+    def _with_text(self, matches) -> List[dict]:
+        """Matches as {id, score, text, page}, with text read from the chunk store in one batch.
+
+        Vectors stored before the chunk store carry their text in metadata.
+        """
+        db = SessionLocal()
+        try:
+            stored = chunk_store.fetch(db, [match['id'] for match in matches])
+        finally:
+            db.close()
+        resolved = []
+        for match in matches:
+            chunk = stored.get(match['id'])
+            metadata = match['metadata'] or {}
+            resolved.append({
+                "id": match['id'],
+                "score": match['score'],
+                "text": chunk.text if chunk else metadata.get('chunk', ''),
+                "page": chunk.page if chunk else metadata.get('page'),
+            })
+        return resolved
+
+    def _build_messages(self, matches: List[dict], question: str) -> List[dict]:
+        context = '\n'.join([match['text'] for match in matches])
 
         prompt = f"""You are a helpful assistant. Only answer based on the context below.
-If the answer isn't found in the context, reply 'This information is not present in the uploaded file.'
+If the answer isn't found in the context, reply '{UNANSWERED}'
 
 Context:
 {context}
 
 User Question: {question}"""
 
-        response = client.chat.completions.create(
-            model=settings.OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": "You answer questions using only the provided document context."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=256,
-            temperature=0.2,
+        return [
+            {"role": "system", "content": "You answer questions using only the provided document context."},
+            {"role": "user", "content": prompt},
+        ]
+
+    async def _answer(self, note_id: str, question: str, user_id: str, top_k: int,
+                      document_hash: Optional[str] = None) -> str:
+        matches = await self._retrieve(note_id, question, user_id, top_k, document_hash)
+        return await ai_service._chat_completion(
+            self._build_messages(matches, question),
+            max_tokens=ANSWER_MAX_TOKENS,
+            temperature=ANSWER_TEMPERATURE,
+            request_type="note_qa",
         )
-        answer = response.choices[0].message.content.strip()
+
+    async def query(self, db: Session, note_id: str, question: str, user_id: str, top_k: int = 3,
+                    document_hash: Optional[str] = None) -> str:
+        self._check_configured()
+        answer = await run_in_threadpool(self._cached_answer, document_hash, question) if document_hash else None
+        if answer is None:
+            # Concurrent identical questions on the same document share one
+            # retrieval + completion; every caller still gets its own ChatLog entry.
+            scope = document_hash or f"{note_id}:{user_id}"
+            flight_key = f"{scope}:{top_k}:{normalize_question(question)}"
+            answer = await self.flight.do(flight_key, lambda: self._answer(note_id, question, user_id, top_k, document_hash))
+            if document_hash:
+                self.answers.set_answer(document_hash, question, answer)
 
         chat_log = ChatLog(user_id=user_id, note_id=note_id, question=question, answer=answer)
         db.add(chat_log)
         db.commit()
         return answer
 
+    def _cached_answer(self, document_hash: str, question: str) -> Optional[str]:
+        db = SessionLocal()
+        try:
+            return self.answers.get_answer(db, document_hash, question)
+        finally:
+            db.close()
+
+    async def stream_query(self, note_id: str, question: str, user_id: str, top_k: int = 3,
+                           document_hash: Optional[str] = None) -> AsyncIterator[Tuple[str, dict]]:
+        """Yield (event, data) pairs: retrieved-context metadata, then answer tokens, then done.
+
+        A cached answer comes back as one token event after an empty
+        context. The full answer is written to ChatLog once generation
+        finishes. The request's session may already be closed by then, so
+        this opens its own.
+        """
+        self._check_configured()
+        answer = await run_in_threadpool(self._cached_answer, document_hash, question) if document_hash else None
+        if answer is not None:
+            yield "context", {"note_id": note_id, "chunks": [], "cached": True}
+            yield "token", {"delta": answer}
+        else:
+            matches = await self._retrieve(note_id, question, user_id, top_k, document_hash)
+            yield "context", {
+                "note_id": note_id,
+                "chunks": [
+                    {"id": match['id'], "score": match['score'], "page": match['page']}
+                    for match in matches
+                ],
+            }
+
+            parts = []
+            async for delta in ai_service._stream_chat_completion(
+                self._build_messages(matches, question),
+                max_tokens=ANSWER_MAX_TOKENS,
+                temperature=ANSWER_TEMPERATURE,
+                request_type="note_qa",
+            ):
+                parts.append(delta)
+                yield "token", {"delta": delta}
+            answer = ''.join(parts).strip()
+            if document_hash:
+                self.answers.set_answer(document_hash, question, answer)
+
+        db = SessionLocal()
+        try:
+            db.add(ChatLog(user_id=user_id, note_id=note_id, question=question, answer=answer))
+            db.commit()
+        finally:
+            db.close()
+        yield "done", {"note_id": note_id, "question": question, "answer": answer}
+
     def delete_note_vectors(self, note_id: str, user_id: str, chunk_ids: List[str]):
         self._check_configured()
         self.index.delete(ids=chunk_ids)
 
+    def _delete_chunk_texts(self, chunk_ids: List[str]):
+        db = SessionLocal()
+        try:
+            document_hashes = chunk_store.document_hashes(db, chunk_ids)
+            keyword_index_store.delete(db, document_hashes)
+            for document_hash in document_hashes:
+                self.answers.invalidate(document_hash)
+            chunk_store.delete(db, chunk_ids)
+            db.commit()
+        finally:
+            db.close()
+
+    async def delete_chunks(self, chunk_ids: List[str]):
+        if chunk_ids and self.index:
+            await run_in_threadpool(self.index.delete, ids=chunk_ids)
+        if chunk_ids:
+            await run_in_threadpool(self._delete_chunk_texts, chunk_ids)
+
 
 rag_service = RAGService()
@@ -0,0 +1,55 @@
+"""Request coalescing for identical concurrent async calls.
+
+When several callers ask for the same thing at the same time (a whole room
+hitting "generate quiz" on one note, or the same @chatbot question twice),
+only the first starts the work; the rest await the same in-flight task. The
+task is reference-counted: it is cancelled as soon as no caller is waiting
+on it, so an abandoned request does not keep burning LLM tokens.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `fn()` once per key among concurrent callers and share its result"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+        else:
+            logger.debug(f"Coalesced request onto in-flight call {key[:12]}")
+
+        call.waiters += 1
+        try:
+            # shield() keeps one caller's cancellation from cancelling the
+            # shared task out from under the others
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nobody is waiting any more: drop it so a later caller starts fresh
+                self._forget(key, call)
+                call.task.cancel()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
@@ -7,7 +7,10 @@ import logging
 from typing import Optional
 
 import boto3
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError, NoCredentialsError
+from starlette.concurrency import run_in_threadpool
 
 from core.config import settings
 
@@ -46,6 +49,27 @@ class StorageService:
             raise RuntimeError(f"File storage upload failed: {e}")
         return key
 
+    async def upload_file(self, file_path: str, key: str, content_type: Optional[str] = None) -> str:
+        """Stream a local file to S3 under `key`, in multipart parts for large files.
+
+        Only one part is read into memory at a time, so uploads never need
+        the whole file as bytes.
+        """
+        self._check_configured()
+        extra_args = {"ContentType": content_type} if content_type else {}
+        config = TransferConfig(
+            multipart_threshold=settings.S3_MULTIPART_CHUNK_SIZE,
+            multipart_chunksize=settings.S3_MULTIPART_CHUNK_SIZE,
+        )
+        try:
+            await run_in_threadpool(
+                self.client.upload_file, file_path, self.bucket, key, ExtraArgs=extra_args, Config=config
+            )
+        except (ClientError, NoCredentialsError, S3UploadFailedError) as e:
+            logger.error(f"S3 upload failed for key {key}: {e}")
+            raise RuntimeError(f"File storage upload failed: {e}")
+        return key
+
     async def download_file(self, key: str) -> bytes:
         """Return the raw bytes stored at `key`."""
         self._check_configured()
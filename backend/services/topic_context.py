@@ -0,0 +1,247 @@
+"""Rolling conversation context for the group-chat assistant.
+
+Each topic keeps its last K decrypted messages in memory plus a running
+summary of everything older. Messages are recorded as they are sent; once
+enough of them have scrolled out of the recent window they are folded into
+the summary by one background LLM call, and the summary is saved on the
+topic's chat_logs document with its watermark: the message_id of the last
+log message it covers. The watermark's position is looked up in the log
+itself, and a save only lands if it moves the watermark forward, so app
+processes folding the same topic never roll each other's summary back.
+
+The full log is never re-read: a topic is loaded from Mongo once per worker
+(its tail, plus whatever lies between the saved watermark and that tail),
+and building the context for a request only walks the bounded in-memory
+window.
+"""
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.config import settings
+from core.database import get_mongo_db
+from services.ai_service import ai_service, estimate_tokens
+from services.ai_usage import usage_scope
+from services.encryption_service import encryption_service
+
+logger = logging.getLogger(__name__)
+
+TopicKey = Tuple[str, str]
+# The log's message ids, in order, inside an aggregation expression
+_MESSAGE_IDS = {"$ifNull": ["$messages.message_id", []]}
+
+
+class TopicContext:
+    def __init__(self):
+        self.recent: deque = deque()
+        # Scrolled out of `recent` but not yet folded into `summary`
+        self.pending: List[Dict[str, Any]] = []
+        # Recorded while the topic was still loading from Mongo
+        self.early: List[Dict[str, Any]] = []
+        self.summary = ""
+        self.watermark_id: Optional[str] = None  # last log message covered by `summary`
+        self.loaded = False
+        self.lock = asyncio.Lock()
+        self.folding: Optional[asyncio.Task] = None
+
+
+class TopicContextStore:
+    def __init__(
+        self,
+        recent_messages: int = settings.TOPIC_CONTEXT_RECENT_MESSAGES,
+        token_budget: int = settings.TOPIC_CONTEXT_TOKEN_BUDGET,
+        summary_batch: int = settings.TOPIC_CONTEXT_SUMMARY_BATCH,
+        max_catchup: int = settings.TOPIC_CONTEXT_MAX_CATCHUP,
+        max_topics: int = settings.TOPIC_CONTEXT_MAX_TOPICS,
+    ):
+        self.recent_messages = recent_messages
+        self.token_budget = token_budget
+        self.summary_batch = summary_batch
+        self.max_catchup = max_catchup
+        self.max_topics = max_topics
+        self._topics: "OrderedDict[TopicKey, TopicContext]" = OrderedDict()
+
+    # -- recording ---------------------------------------------------------
+
+    def record(self, room_id: str, topic_id: str, message_id: str, user_name: str, content: str, is_ai: bool = False):
+        """Append a just-saved message (plaintext) to the topic's window"""
+        ctx = self._topics.get((room_id, topic_id))
+        if ctx is None:
+            # Not loaded on this worker yet; it will be read from the log on first use
+            return
+        message = {"message_id": message_id, "user_name": user_name, "content": content, "is_ai": is_ai}
+        if not ctx.loaded:
+            ctx.early.append(message)
+            return
+        self._push(ctx, message)
+        self._maybe_fold((room_id, topic_id), ctx)
+
+    def _push(self, ctx: TopicContext, message: Dict[str, Any]):
+        ctx.recent.append(message)
+        while len(ctx.recent) > self.recent_messages:
+            ctx.pending.append(ctx.recent.popleft())
+        if ctx.folding is None and len(ctx.pending) > self.max_catchup:
+            # Summarization keeps failing: drop the oldest rather than grow without bound
+            overflow = len(ctx.pending) - self.max_catchup
+            ctx.watermark_id = ctx.pending[overflow - 1]["message_id"]
+            del ctx.pending[:overflow]
+
+    # -- reading -----------------------------------------------------------
+
+    async def get_context(self, room_id: str, topic_id: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """Return (running summary, recent messages) fitted to the token budget"""
+        key = (room_id, topic_id)
+        ctx = self._topics.get(key)
+        if ctx is None:
+            ctx = TopicContext()
+            self._topics[key] = ctx
+            while len(self._topics) > self.max_topics:
+                self._topics.popitem(last=False)
+        self._topics.move_to_end(key)
+
+        if not ctx.loaded:
+            async with ctx.lock:
+                if not ctx.loaded:
+                    await self._load(key, ctx)
+
+        budget = self.token_budget - estimate_tokens(ctx.summary)
+        history = []
+        for message in reversed(ctx.recent):
+            cost = estimate_tokens(message["content"])
+            if cost > budget:
+                break
+            budget -= cost
+            history.append(message)
+        history.reverse()
+        return ctx.summary, history
+
+    async def _load(self, key: TopicKey, ctx: TopicContext):
+        """Read the log tail and the unsummarized backlog once, then go incremental"""
+        room_id, topic_id = key
+        try:
+            mongo_db = get_mongo_db()
+            if mongo_db is not None:
+                await self._load_from_log(mongo_db, room_id, topic_id, ctx)
+        except Exception as e:
+            logger.warning(f"Could not load chat context for topic {topic_id}: {e}")
+
+        seen = {m["message_id"] for m in ctx.recent}
+        for message in ctx.early:
+            if message["message_id"] not in seen:
+                self._push(ctx, message)
+        ctx.early = []
+        ctx.loaded = True
+        self._maybe_fold(key, ctx)
+
+    async def _load_from_log(self, mongo_db, room_id: str, topic_id: str, ctx: TopicContext):
+        match = {"room_id": room_id, "topic_id": topic_id}
+        messages = {"$ifNull": ["$messages", []]}
+        docs = await mongo_db.chat_logs.aggregate([
+            {"$match": match},
+            {"$project": {
+                "count": {"$size": messages},
+                "tail": {"$slice": [messages, -self.recent_messages]},
+                "context_summary": 1,
+                "context_watermark_id": 1,
+                # Just past the last summarized message (0 if it is not in the log)
+                "watermark_position": {"$add": [
+                    {"$indexOfArray": [_MESSAGE_IDS, {"$ifNull": ["$context_watermark_id", None]}]}, 1
+                ]},
+            }},
+        ]).to_list(length=1)
+        if not docs:
+            return
+        doc = docs[0]
+
+        tail_start = doc["count"] - len(doc["tail"])
+        ctx.summary = doc.get("context_summary") or ""
+        ctx.watermark_id = doc.get("context_watermark_id")
+        watermark = doc["watermark_position"] if ctx.watermark_id else 0
+        watermark = max(min(watermark, tail_start), tail_start - self.max_catchup)
+
+        backlog = tail_start - watermark
+        if backlog > 0:
+            gap = await mongo_db.chat_logs.find_one(
+                match, {"messages": {"$slice": [watermark, backlog]}}
+            )
+            ctx.pending = [m for m in map(self._from_log, gap.get("messages", [])) if m]
+        ctx.recent = deque(m for m in map(self._from_log, doc["tail"]) if m)
+
+    @staticmethod
+    def _from_log(msg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Stored chat message -> plaintext context entry (None if unreadable)"""
+        metadata = msg.get("metadata") or {}
+        if metadata.get("requested_by"):
+            # @chatbot questions are stored as AI messages but were asked by a member
+            return {
+                "message_id": msg.get("message_id"),
+                "user_name": metadata.get("requester_name"),
+                "content": msg.get("content", ""),
+                "is_ai": False,
+            }
+        if msg.get("is_ai"):
+            content = msg.get("content", "")
+        else:
+            content = encryption_service.decrypt_message(msg.get("content", ""))
+            if content.startswith("[Decryption failed"):
+                return None
+        return {
+            "message_id": msg.get("message_id"),
+            "user_name": msg.get("user_name"),
+            "content": content,
+            "is_ai": bool(msg.get("is_ai")),
+        }
+
+    # -- summarizing -------------------------------------------------------
+
+    def _maybe_fold(self, key: TopicKey, ctx: TopicContext):
+        if ctx.folding is None and len(ctx.pending) >= self.summary_batch:
+            ctx.folding = asyncio.ensure_future(self._fold(key, ctx))
+
+    async def _fold(self, key: TopicKey, ctx: TopicContext):
+        """Merge pending messages into the running summary and advance the watermark"""
+        # Charged to the room, not to whoever happened to send the triggering message
+        with usage_scope(user_id=None, room_id=key[0], topic_id=key[1]):
+            await self._fold_pending(key, ctx)
+
+    async def _fold_pending(self, key: TopicKey, ctx: TopicContext):
+        try:
+            while len(ctx.pending) >= self.summary_batch:
+                batch, tokens = [], 0
+                for message in ctx.pending:
+                    tokens += estimate_tokens(message["content"])
+                    if batch and tokens > settings.SUMMARY_SECTION_TOKENS:
+                        break
+                    batch.append(message)
+
+                ctx.summary = await ai_service.summarize_chat_context(ctx.summary, batch)
+                del ctx.pending[:len(batch)]
+                ctx.watermark_id = batch[-1]["message_id"]
+                await self._save_summary(key, ctx)
+        except Exception as e:
+            logger.warning(f"Could not update chat summary for topic {key[1]}: {e}")
+        finally:
+            ctx.folding = None
+
+    async def _save_summary(self, key: TopicKey, ctx: TopicContext):
+        mongo_db = get_mongo_db()
+        if mongo_db is None:
+            return
+        room_id, topic_id = key
+        # Only move the saved watermark forward in the log: another process may
+        # have saved a summary that covers more
+        ahead = {"$gt": [
+            {"$indexOfArray": [_MESSAGE_IDS, {"$literal": ctx.watermark_id}]},
+            {"$indexOfArray": [_MESSAGE_IDS, {"$ifNull": ["$context_watermark_id", None]}]},
+        ]}
+        await mongo_db.chat_logs.update_one(
+            {"room_id": room_id, "topic_id": topic_id},
+            [{"$set": {
+                "context_summary": {"$cond": [ahead, {"$literal": ctx.summary}, "$context_summary"]},
+                "context_watermark_id": {"$cond": [ahead, {"$literal": ctx.watermark_id}, "$context_watermark_id"]},
+            }}],
+        )
+
+
+topic_context_store = TopicContextStore()
@@ -0,0 +1,69 @@
+"""Bounded-memory intake of files uploaded to notes.
+
+Starlette already spools an UploadFile (in memory up to 1MB, then to a
+temp file). spool_upload copies it in UPLOAD_READ_CHUNK_SIZE pieces to a
+named temp file, which S3 multipart uploads and extraction workers both
+read by path. The sha256 and size are computed on the way through, and an
+upload over MAX_FILE_SIZE stops at the limit instead of being read whole.
+
+The copy outlives the request: background ingestion (services/ingestion.py)
+owns it and discards it when done.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+
+from fastapi import UploadFile
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds the size limit"""
+
+
+class SpooledUpload:
+    __slots__ = ("path", "size", "content_hash")
+
+    def __init__(self, path: str, size: int, content_hash: str):
+        self.path = path
+        self.size = size
+        self.content_hash = content_hash
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove spooled upload {self.path}: {e}")
+
+
+async def spool_upload(
+    upload: UploadFile,
+    suffix: str = "",
+    max_size: int = settings.MAX_FILE_SIZE,
+    chunk_size: int = settings.UPLOAD_READ_CHUNK_SIZE,
+) -> SpooledUpload:
+    """Copy an upload to a temp file; the caller discards it when done"""
+    digest = hashlib.sha256()
+    size = 0
+    handle = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    try:
+        with handle:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(f"Upload exceeds {max_size} bytes")
+                digest.update(chunk)
+                handle.write(chunk)
+    except BaseException:
+        os.remove(handle.name)
+        raise
+    return SpooledUpload(handle.name, size, digest.hexdigest())
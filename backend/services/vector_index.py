@@ -0,0 +1,379 @@
+"""Vector index backends for RAG, selected by VECTOR_DB_TYPE.
+
+RAGService only uses the small slice of the Pinecone Index API below
+(upsert / query / delete), so alternative stores implement exactly that.
+create_index() picks the backend:
+
+- "pinecone": the hosted index (needs VECTOR_DB_API_KEY)
+- "local": LocalVectorIndex, memory-mapped float32 matrices on local disk
+- "memory": InMemoryIndex, nothing persisted
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+
+import numpy as np
+from pinecone import Pinecone
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class VectorIndex(Protocol):
+    def upsert(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]]): ...
+
+    def query(self, vector: List[float], top_k: int, include_metadata: bool = True,
+              filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]: ...
+
+    def delete(self, ids: List[str]): ...
+
+
+class InMemoryIndex:
+    """Process-local brute-force cosine index (VECTOR_DB_TYPE="memory").
+
+    Meant for local development, load tests with the fake AI provider, and
+    CI: nothing is persisted and every worker has its own copy.
+    """
+
+    def __init__(self):
+        # id -> (unit vector, metadata)
+        self._vectors: Dict[str, Tuple[List[float], Dict[str, Any]]] = {}
+        # Pinecone's client is sync and RAGService calls it from the threadpool
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> List[float]:
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    def upsert(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]]):
+        with self._lock:
+            for vector_id, values, metadata in vectors:
+                self._vectors[vector_id] = (self._normalize(values), dict(metadata or {}))
+
+    def query(self, vector: List[float], top_k: int, include_metadata: bool = True,
+              filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        query = self._normalize(vector)
+        with self._lock:
+            candidates = list(self._vectors.items())
+        matches = []
+        for vector_id, (values, metadata) in candidates:
+            if filter and any(metadata.get(key) != value for key, value in filter.items()):
+                continue
+            score = sum(a * b for a, b in zip(query, values))
+            matches.append({"id": vector_id, "score": score, "metadata": metadata if include_metadata else {}})
+        matches.sort(key=lambda match: match["score"], reverse=True)
+        return {"matches": matches[:top_k]}
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            for vector_id in ids:
+                self._vectors.pop(vector_id, None)
+
+
+# Local store files grow by doubling, from this many rows
+MIN_PARTITION_ROWS = 64
+# A partition is rewritten without its deleted rows once they are this share of it
+COMPACT_DEAD_FRACTION = 0.5
+
+
+def partition_key(fields: Dict[str, Any]) -> Optional[str]:
+    """The partition a vector lives in, or a query searches, given its metadata or filter.
+
+    Documents embedded by content hash (shared by every note that uploaded
+    them) are one partition each; older per-note vectors are one per
+    (user, note).
+    """
+    if fields.get("document_hash"):
+        return f"document/{fields['document_hash']}"
+    if fields.get("user_id") is not None and fields.get("note_id") is not None:
+        return f"note/{fields['user_id']}/{fields['note_id']}"
+    return None
+
+
+class _Partition:
+    """One memory-mapped float32 matrix of unit vectors, plus its ids and metadata.
+
+    Rows are appended and never move until compaction; a deleted row keeps
+    its slot (id None) until then. The JSON sidecar names the current
+    matrix file and is replaced atomically after the matrix is flushed, so
+    a crash leaves the previous consistent state.
+    """
+    __slots__ = ("key", "root", "name", "generation", "dim", "matrix", "ids", "metadata", "alive", "dead")
+
+    def __init__(self, key: str, root: str, dim: int):
+        self.key = key
+        self.root = root
+        self.name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        self.generation = 0
+        self.dim = dim
+        self.matrix: Optional[np.memmap] = None
+        self.ids: List[Optional[str]] = []
+        self.metadata: List[Optional[Dict[str, Any]]] = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.dead = 0
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self.matrix is None else self.matrix.shape[0]
+
+    def _matrix_path(self, generation: int) -> str:
+        return os.path.join(self.root, f"{self.name}.{generation}.f32")
+
+    @property
+    def sidecar_path(self) -> str:
+        return os.path.join(self.root, f"{self.name}.json")
+
+    def _map(self, generation: int, capacity: int, mode: str = "r+") -> np.memmap:
+        return np.memmap(self._matrix_path(generation), dtype=np.float32, mode=mode, shape=(capacity, self.dim))
+
+    @classmethod
+    def load(cls, root: str, sidecar: str) -> "_Partition":
+        with open(sidecar, encoding="utf-8") as f:
+            state = json.load(f)
+        partition = cls(state["key"], root, state["dim"])
+        partition.generation = state["generation"]
+        partition.ids = state["ids"]
+        partition.metadata = state["metadata"]
+        partition.alive = np.array([vector_id is not None for vector_id in partition.ids], dtype=bool)
+        partition.dead = partition.count - int(partition.alive.sum())
+        partition.matrix = partition._map(partition.generation, state["capacity"])
+        return partition
+
+    def save(self):
+        self.matrix.flush()
+        state = {
+            "key": self.key,
+            "dim": self.dim,
+            "generation": self.generation,
+            "capacity": self.capacity,
+            "ids": self.ids,
+            "metadata": self.metadata,
+        }
+        temporary = f"{self.sidecar_path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temporary, self.sidecar_path)
+
+    def append(self, rows: np.ndarray, ids: List[str], metadata: List[Dict[str, Any]]) -> int:
+        """Add unit vectors at the end, growing the file if needed; returns the first new row"""
+        first = self.count
+        needed = first + len(ids)
+        if needed > self.capacity:
+            capacity = max(needed, 2 * self.capacity, MIN_PARTITION_ROWS)
+            if self.matrix is not None:
+                self.matrix.flush()
+            # Extending the file keeps existing rows where they are
+            with open(self._matrix_path(self.generation), "ab") as f:
+                f.truncate(capacity * self.dim * 4)
+            self.matrix = self._map(self.generation, capacity)
+        self.matrix[first:needed] = rows
+        self.ids.extend(ids)
+        self.metadata.extend(metadata)
+        self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+        return first
+
+    def remove(self, row: int):
+        self.ids[row] = None
+        self.metadata[row] = None
+        self.alive[row] = False
+        self.dead += 1
+
+    def compact(self) -> Dict[str, int]:
+        """Rewrite the live rows into a new matrix file; returns the new row of each id"""
+        keep = np.flatnonzero(self.alive)
+        generation = self.generation + 1
+        capacity = max(len(keep), MIN_PARTITION_ROWS)
+        matrix = self._map(generation, capacity, mode="w+")
+        matrix[:len(keep)] = self.matrix[keep]
+        old_path = self._matrix_path(self.generation)
+        self.matrix = matrix
+        self.generation = generation
+        self.ids = [self.ids[row] for row in keep]
+        self.metadata = [self.metadata[row] for row in keep]
+        self.alive = np.ones(len(keep), dtype=bool)
+        self.dead = 0
+        self.save()
+        os.remove(old_path)
+        return {vector_id: row for row, vector_id in enumerate(self.ids)}
+
+    def drop(self):
+        self.matrix = None
+        for path in (self._matrix_path(self.generation), self.sidecar_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class LocalVectorIndex:
+    """Vectors in memory-mapped float32 files on local disk (VECTOR_DB_TYPE="local").
+
+    Vectors are partitioned as partition_key() describes, so a question
+    about one note scores only that document's rows: one matrix-vector
+    product and an argpartition for the top k, with no network hop.
+    Deletes leave holes that are compacted away once they make up
+    COMPACT_DEAD_FRACTION of a partition.
+
+    Each process keeps its own view of the files, so this suits one-worker
+    deployments, local development and tests; several workers need their
+    own VECTOR_DB_LOCAL_PATH or Pinecone.
+    """
+
+    def __init__(self, path: str = settings.VECTOR_DB_LOCAL_PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._partitions: Dict[str, _Partition] = {}
+        # id -> (partition key, row)
+        self._locations: Dict[str, Tuple[str, int]] = {}
+        # Pinecone's client is sync and RAGService calls it from the threadpool
+        self._lock = threading.Lock()
+        for entry in sorted(os.listdir(path)):
+            if entry.endswith(".json"):
+                try:
+                    partition = _Partition.load(path, os.path.join(path, entry))
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error(f"Skipping unreadable vector partition {entry}: {e}")
+                    continue
+                self._partitions[partition.key] = partition
+                for row, vector_id in enumerate(partition.ids):
+                    if vector_id is not None:
+                        self._locations[vector_id] = (partition.key, row)
+
+    @staticmethod
+    def _unit_rows(values: List[List[float]]) -> np.ndarray:
+        rows = np.asarray(values, dtype=np.float32)
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return rows / norms
+
+    def upsert(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]]):
+        if not vectors:
+            return
+        groups: Dict[str, List[Tuple[str, List[float], Dict[str, Any]]]] = {}
+        for vector_id, values, metadata in vectors:
+            groups.setdefault(partition_key(metadata or {}) or "default", []).append((vector_id, values, metadata))
+        with self._lock:
+            touched = set()
+            for key, group in groups.items():
+                rows = self._unit_rows([values for _, values, _ in group])
+                partition = self._partitions.get(key)
+                if partition is None:
+                    partition = self._partitions[key] = _Partition(key, self.path, rows.shape[1])
+                elif rows.shape[1] != partition.dim:
+                    raise ValueError(f"Vectors have {rows.shape[1]} dimensions, partition {key} has {partition.dim}")
+                new = []
+                for (vector_id, _, metadata), row in zip(group, rows):
+                    location = self._locations.get(vector_id)
+                    if location is not None and location[0] == key:
+                        # Same partition: overwrite in place
+                        partition.matrix[location[1]] = row
+                        partition.metadata[location[1]] = dict(metadata or {})
+                        continue
+                    if location is not None:
+                        self._partitions[location[0]].remove(location[1])
+                        touched.add(location[0])
+                    new.append((vector_id, row, dict(metadata or {})))
+                if new:
+                    first = partition.append(
+                        np.stack([row for _, row, _ in new]), [vector_id for vector_id, _, _ in new],
+                        [metadata for _, _, metadata in new],
+                    )
+                    for offset, (vector_id, _, _) in enumerate(new):
+                        self._locations[vector_id] = (key, first + offset)
+                touched.add(key)
+            for key in touched:
+                self._settle(self._partitions[key])
+
+    def query(self, vector: List[float], top_k: int, include_metadata: bool = True,
+              filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        query = self._unit_rows([vector])[0]
+        filter = filter or {}
+        key = partition_key(filter)
+        with self._lock:
+            if key is not None:
+                partitions = [self._partitions[key]] if key in self._partitions else []
+            else:
+                partitions = list(self._partitions.values())
+            # Filter fields that the partition does not already guarantee
+            covered = {"document_hash"} if key and key.startswith("document/") else {"user_id", "note_id"} if key else set()
+            extra = {field: value for field, value in filter.items() if field not in covered}
+            candidates = []
+            for partition in partitions:
+                if partition.count == partition.dead or query.shape[0] != partition.dim:
+                    continue
+                scores = partition.matrix[:partition.count] @ query
+                mask = partition.alive
+                if extra:
+                    mask = mask & np.array(
+                        [meta is not None and all(meta.get(f) == v for f, v in extra.items()) for meta in partition.metadata],
+                        dtype=bool,
+                    )
+                rows = np.flatnonzero(mask)
+                if len(rows) > top_k:
+                    rows = rows[np.argpartition(-scores[rows], top_k - 1)[:top_k]]
+                candidates.extend((float(scores[row]), partition, int(row)) for row in rows)
+            candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+            matches = [
+                {
+                    "id": partition.ids[row],
+                    "score": score,
+                    "metadata": dict(partition.metadata[row]) if include_metadata else {},
+                }
+                for score, partition, row in candidates[:top_k]
+            ]
+        return {"matches": matches}
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            touched = set()
+            for vector_id in ids:
+                location = self._locations.pop(vector_id, None)
+                if location is not None:
+                    self._partitions[location[0]].remove(location[1])
+                    touched.add(location[0])
+            for key in touched:
+                self._settle(self._partitions[key])
+
+    def compact(self):
+        """Rewrite every partition that has deleted rows"""
+        with self._lock:
+            for partition in list(self._partitions.values()):
+                if partition.dead:
+                    self._settle(partition, force=True)
+
+    def _settle(self, partition: _Partition, force: bool = False):
+        """Persist a changed partition, compacting or dropping it when enough of it is deleted"""
+        if partition.dead == partition.count:
+            partition.drop()
+            del self._partitions[partition.key]
+        elif force or partition.dead > partition.count * COMPACT_DEAD_FRACTION:
+            for vector_id, row in partition.compact().items():
+                self._locations[vector_id] = (partition.key, row)
+        else:
+            partition.save()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "partitions": len(self._partitions),
+                "vectors": len(self._locations),
+                "deleted_rows": sum(partition.dead for partition in self._partitions.values()),
+            }
+
+
+def create_index() -> Optional[VectorIndex]:
+    """The vector index VECTOR_DB_TYPE selects, or None if it is not configured"""
+    if settings.VECTOR_DB_TYPE == "memory":
+        return InMemoryIndex()
+    if settings.VECTOR_DB_TYPE == "local":
+        return LocalVectorIndex()
+    if settings.VECTOR_DB_API_KEY:
+        return Pinecone(api_key=settings.VECTOR_DB_API_KEY).Index(settings.VECTOR_DB_INDEX_NAME)
+    return None
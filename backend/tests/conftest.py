@@ -1,6 +1,91 @@
 import os
 import sys
 
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
 # Ensure the backend root (where main.py and its sibling packages live) is
 # importable regardless of which directory pytest is invoked from.
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeEmbeddings:
+    """Stands in for RAGService.embed_chunks: vectors come from `vector(text)`, and `texts` records what was embedded"""
+
+    def __init__(self):
+        self.vector = lambda text: [1.0, 0.0]
+        self.texts = []
+
+    async def __call__(self, texts, priority=None):
+        self.texts.extend(texts)
+        return [self.vector(text) for text in texts]
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    """A fresh in-memory database with every table, which the services use as SessionLocal"""
+    import main  # noqa: F401  (registers every mapper)
+    from core.database import Base
+    from services import ingestion, rag_service
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(rag_service, "SessionLocal", Session)
+    monkeypatch.setattr(ingestion, "SessionLocal", Session)
+    return Session
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def embeddings():
+    return FakeEmbeddings()
+
+
+@pytest.fixture
+def rag(session_factory, embeddings, monkeypatch):
+    """A configured RAGService on the test database, with an in-memory index, fresh caches and fake embeddings"""
+    from services.answer_cache import AnswerCache
+    from services.rag_service import RAGService
+    from services.vector_index import InMemoryIndex
+
+    service = RAGService()
+    service.index = InMemoryIndex()
+    service.answers = AnswerCache()
+    monkeypatch.setattr(service, "_check_configured", lambda: None)
+    monkeypatch.setattr(service, "embed_chunks", embeddings)
+    return service
+
+
+@pytest.fixture
+def client(session_factory, monkeypatch):
+    """The app's routes on the test database, signed in as user u1 (the app's startup is not run)"""
+    import types
+
+    from fastapi.testclient import TestClient
+
+    import main
+    from api import notes
+    from core.database import get_db
+    from middleware.auth_middleware import get_current_user
+
+    def test_db():
+        session = session_factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    monkeypatch.setattr(notes, "SessionLocal", session_factory)
+    main.app.dependency_overrides[get_db] = test_db
+    main.app.dependency_overrides[get_current_user] = lambda: types.SimpleNamespace(id="u1")
+    yield TestClient(main.app, base_url="http://localhost")
+    main.app.dependency_overrides.clear()
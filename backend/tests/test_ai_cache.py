@@ -0,0 +1,74 @@
+import asyncio
+
+from services.ai_cache import AIResponseCache
+
+
+def test_key_depends_on_every_input():
+    base = AIResponseCache.make_key("gpt-4o-mini", "summary", "doc", {"temperature": 0.3})
+    assert base == AIResponseCache.make_key("gpt-4o-mini", "summary", "doc", {"temperature": 0.3})
+    assert base != AIResponseCache.make_key("gpt-4o", "summary", "doc", {"temperature": 0.3})
+    assert base != AIResponseCache.make_key("gpt-4o-mini", "quiz", "doc", {"temperature": 0.3})
+    assert base != AIResponseCache.make_key("gpt-4o-mini", "summary", "doc2", {"temperature": 0.3})
+    assert base != AIResponseCache.make_key("gpt-4o-mini", "summary", "doc", {"temperature": 0.7})
+
+
+def test_lru_evicts_least_recently_used_and_counts_hits():
+    cache = AIResponseCache(max_entries=2, ttl_seconds=60, persistent_max_entries=10, enabled=True)
+
+    async def run():
+        await cache.set("a", 1)
+        await cache.set("b", 2)
+        assert await cache.get("a") == 1  # "b" is now least recently used
+        await cache.set("c", 3)
+        return await cache.get("a"), await cache.get("b"), await cache.get("c")
+
+    assert asyncio.run(run()) == (1, None, 3)
+    stats = cache.stats()
+    assert stats["memory_hits"] == 3
+    assert stats["misses"] == 1
+
+
+def test_expired_entries_are_misses():
+    cache = AIResponseCache(max_entries=2, ttl_seconds=0, persistent_max_entries=10, enabled=True)
+
+    async def run():
+        await cache.set("a", {"host_script": "hi"})
+        return await cache.get("a")
+
+    assert asyncio.run(run()) is None
+
+
+def test_cached_values_are_copies():
+    cache = AIResponseCache(max_entries=2, ttl_seconds=60, persistent_max_entries=10, enabled=True)
+
+    async def run():
+        await cache.set("quiz", [{"question": "q"}])
+        first = await cache.get("quiz")
+        first[0]["question"] = "mutated"
+        return await cache.get("quiz")
+
+    assert asyncio.run(run()) == [{"question": "q"}]
+
+
+def test_changed_ttl_is_applied_to_the_existing_index(monkeypatch):
+    from pymongo.errors import OperationFailure
+    from services import ai_cache
+
+    commands = []
+
+    class Collection:
+        async def create_index(self, key, expireAfterSeconds):
+            raise OperationFailure("An equivalent index already exists with different options", code=85)
+
+    class Database:
+        def __getitem__(self, name):
+            return Collection()
+
+        async def command(self, name, collection, **options):
+            commands.append((name, collection, options))
+
+    monkeypatch.setattr(ai_cache, "get_mongo_db", lambda: Database())
+    cache = AIResponseCache(max_entries=2, ttl_seconds=3600, persistent_max_entries=10, enabled=True)
+    asyncio.run(cache.ensure_indexes())
+    assert commands == [("collMod", "ai_response_cache",
+                         {"index": {"keyPattern": {"created_at": 1}, "expireAfterSeconds": 3600}})]
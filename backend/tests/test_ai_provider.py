@@ -0,0 +1,83 @@
+import asyncio
+
+from services.ai_provider import FakeProvider, create_provider
+from services.ai_service import AIService
+from services.vector_index import InMemoryIndex
+
+DOCUMENT = (
+    "Photosynthesis converts light energy into chemical energy. Chlorophyll absorbs light "
+    "in the chloroplasts, and the Calvin cycle fixes carbon dioxide into glucose."
+)
+
+
+def _fake():
+    return FakeProvider(
+        latency_ms=0, latency_jitter_ms=0,
+        completion_tokens=50, completion_tokens_jitter=10,
+        embedding_latency_ms=0, embedding_dimensions=64,
+    )
+
+
+def test_fake_completions_are_deterministic_and_report_usage():
+    provider = _fake()
+    messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": DOCUMENT}]
+
+    async def run():
+        first = await provider.complete("gpt-4o-mini", messages, 100, 0.7, 30)
+        second = await provider.complete("gpt-4o-mini", messages, 100, 0.7, 30)
+        streamed = [delta async for delta in provider.stream("gpt-4o-mini", messages, 100, 0.7, 30)]
+        return first, second, streamed
+
+    first, second, streamed = asyncio.run(run())
+    assert first.text == second.text
+    assert first.usage.prompt_tokens > 0 and first.usage.completion_tokens > 0
+    assert "".join(d.text for d in streamed) == first.text
+    assert streamed[-1].usage.completion_tokens == first.usage.completion_tokens
+
+
+def test_fake_backend_drives_the_real_quiz_and_audio_parsers(monkeypatch):
+    service = AIService()
+    monkeypatch.setattr(service, "provider", _fake())
+    service.cache.enabled = False
+    try:
+        async def run():
+            quiz = await service.generate_quiz_questions(DOCUMENT, num_questions=3, difficulty="hard")
+            script = await service.generate_audio_overview_script(DOCUMENT)
+            analysis = await service.analyze_document_for_quiz(DOCUMENT)
+            return quiz, script, analysis
+
+        quiz, script, analysis = asyncio.run(run())
+    finally:
+        service.cache.enabled = True
+
+    assert len(quiz) == 3
+    assert all(len(q["options"]) == 4 and 0 <= q["correct_answer"] <= 3 for q in quiz)
+    assert quiz[0]["difficulty"] == "hard"
+    assert script["host_script"].startswith("Welcome")
+    assert analysis["topics"]
+
+
+def test_fake_embeddings_retrieve_overlapping_text():
+    provider = _fake()
+    chunks = [DOCUMENT, "The French Revolution began in 1789 with the storming of the Bastille."]
+
+    async def run():
+        stored = await provider.embed("text-embedding-ada-002", chunks)
+        question = await provider.embed("text-embedding-ada-002", ["What does chlorophyll absorb in photosynthesis?"])
+        return stored.vectors, question.vectors[0]
+
+    vectors, question = asyncio.run(run())
+    index = InMemoryIndex()
+    index.upsert(vectors=[(f"n-{i}", v, {"note_id": "n", "chunk": c}) for i, (v, c) in enumerate(zip(vectors, chunks))])
+    matches = index.query(vector=question, top_k=1, include_metadata=True, filter={"note_id": "n"})["matches"]
+    assert matches[0]["id"] == "n-0"
+    assert index.query(vector=question, top_k=1, filter={"note_id": "other"})["matches"] == []
+
+
+def test_unknown_provider_is_rejected():
+    try:
+        create_provider("nope")
+    except ValueError as e:
+        assert "AI_PROVIDER" in str(e)
+    else:
+        raise AssertionError("expected ValueError")
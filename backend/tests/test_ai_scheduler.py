@@ -0,0 +1,87 @@
+import asyncio
+
+import httpx
+import openai
+
+from services.ai_scheduler import AIScheduler, INTERACTIVE, BATCH
+
+
+def _rate_limit_error(retry_after: str = "0"):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def test_interactive_requests_jump_the_batch_queue():
+    scheduler = AIScheduler(
+        requests_per_minute=6000, tokens_per_minute=10**6,
+        max_concurrency=2, min_concurrency=1, interactive_reserve=0,
+    )
+    order = []
+
+    async def call(name, priority, gate):
+        async def fn():
+            await gate.wait()
+            order.append(name)
+        await scheduler.run(fn, priority=priority)
+
+    async def run():
+        gate = asyncio.Event()
+        # The window starts at 1 slot: the first batch call holds it
+        first = asyncio.ensure_future(call("batch-1", BATCH, gate))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.ensure_future(call("batch-2", BATCH, gate)),
+            asyncio.ensure_future(call("chat", INTERACTIVE, gate)),
+        ]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(first, *waiting)
+
+    asyncio.run(run())
+    assert order[0] == "batch-1"
+    assert order.index("chat") < order.index("batch-2")
+
+
+def test_rate_limit_halves_window_and_retries():
+    scheduler = AIScheduler(
+        requests_per_minute=6000, tokens_per_minute=10**6,
+        max_concurrency=8, min_concurrency=1, interactive_reserve=0,
+        max_retries=2, base_delay=0.0,
+    )
+    attempts = 0
+
+    async def flaky():
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise _rate_limit_error()
+        return "ok"
+
+    assert asyncio.run(scheduler.run(flaky)) == "ok"
+    stats = scheduler.stats()
+    assert attempts == 2
+    assert stats["rate_limited"] == 1
+    assert stats["retries"] == 1
+    # Halved from 4 to 2, then one additive step back up
+    assert 2.0 < stats["concurrency_window"] < 3.0
+    assert stats["in_flight"] == 0
+
+
+def test_gives_up_after_max_retries():
+    scheduler = AIScheduler(
+        requests_per_minute=6000, tokens_per_minute=10**6,
+        max_concurrency=4, min_concurrency=1, interactive_reserve=0,
+        max_retries=1, base_delay=0.0,
+    )
+
+    async def always_limited():
+        raise _rate_limit_error()
+
+    try:
+        asyncio.run(scheduler.run(always_limited))
+        raised = False
+    except openai.RateLimitError:
+        raised = True
+    assert raised
+    assert scheduler.stats()["in_flight"] == 0
@@ -0,0 +1,93 @@
+import asyncio
+import types
+
+import pytest
+
+from services import ai_usage as ai_usage_module
+from services.ai_usage import AIUsageTracker, AIQuotaExceeded, usage_scope
+
+
+def _tracker(**overrides):
+    options = dict(
+        user_soft_limit=100, user_hard_limit=200,
+        room_soft_limit=0, room_hard_limit=300,
+        flush_batch_size=2, flush_interval=60,
+    )
+    options.update(overrides)
+    return AIUsageTracker(**options)
+
+
+def test_usage_is_attributed_to_the_enclosing_scope():
+    tracker = _tracker()
+    with usage_scope(user_id="u1", room_id="r1"):
+        with usage_scope(topic_id="t1"):
+            tracker.record_completion("openai", "gpt-4o-mini", "chat", types.SimpleNamespace(prompt_tokens=30, completion_tokens=20), 0.5)
+    tracker.record_completion("openai", "gpt-4o-mini", "summary", None, 1.0, estimated_prompt_tokens=7, estimated_completion_tokens=3)
+
+    stats = tracker.stats()
+    assert stats["today"]["top_users"] == [{"id": "u1", "tokens": 50}]
+    assert stats["today"]["top_rooms"] == [{"id": "r1", "tokens": 50}]
+    by_type = {row["request_type"]: row for row in stats["since_startup"]}
+    assert by_type["chat"]["prompt_tokens"] == 30
+    assert by_type["summary"]["completion_tokens"] == 3
+
+    docs = tracker._buffer
+    assert docs[0]["user_id"] == "u1" and docs[0]["topic_id"] == "t1" and docs[0]["tokens_used"] == 50
+    assert docs[1]["user_id"] == "system"
+
+
+def test_soft_then_hard_quota():
+    tracker = _tracker()
+    with usage_scope(user_id="u1"):
+        assert tracker.check_quota() is False
+        tracker.record("openai", "gpt-4o-mini", "chat", prompt_tokens=150)
+        assert tracker.check_quota() is True
+        tracker.record("openai", "gpt-4o-mini", "chat", prompt_tokens=60)
+        with pytest.raises(AIQuotaExceeded) as excinfo:
+            tracker.check_quota()
+    assert excinfo.value.status_code == 429
+    # Other users are unaffected
+    assert tracker.check_quota(user_id="u2") is False
+
+
+def test_records_are_flushed_to_mongo_in_batches(monkeypatch):
+    inserted = []
+
+    class Collection:
+        async def insert_many(self, docs, ordered=False):
+            inserted.append(len(docs))
+
+    monkeypatch.setattr(ai_usage_module, "get_mongo_db", lambda: {"ai_responses": Collection()})
+    tracker = _tracker(flush_batch_size=3)
+
+    async def run():
+        for _ in range(3):
+            tracker.record("elevenlabs", "eleven_monolingual_v1", "tts", characters=10)
+        await asyncio.sleep(0)  # a full batch flushes in the background
+        tracker.record("elevenlabs", "eleven_monolingual_v1", "tts", characters=10)
+        await tracker.stop()  # the remainder flushes on shutdown
+
+    asyncio.run(run())
+    assert inserted == [3, 1]
+    assert tracker.stats()["flushed"] == 4
+
+
+def test_failed_flushes_keep_only_the_newest_records(monkeypatch):
+    attempts = []
+
+    class Collection:
+        async def insert_many(self, docs, ordered=False):
+            attempts.append(len(docs))
+            raise ConnectionError("Mongo is down")
+
+    monkeypatch.setattr(ai_usage_module, "get_mongo_db", lambda: {"ai_responses": Collection()})
+    tracker = _tracker(flush_batch_size=2)
+    for characters in range(25):
+        tracker.record("elevenlabs", "eleven_monolingual_v1", "tts", characters=characters)
+
+    asyncio.run(tracker.flush())
+    asyncio.run(tracker.flush())
+
+    assert attempts == [25, 20]
+    assert [doc["metadata"]["characters"] for doc in tracker._buffer] == list(range(5, 25))
+    assert tracker.stats()["dropped"] == 5 and tracker.stats()["flushed"] == 0
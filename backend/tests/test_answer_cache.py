@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from models.postgresql.chat_log import ChatLog
+from models.postgresql.document_text import NoteDocument
+from models.postgresql.note import Note
+from services import rag_service as rag_module
+from services.answer_cache import AnswerCache, normalize_question
+from services.document_store import DocumentTextStore
+
+
+@pytest.fixture
+def answered(rag, db, monkeypatch):
+    """Two notes sharing one document; the questions that reached the model are recorded"""
+    db.add_all([Note(id="n1", title="Biology", user_id="u1"), Note(id="n2", title="Biology", user_id="u2")])
+    store = DocumentTextStore()
+    for note_id in ("n1", "n2"):
+        store.attach(db, note_id, store.save(db, "doc", ["Photosynthesis makes sugar."]))
+    db.query(NoteDocument).update({NoteDocument.attached_at: datetime.utcnow() - timedelta(minutes=2)})
+    db.commit()
+    answered = []
+
+    async def answer(note_id, question, user_id, top_k, document_hash=None):
+        answered.append(question)
+        return f"answer {len(answered)}"
+
+    monkeypatch.setattr(rag, "_answer", answer)
+    return answered
+
+
+def test_repeated_questions_reuse_the_answer_for_the_same_document(rag, db, answered, monkeypatch):
+
+    first = asyncio.run(rag.query(db, "n1", "What is the main idea?", "u1", document_hash="doc"))
+    # Another note with the same file, asking the same thing differently
+    again = asyncio.run(rag.query(db, "n2", "  what is the MAIN idea ", "u2", document_hash="doc"))
+    # The first note's file is replaced; what was asked before is about the old file
+    db.query(ChatLog).update({ChatLog.created_at: datetime.utcnow() - timedelta(minutes=1)})
+    store = DocumentTextStore()
+    store.attach(db, "n1", store.save(db, "edited-doc", ["Photosynthesis makes sugar from light."]))
+    db.commit()
+    other = asyncio.run(rag.query(db, "n1", "What is the main idea?", "u1", document_hash="edited-doc"))
+
+    assert (first, again, other) == ("answer 1", "answer 1", "answer 2")
+    assert answered == ["What is the main idea?", "What is the main idea?"]
+    assert [log.answer for log in db.query(ChatLog).order_by(ChatLog.created_at)] == ["answer 1", "answer 1", "answer 2"]
+    assert rag.answers.stats()["answer_hits"] == 1
+
+    # A fresh worker starts from ChatLog, read off the event loop; dropping the document forgets its answers
+    rag.answers = AnswerCache()
+    seeded_on = []
+    seed = rag.answers._seed
+    monkeypatch.setattr(rag.answers, "_seed", lambda db, h: (seeded_on.append(threading.current_thread()), seed(db, h)))
+    assert asyncio.run(rag.query(db, "n2", "What is the main idea", "u2", document_hash="doc")) == "answer 1"
+    assert len(answered) == 2
+    assert seeded_on and threading.main_thread() not in seeded_on
+    rag.answers.invalidate("doc")
+    db.query(ChatLog).delete()
+    db.commit()
+    assert asyncio.run(rag.query(db, "n2", "What is the main idea", "u2", document_hash="doc")) == "answer 3"
+
+
+def test_answers_and_embeddings_are_keyed_by_the_normalized_question(rag, db, answered, embeddings):
+    embedded = embeddings.texts
+    for question in ("Define osmosis.", "define   OSMOSIS", "define osmosis?"):
+        assert asyncio.run(rag._question_embedding(question)) == [1.0, 0.0]
+    assert embedded == ["define osmosis"] and normalize_question("Define osmosis.") == "define osmosis"
+
+    # Refusals are never cached, so a later attempt can still find the answer
+    rag.answers.set_answer("doc", "Define osmosis", rag_module.UNANSWERED)
+    assert rag.answers.get_answer(db, "doc", "Define osmosis") is None
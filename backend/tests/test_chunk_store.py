@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from models.postgresql.document_text import DocumentChunk
+
+
+@pytest.fixture(autouse=True)
+def _photosynthesis_embeddings(embeddings):
+    embeddings.vector = lambda text: [1.0, 5.0 * ("photosynthesis" in text.lower())]
+
+
+def test_index_holds_only_ids_and_filter_fields_and_text_comes_from_the_store(rag, db):
+    pages = ["Photosynthesis turns light into sugar. " * 40, "The Krebs cycle releases energy. " * 40]
+    text = "\n".join(pages)
+    chunk_ids = asyncio.run(rag.embed_and_store_chunks("doc", text, [0, len(pages[0]) + 1]))
+
+    assert len(chunk_ids) > 2
+    stored = {vector_id: metadata for vector_id, (_, metadata) in rag.index._vectors.items()}
+    assert set(stored) == set(chunk_ids)
+    assert all(metadata == {"document_hash": "doc"} for metadata in stored.values())
+    rows = db.query(DocumentChunk).order_by(DocumentChunk.position).all()
+    assert [row.chunk_id for row in rows] == chunk_ids
+    assert all(text[row.start_offset:row.end_offset] == row.text for row in rows)
+    assert len(rows[0].compressed_text) < len(rows[0].text) // 2
+
+    matches = asyncio.run(rag._retrieve("n1", "What is photosynthesis?", "u1", top_k=2, document_hash="doc"))
+    assert [match["page"] for match in matches] == [1, 1]
+    assert all(match["text"].startswith("Photosynthesis") for match in matches)
+    assert "Photosynthesis turns light" in rag._build_messages(matches, "q")[1]["content"]
+
+    asyncio.run(rag.delete_chunks(chunk_ids))
+    assert db.query(DocumentChunk).count() == 0 and not rag.index._vectors
+
+
+def test_vectors_stored_with_text_in_metadata_still_answer(rag):
+    rag.index.upsert([("note-1-0", [1.0, 1.0], {"note_id": "n1", "user_id": "u1", "chunk": "Old chunk text"})])
+
+    matches = asyncio.run(rag._retrieve("n1", "Photosynthesis?", "u1", top_k=3))
+    assert [(match["id"], match["text"], match["page"]) for match in matches] == [("note-1-0", "Old chunk text", None)]
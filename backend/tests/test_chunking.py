@@ -0,0 +1,56 @@
+import pytest
+
+from services.chunking import SentenceChunker
+from services.document_store import join_pages
+
+PAGES = [
+    "Photosynthesis happens in chloroplasts. Chlorophyll absorbs red and blue light! "
+    "Why is the leaf green? It reflects green light.\n\nThe light reactions make ATP.",
+    "The Calvin cycle fixes carbon dioxide. It runs in the stroma and produces "
+    "glucose for the plant (and for us).",
+]
+
+
+def test_chunks_are_whole_sentences_with_overlap_and_spans():
+    text, offsets = join_pages(PAGES)
+    chunks = SentenceChunker(chunk_tokens=20, overlap_tokens=10).chunk(text, offsets)
+
+    assert len(chunks) > 2
+    for chunk in chunks:
+        assert text[chunk.start:chunk.end] == chunk.text
+        assert chunk.text[-1] in ".!?)" and chunk.text[0].isupper()
+        assert len(chunk.text) <= 20 * 4
+    # Neighbours share boundary sentences, as far as the next sentence still fits
+    assert chunks[1].text.startswith("Chlorophyll absorbs") and chunks[1].start < chunks[0].end
+    assert [chunk.page for chunk in chunks][0] == 1 and chunks[-1].page == 2
+    assert chunks[-1].text.endswith("(and for us).")
+
+
+def test_streamed_pages_chunk_exactly_like_the_joined_text():
+    chunker = SentenceChunker(chunk_tokens=15, overlap_tokens=5)
+    pages = PAGES + ["", "A trailing fragment without an end", "   "]
+    streamed = [chunk for page in pages for chunk in chunker.feed(page)] + list(chunker.finish())
+    whole = chunker.chunk(*join_pages(pages))
+    assert [(c.text, c.start, c.end, c.page) for c in streamed] == [(c.text, c.start, c.end, c.page) for c in whole]
+    assert whole[-1].text.endswith("without an end") and whole[-1].end == len(join_pages(pages)[0].rstrip())
+
+
+def test_overlong_sentences_are_cut_at_whitespace():
+    text = " ".join(f"word{i}" for i in range(200)) + "."
+    chunks = SentenceChunker(chunk_tokens=25, overlap_tokens=0).chunk(text)
+    assert all(len(chunk.text) <= 100 for chunk in chunks)
+    assert " ".join(chunk.text for chunk in chunks) == text
+    with pytest.raises(ValueError):
+        SentenceChunker(chunk_tokens=10, overlap_tokens=10)
+
+
+def test_content_defined_boundaries_resync_after_an_edit():
+    sentences = [f"Sentence {i} is about topic {i % 7}." for i in range(120)]
+    chunker = SentenceChunker(chunk_tokens=40, overlap_tokens=10, content_defined=True)
+    before = chunker.chunk(" ".join(sentences))
+    sentences[20] = "This sentence was rewritten to be a good deal longer than it was."
+    after = chunker.chunk(" ".join(sentences))
+
+    assert all(len(chunk.text) <= 40 * 4 for chunk in before)
+    assert len({c.text for c in after} - {c.text for c in before}) <= 2
+    assert before[-1].text == after[-1].text and before[-1].text.endswith("Sentence 119 is about topic 0.")
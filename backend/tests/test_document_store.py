@@ -0,0 +1,79 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import main  # noqa: F401  (registers every mapper DocumentText's foreign key refers to)
+from core.database import Base
+from models.postgresql.document_text import DocumentText, NoteDocument
+from services.document_store import DocumentTextStore, content_hash, join_pages
+
+
+def _session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def test_join_pages_records_page_offsets():
+    text, offsets = join_pages(["first page", "second", ""])
+    assert text == "first page\nsecond\n"
+    assert offsets == [0, 11, 18]
+    assert text[offsets[1]:].startswith("second")
+    assert join_pages([]) == ("", [0])
+
+
+def test_text_round_trips_compressed():
+    db = _session()
+    store = DocumentTextStore(compression_level=9)
+    pages = ["Photosynthesis " * 200, "The Calvin cycle " * 200]
+
+    record = store.save(db, content_hash(b"v1"), pages, storage_path="documents/v1.pdf", file_type="pdf")
+    store.attach(db, "note-1", record)
+    db.commit()
+    text = store.get_text(db, "note-1")
+    assert text == "\n".join(pages)
+    assert len(record.compressed_text) < len(text) // 10
+    assert record.page_count == 2 and record.char_count == len(text)
+    assert record.page_at(0) == 1 and record.page_at(len(pages[0]) + 5) == 2
+    assert store.embedded_hash(db, "note-1") is None
+
+    record.chunk_count = 3
+    db.commit()
+    assert store.embedded_hash(db, "note-1") == content_hash(b"v1")
+    assert record.chunk_ids() == [f"{content_hash(b'v1')}-{i}" for i in range(3)]
+
+
+def test_identical_uploads_share_one_document_until_the_last_note_lets_go():
+    db = _session()
+    store = DocumentTextStore()
+    file_hash = content_hash(b"same bytes")
+
+    first = store.save(db, file_hash, ["shared text"], storage_path="documents/shared.pdf")
+    first.chunk_count = 2
+    store.attach(db, "note-1", first)
+    # A second save of the same content returns the stored record
+    second = store.save(db, file_hash, ["parsed again"])
+    assert second is first
+    assert store.attach(db, "note-2", store.find(db, file_hash)) is None
+    db.commit()
+    assert db.query(DocumentText).count() == 1
+    assert store.find(db, file_hash).ref_count == 2
+    assert store.get_text(db, "note-2") == "shared text"
+
+    assert store.detach(db, "note-1") is None
+    db.commit()
+    assert store.find(db, file_hash).ref_count == 1
+
+    # Re-pointing the last note at other content releases the shared document
+    other = store.save(db, content_hash(b"other"), ["other text"])
+    released = store.attach(db, "note-2", other)
+    db.commit()
+    assert released.content_hash == file_hash
+    assert released.storage_path == "documents/shared.pdf"
+    assert released.chunk_ids == [f"{file_hash}-0", f"{file_hash}-1"]
+    assert store.find(db, file_hash) is None
+    assert store.get_text(db, "note-2") == "other text"
+
+    assert store.detach(db, "note-2").content_hash == content_hash(b"other")
+    assert store.detach(db, "note-2") is None
+    db.commit()
+    assert db.query(DocumentText).count() == 0 and db.query(NoteDocument).count() == 0
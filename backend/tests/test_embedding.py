@@ -0,0 +1,112 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from services.embedding import EmbeddingBatcher
+
+
+def _bad_request():
+    response = httpx.Response(400, request=httpx.Request("POST", "https://api.openai.com/v1/embeddings"))
+    return openai.BadRequestError("maximum context length exceeded", response=response, body=None)
+
+
+def test_batches_are_sized_by_tokens_and_run_concurrently_under_the_cap():
+    calls, in_flight, peak = [], 0, 0
+
+    async def embed(texts, priority):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        calls.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(embed, max_batch_tokens=100, max_batch_inputs=8, max_concurrency=2)
+    texts = ["x" * 120] * 20 + ["y" * 4] * 20  # ~31 tokens each, then ~2 tokens each
+
+    vectors = asyncio.run(batcher.embed(texts))
+
+    assert vectors == [[float(len(text))] for text in texts]
+    assert batcher.batches(texts)[:2] == [(0, 3), (3, 6)]
+    assert max(calls) == 8 and sum(calls) == 40
+    assert peak == 2
+    stats = batcher.stats()
+    assert stats["chunks"] == 40 and stats["batches"] == len(calls) and stats["chunks_per_second"] > 0
+
+
+def test_rejected_batches_are_split_and_other_failures_not_resent():
+    attempts = {}
+
+    async def embed(texts, priority):
+        key = texts[0]
+        attempts[key] = attempts.get(key, 0) + 1
+        if len(texts) > 1 and "huge" in texts:
+            raise _bad_request()
+        if texts == ["huge"]:
+            return [[-1.0]]
+        return [[1.0] for _ in texts]
+
+    batcher = EmbeddingBatcher(embed, max_batch_tokens=10, max_batch_inputs=2)
+    texts = ["ok", "fine", "huge", "good", "tail"]
+
+    vectors = asyncio.run(batcher.embed(texts))
+
+    assert vectors == [[1.0], [1.0], [-1.0], [1.0], [1.0]]
+    # Only the rejected batch was sent again, as its two halves
+    assert attempts == {"ok": 1, "huge": 2, "good": 1, "tail": 1}
+    assert batcher.stats()["splits"] == 1
+
+    async def always_rejected(texts, priority):
+        raise _bad_request()
+
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(EmbeddingBatcher(always_rejected).embed(["a", "b", "c"]))
+
+    # Transient errors were already retried by the scheduler inside embed_fn
+    calls = []
+
+    async def unreachable(texts, priority):
+        calls.append(texts)
+        raise openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com"))
+
+    batcher = EmbeddingBatcher(unreachable)
+    with pytest.raises(openai.APIConnectionError):
+        asyncio.run(batcher.embed(["a"]))
+    assert len(calls) == 1 and batcher.stats()["failed_batches"] == 1
+
+
+def test_streamed_chunks_are_stored_in_concurrent_token_sized_batches(monkeypatch):
+    from services.chunking import SentenceChunker
+    from services.rag_service import RAGService
+
+    rag = RAGService()
+    rag.embedder = EmbeddingBatcher(None, max_batch_tokens=60, max_concurrency=3)
+    chunks = SentenceChunker(chunk_tokens=20, overlap_tokens=0).chunk("A short sentence here. " * 40)
+    stored, in_flight, peak, progress = [], 0, 0, []
+
+    async def store_chunks(document_hash, batch, first_index):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        stored.append((first_index, len(batch), sum(chunk.tokens for chunk in batch)))
+
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    monkeypatch.setattr(rag, "_check_configured", lambda: None)
+    monkeypatch.setattr(rag, "_store_chunks", store_chunks)
+    chunk_ids = asyncio.run(rag.embed_and_store_chunk_stream("doc", stream(), on_stored=progress.append))
+
+    assert chunk_ids == [f"doc-{i}" for i in range(len(chunks))]
+    stored.sort()
+    assert [first for first, _, _ in stored] == [sum(size for _, size, _ in stored[:i]) for i in range(len(stored))]
+    assert sum(size for _, size, _ in stored) == len(chunks)
+    assert all(tokens <= 60 for _, _, tokens in stored) and len(stored) > 3
+    assert peak > 1
+    assert progress[-1] == len(chunks)
@@ -0,0 +1,41 @@
+import asyncio
+
+from services.embedding_cache import EmbeddingCache
+from services.rag_service import EMBEDDING_MODEL, RAGService
+
+
+def test_embed_chunks_only_calls_the_api_for_uncached_text(tmp_path, monkeypatch):
+    rag = RAGService()
+    rag.cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    embedded = []
+
+    async def embed(texts, priority=None):
+        embedded.append(list(texts))
+        return [[float(len(text)), 0.5] for text in texts]
+
+    monkeypatch.setattr(rag.embedder, "embed", embed)
+    first = asyncio.run(rag.embed_chunks(["alpha", "beta", "alpha"]))
+    # Edited document: one chunk unchanged (up to whitespace), one new
+    second = asyncio.run(rag.embed_chunks(["  alpha\n", "gamma"]))
+
+    assert embedded == [["alpha", "beta"], ["gamma"]]
+    assert first == [[5.0, 0.5], [4.0, 0.5], [5.0, 0.5]]
+    assert second == [[5.0, 0.5], [5.0, 0.5]]
+    # The file outlives the process, and vectors are keyed by model too
+    reopened = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    assert reopened.get_many(EMBEDDING_MODEL, ["beta", "delta"]) == [[4.0, 0.5], None]
+    assert reopened.get_many("other-model", ["beta"]) == [None]
+
+
+def test_least_recently_used_vectors_are_evicted_beyond_the_size_bound(tmp_path):
+    vector = [0.25] * 256  # 1KB as float32
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), max_bytes=10 * 1024)
+    cache.put_many("m", [f"chunk {i}" for i in range(8)], [vector] * 8)
+    cache.get_many("m", ["chunk 0"])  # recently used, so kept
+    cache.put_many("m", [f"chunk {i}" for i in range(8, 12)], [vector] * 4)
+
+    cached = cache.get_many("m", [f"chunk {i}" for i in range(12)])
+    assert cache._bytes <= 10 * 1024
+    assert cache.evicted == 12 - sum(v is not None for v in cached) > 0
+    assert cached[0] == vector and cached[11] == vector
+    assert cached[1] is None
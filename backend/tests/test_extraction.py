@@ -0,0 +1,189 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from services.document_store import content_hash, join_pages
+from services.extraction import ExtractionError, ExtractionPool, ExtractionTimeout, iter_document_pages, temporary_document
+from services.extractors import resolve_format
+from services.rag_service import RAGService
+from benchmarks.corpus import make_pdf
+
+
+def _worker_pid(_: bytes) -> int:
+    return os.getpid()
+
+
+def _hang(seconds: float) -> str:
+    time.sleep(seconds)
+    return "done"
+
+
+def _allocate(megabytes: int) -> int:
+    return len(bytearray(megabytes * 1024 * 1024))
+
+
+def _pool(**overrides):
+    options = dict(enabled=True, workers=2, timeout=10, memory_limit_mb=0, max_tasks_per_child=0)
+    options.update(overrides)
+    return ExtractionPool(**options)
+
+
+def test_parsers_run_in_worker_processes():
+    pool = _pool()
+
+    async def run():
+        return await asyncio.gather(*[pool.run(_worker_pid, b"") for _ in range(4)])
+
+    try:
+        pids = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert os.getpid() not in pids
+    assert pool.stats()["jobs"] == 4
+
+
+def test_timed_out_job_is_killed_and_the_pool_recovers():
+    pool = _pool(timeout=0.5)
+
+    async def run():
+        await pool.run(_worker_pid, b"", timeout=30)  # warm the pool up (worker start-up is slow)
+        started = time.perf_counter()
+        with pytest.raises(ExtractionTimeout):
+            await pool.run(_hang, 30)
+        elapsed = time.perf_counter() - started
+        return elapsed, await pool.run(_hang, 0, timeout=30)
+
+    try:
+        elapsed, result = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert elapsed < 5
+    assert result == "done"
+    assert pool.stats()["timeouts"] == 1 and pool.stats()["recycles"] >= 1
+
+
+def test_cancelled_job_runs_out_without_killing_the_jobs_beside_it():
+    pool = _pool(timeout=10)
+
+    async def run():
+        await asyncio.gather(pool.run(_worker_pid, b""), pool.run(_worker_pid, b""))  # warm both workers up
+        other = asyncio.ensure_future(pool.run(_hang, 1))
+        cancelled = asyncio.ensure_future(pool.run(_hang, 0.5))
+        await asyncio.sleep(0.2)
+        cancelled.cancel()
+        result = await other
+        await asyncio.gather(*pool._abandoned)
+        return result, cancelled.cancelled(), pool.stats()
+
+    try:
+        result, was_cancelled, stats = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert result == "done" and was_cancelled
+    assert stats["recycles"] == 0 and stats["abandoned"] == 0
+    assert pool._slots._value == 2
+
+
+def test_memory_cap_turns_runaway_parses_into_errors():
+    pool = _pool(memory_limit_mb=512)
+
+    async def run():
+        with pytest.raises(ExtractionError):
+            await pool.run(_allocate, 2048)
+        return await pool.run(_allocate, 1)
+
+    try:
+        assert asyncio.run(run()) == 1024 * 1024
+    finally:
+        pool.shutdown()
+
+
+def test_pdf_pages_stream_in_order_across_workers():
+    pool = _pool(workers=3)
+    document = make_pdf([f"Page {i} covers photosynthesis" for i in range(20)])
+
+    async def run():
+        with temporary_document(document, suffix=".pdf") as path:
+            return [page async for page in iter_document_pages(path, resolve_format("pdf"), pool=pool, pages_per_job=3)]
+
+    try:
+        pages = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert [number for number, _ in pages] == list(range(1, 21))
+    assert pages[13][1] == "Page 13 covers photosynthesis"
+    assert pool.stats()["jobs"] == 1 + 7  # page count, then 7 ranges of 3
+
+
+def test_streamed_pages_chunk_like_the_joined_text_and_survive_embedding_errors(monkeypatch):
+    rag = RAGService()
+    pages = [" ".join(f"Sentence {p}-{i} ends here." for i in range(n)) for p, n in enumerate([70, 0, 12, 130])]
+    consumed = []
+
+    async def stream():
+        for page in pages:
+            consumed.append(page)
+            yield page
+
+    async def chunks():
+        return [chunk async for chunk in rag.chunk_pages(stream())]
+
+    def spans(chunks):
+        return [(chunk.text, chunk.start, chunk.page) for chunk in chunks]
+
+    assert spans(asyncio.run(chunks())) == spans(rag.chunk_text(*join_pages(pages)))
+
+    async def failing_embed(chunks, priority=None):
+        raise RuntimeError("embedding outage")
+
+    consumed.clear()
+    monkeypatch.setattr(rag, "_check_configured", lambda: None)
+    monkeypatch.setattr(rag, "embed_chunks", failing_embed)
+    with pytest.raises(RuntimeError, match="embedding outage"):
+        asyncio.run(rag.embed_and_store_chunk_stream(content_hash(b"doc"), rag.chunk_pages(stream())))
+    assert consumed == pages
+
+
+def test_registry_resolves_formats_and_falls_back_on_blank_pages(monkeypatch):
+    from services import extractors
+
+    assert resolve_format("PDF").name == "pdf"
+    assert resolve_format(filename="notes.markdown").name == "md"
+    assert resolve_format(filename="upload", mime_type="text/plain; charset=utf-8").name == "txt"
+    with pytest.raises(ValueError):
+        resolve_format(filename="slides.pptx")
+
+    calls = []
+
+    def fast(path, pages):
+        calls.append(("fast", list(pages)))
+        return ["" if i % 2 else f"fast {i}" for i in pages]
+
+    def layout(path, pages):
+        calls.append(("layout", list(pages)))
+        return [f"layout {i}" for i in pages]
+
+    def broken(path, pages):
+        raise RuntimeError("cannot parse")
+
+    monkeypatch.setitem(extractors.PAGED_BACKENDS, "fast", fast)
+    monkeypatch.setitem(extractors.PAGED_BACKENDS, "layout", layout)
+    monkeypatch.setitem(extractors.PAGED_BACKENDS, "broken", broken)
+
+    assert extractors.extract_page_range("doc.pdf", 4, 8, ["fast", "layout"]) == ["fast 4", "layout 5", "fast 6", "layout 7"]
+    assert calls == [("fast", [4, 5, 6, 7]), ("layout", [5, 7])]
+    assert extractors.extract_page_range("doc.pdf", 0, 2, ["broken", "layout"]) == ["layout 0", "layout 1"]
+    with pytest.raises(RuntimeError):
+        extractors.extract_page_range("doc.pdf", 0, 2, ["broken"])
+
+
+def test_markdown_uploads_are_extracted():
+    pool = _pool(enabled=False)
+
+    async def run():
+        with temporary_document(b"# Title\n\nSome *markdown* text", suffix=".md") as path:
+            return [page async for page in iter_document_pages(path, resolve_format("md"), pool=pool)]
+
+    assert asyncio.run(run()) == [(1, "# Title\n\nSome *markdown* text")]
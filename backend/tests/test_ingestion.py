@@ -0,0 +1,210 @@
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+from models.postgresql.ingestion_job import IngestionJob
+from models.postgresql.note import Note
+from services import ingestion
+from services.document_store import content_hash, document_text_store
+from services.ingestion import IngestionPipeline
+from services.uploads import SpooledUpload
+
+PAGES = ["Photosynthesis converts light into chemical energy " * 40, "The Calvin cycle fixes carbon " * 40]
+
+
+@pytest.fixture(autouse=True)
+def _notes(db):
+    db.add_all([Note(id="n1", title="Biology", user_id="u1"), Note(id="n2", title="Revision", user_id="u1")])
+    db.commit()
+
+
+def _spool(data: bytes) -> SpooledUpload:
+    handle = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    handle.write(data)
+    handle.close()
+    return SpooledUpload(handle.name, len(data), content_hash(data))
+
+
+def _fake_stages(monkeypatch, events, store_error=None, extract_error=None):
+    async def upload_file(path, key, content_type=None):
+        if store_error:
+            raise RuntimeError(store_error)
+        events.append(("stored", key))
+
+    async def delete_file(key):
+        events.append(("deleted file", key))
+
+    async def iter_document_pages(path, file_type):
+        for number, page in enumerate(PAGES, start=1):
+            await asyncio.sleep(0)
+            if extract_error:
+                raise ValueError(extract_error)
+            yield number, page
+
+    async def embed_and_store_chunk_stream(document_hash, chunks, on_stored=None):
+        stored = [chunk async for chunk in chunks]
+        events.append("embedding")
+        await asyncio.sleep(0.05)  # still embedding while the summary is written
+        events.append("embedded")
+        if on_stored:
+            on_stored(len(stored))
+        return [f"{document_hash}-{i}" for i in range(len(stored))]
+
+    async def generate_document_summary(text):
+        events.append("summarizing")
+        return "Light becomes glucose."
+
+    async def analyze_document_for_quiz(text):
+        return {"topics": ["photosynthesis"], "suggested_difficulty": "easy"}
+
+    async def delete_chunks(chunk_ids):
+        events.append(("deleted", len(chunk_ids)))
+
+    async def sync_note_content(note_id, user_id):
+        events.append(("synced", note_id))
+
+    monkeypatch.setattr(ingestion.storage_service, "upload_file", upload_file)
+    monkeypatch.setattr(ingestion.storage_service, "delete_file", delete_file)
+    monkeypatch.setattr(ingestion.ai_service, "iter_document_pages", iter_document_pages)
+    monkeypatch.setattr(ingestion.ai_service, "generate_document_summary", generate_document_summary)
+    monkeypatch.setattr(ingestion.ai_service, "analyze_document_for_quiz", analyze_document_for_quiz)
+    monkeypatch.setattr(ingestion.rag_service, "_check_configured", lambda: None)
+    monkeypatch.setattr(ingestion.rag_service, "embed_and_store_chunk_stream", embed_and_store_chunk_stream)
+    monkeypatch.setattr(ingestion.rag_service, "delete_chunks", delete_chunks)
+    monkeypatch.setattr(ingestion.rag_service, "sync_note_content", sync_note_content)
+
+
+def test_upload_is_processed_in_the_background_and_shared_by_identical_uploads(db, monkeypatch):
+    events = []
+    _fake_stages(monkeypatch, events)
+    pipeline = IngestionPipeline(progress_interval=0)
+
+    async def run():
+        first_upload, second_upload = _spool(b"%PDF lecture"), _spool(b"%PDF lecture")
+        first = pipeline.submit(db, db.get(Note, "n1"), "u1", first_upload, "lecture.pdf", ".pdf")
+        assert first.status == "queued"
+        await asyncio.gather(*pipeline._tasks)
+        second = pipeline.submit(db, db.get(Note, "n2"), "u1", second_upload, "copy.pdf", ".pdf")
+        await asyncio.gather(*pipeline._tasks)
+        return first.id, second.id, [first_upload.path, second_upload.path]
+
+    first_id, second_id, paths = asyncio.run(run())
+    db.expire_all()
+    first = db.get(IngestionJob, first_id)
+    assert first.status == "completed" and first.progress == 100
+    assert set(first.stages.values()) == {"done"}
+    assert first.pages_extracted == 2 and first.chunks_embedded == first.chunks_created > 0
+    assert first.to_dict()["analysis"]["topics"] == ["photosynthesis"]
+    # Summarizing ran while chunks were still being embedded
+    assert events.index("summarizing") < events.index("embedded")
+
+    second = db.get(IngestionJob, second_id)
+    assert second.status == "completed"
+    assert [second.stages[stage] for stage in ("store", "extract", "embed", "summarize")] == ["skipped"] * 4
+    assert [event for event in events if event[0] == "stored"] == [
+        ("stored", f"documents/{content_hash(b'%PDF lecture')}.pdf")
+    ]
+
+    for note_id in ("n1", "n2"):
+        note = db.get(Note, note_id)
+        assert note.document_summary == "Light becomes glucose."
+        assert note.uploaded_file_path == f"documents/{content_hash(b'%PDF lecture')}.pdf"
+        assert document_text_store.get_text(db, note_id) == "\n".join(PAGES)
+        # The vectors of the note's own text are dropped once it has a document
+        assert ("synced", note_id) in events
+    assert not any(os.path.exists(path) for path in paths)
+
+
+def test_failed_store_fails_the_job_and_leaves_the_note_untouched(db, monkeypatch):
+    events = []
+    _fake_stages(monkeypatch, events, store_error="S3 is down")
+    pipeline = IngestionPipeline(progress_interval=0)
+
+    async def run():
+        job = pipeline.submit(db, db.get(Note, "n1"), "u1", _spool(b"%PDF lecture"), "lecture.pdf", ".pdf")
+        await asyncio.gather(*pipeline._tasks)
+        return job.id
+
+    job_id = asyncio.run(run())
+    db.expire_all()
+    job = db.get(IngestionJob, job_id)
+    assert job.status == "failed" and job.error == "S3 is down"
+    assert job.stages["store"] == "failed" and job.finished_at is not None
+    # Vectors embedded for the abandoned document are removed again
+    assert job.chunks_embedded > 0 and ("deleted", job.chunks_embedded) in events
+    assert db.get(Note, "n1").uploaded_file_path is None
+    assert document_text_store.find(db, content_hash(b"%PDF lecture")) is None
+
+
+def test_document_stays_stored_when_its_last_note_lets_go_during_a_job(db, monkeypatch):
+    events = []
+    _fake_stages(monkeypatch, events)
+    pipeline = IngestionPipeline(progress_interval=0)
+    file_hash = content_hash(b"%PDF lecture")
+
+    async def run():
+        pipeline.submit(db, db.get(Note, "n2"), "u1", _spool(b"%PDF lecture"), "lecture.pdf", ".pdf")
+        await asyncio.gather(*pipeline._tasks)
+
+        async def analyze_while_n2_detaches(text):
+            assert document_text_store.detach(db, "n2") is None  # the job still holds it
+            db.commit()
+            return {"topics": []}
+
+        monkeypatch.setattr(ingestion.ai_service, "analyze_document_for_quiz", analyze_while_n2_detaches)
+        job = pipeline.submit(db, db.get(Note, "n1"), "u1", _spool(b"%PDF lecture"), "copy.pdf", ".pdf")
+        await asyncio.gather(*pipeline._tasks)
+        return job.id
+
+    job_id = asyncio.run(run())
+    db.expire_all()
+    assert db.get(IngestionJob, job_id).status == "completed"
+    assert document_text_store.find(db, file_hash).ref_count == 1
+    assert document_text_store.get_text(db, "n1") == "\n".join(PAGES)
+    assert not any(event[0] == "deleted" for event in events)
+
+
+def test_unextractable_upload_is_kept_under_the_notes_own_key(db, monkeypatch):
+    events = []
+    _fake_stages(monkeypatch, events, extract_error="not a PDF")
+    pipeline = IngestionPipeline(progress_interval=0)
+
+    async def run():
+        job = pipeline.submit(db, db.get(Note, "n1"), "u1", _spool(b"%PDF broken"), "broken.pdf", ".pdf")
+        await asyncio.gather(*pipeline._tasks)
+        return job.id
+
+    job_id = asyncio.run(run())
+    db.expire_all()
+    file_hash = content_hash(b"%PDF broken")
+    job = db.get(IngestionJob, job_id)
+    assert job.status == "failed" and job.stages["extract"] == "failed"
+    note = db.get(Note, "n1")
+    assert note.uploaded_file_path == f"notes/n1/{file_hash}.pdf"
+    assert ("stored", note.uploaded_file_path) in events
+    # The shared object has no document counting references to it
+    assert ("deleted file", f"documents/{file_hash}.pdf") in events
+    assert document_text_store.find(db, file_hash) is None
+
+
+def test_jobs_left_unfinished_by_a_dead_process_are_failed(db):
+    long_ago = datetime.utcnow() - timedelta(hours=1)
+    db.add_all([
+        IngestionJob(id="dead", note_id="n1", user_id="u1", status="running",
+                     stage_states='{"store": "done", "extract": "running"}', updated_at=long_ago),
+        IngestionJob(id="ours", note_id="n2", user_id="u1", status="running", updated_at=long_ago),
+        IngestionJob(id="busy", note_id="n2", user_id="u1", status="queued"),
+    ])
+    db.commit()
+    pipeline = IngestionPipeline(stale_after=600)
+    pipeline._job_ids.add("ours")
+
+    pipeline.start()
+    db.expire_all()
+    dead = db.get(IngestionJob, "dead")
+    assert dead.status == "failed" and dead.error == ingestion.INTERRUPTED
+    assert dead.stages["extract"] == "failed" and dead.stages["store"] == "done"
+    assert [db.get(IngestionJob, job_id).status for job_id in ("ours", "busy")] == ["running", "queued"]
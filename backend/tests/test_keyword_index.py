@@ -0,0 +1,64 @@
+import asyncio
+
+from models.postgresql.document_text import DocumentKeywordIndex
+from services import rag_service as rag_module
+from services.keyword_index import KeywordIndex, KeywordIndexStore, reciprocal_rank_fusion
+
+CHUNKS = [
+    "Enzymes speed up reactions in the cell. Enzymes are proteins.",
+    "The Michaelis-Menten equation relates reaction rate to substrate concentration.",
+    "Photosynthesis happens in the chloroplast and needs light.",
+    "Cells, enzymes and reactions: the cell is the unit of life.",
+]
+
+
+def test_bm25_ranks_rare_exact_terms_and_round_trips():
+    index = KeywordIndex.build([f"c{i}" for i in range(len(CHUNKS))], CHUNKS)
+
+    assert [chunk_id for chunk_id, _ in index.search("michaelis menten rate", 3)] == ["c1"]
+    assert [chunk_id for chunk_id, _ in index.search("Are enzymes proteins?", 3)] == ["c0", "c3"]
+    # Terms in most chunks still count, but for little
+    scores = dict(index.search("the cell michaelis", 4))
+    assert max(scores, key=scores.get) == "c1" and 0 < scores["c0"] < scores["c1"]
+    assert index.search("mitochondria", 3) == []
+
+    restored = KeywordIndex.from_bytes(index.to_bytes())
+    assert restored.search("Michaelis-Menten and proteins", 4) == index.search("Michaelis-Menten and proteins", 4)
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]], k=1) == [
+        ("c", 1 / 4 + 1 / 2), ("a", 1 / 2), ("b", 1 / 3), ("d", 1 / 3)
+    ]
+
+
+def test_bm25_ranks_one_and_two_chunk_documents():
+    assert [chunk_id for chunk_id, _ in KeywordIndex.build(["c0"], ["Planck's constant"]).search("Planck", 3)] == ["c0"]
+    index = KeywordIndex.build(["c0", "c1"], ["Planck's constant links energy and frequency.", "Energy is conserved."])
+    assert [chunk_id for chunk_id, _ in index.search("Planck", 3)] == ["c0"]
+    assert [chunk_id for chunk_id, _ in index.search("energy frequency", 3)] == ["c0", "c1"]
+
+
+def test_hybrid_retrieval_finds_exact_terms_the_vectors_miss(rag, db, embeddings, monkeypatch):
+    monkeypatch.setattr(rag_module, "keyword_index_store", KeywordIndexStore())
+    # Embeddings that only know about enzymes
+    embeddings.vector = lambda text: [1.0, 3.0 * ("enzyme" in text.lower())]
+    # One mention of the equation, among pages that never say "enzyme"
+    text = " ".join([CHUNKS[0]] * 200 + [CHUNKS[2]] * 30 + [CHUNKS[1]] + [CHUNKS[2]] * 30)
+    chunk_ids = asyncio.run(rag.embed_and_store_chunks("doc", text))
+    assert db.query(DocumentKeywordIndex).count() == 1
+
+    question = "How do enzymes relate to the Michaelis-Menten equation?"
+    monkeypatch.setattr(rag_module.settings, "RAG_HYBRID_SEARCH", False)
+    dense = asyncio.run(rag._retrieve("n1", question, "u1", top_k=3, document_hash="doc"))
+    monkeypatch.setattr(rag_module.settings, "RAG_HYBRID_SEARCH", True)
+    hybrid = asyncio.run(rag._retrieve("n1", question, "u1", top_k=3, document_hash="doc"))
+    assert not any("Michaelis" in match["text"] for match in dense)
+    assert any("Michaelis" in match["text"] for match in hybrid)
+
+    # A document whose index is missing gets one rebuilt from its stored chunks
+    db.query(DocumentKeywordIndex).delete()
+    db.commit()
+    monkeypatch.setattr(rag_module, "keyword_index_store", KeywordIndexStore())
+    assert asyncio.run(rag._retrieve("n1", question, "u1", top_k=3, document_hash="doc")) == hybrid
+    assert db.query(DocumentKeywordIndex).count() == 1
+
+    asyncio.run(rag.delete_chunks(chunk_ids))
+    assert db.query(DocumentKeywordIndex).count() == 0
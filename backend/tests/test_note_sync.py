@@ -0,0 +1,59 @@
+import asyncio
+
+from models.postgresql.document_text import DocumentChunk
+from models.postgresql.note import Note
+from services.document_store import document_text_store
+
+
+def _paragraph(i: int) -> str:
+    return " ".join(f"Paragraph {i} sentence {j} explains topic {i} in some detail." for j in range(20))
+
+
+def test_note_edits_only_embed_changed_chunks(rag, db, embeddings):
+    embeddings.vector = lambda text: [1.0, float("revised" in text)]
+    embedded = embeddings.texts
+    paragraphs = [_paragraph(i) for i in range(12)]
+    db.add(Note(id="n1", title="Notes", user_id="u1", content="\n\n".join(paragraphs)))
+    db.commit()
+
+    added, removed = asyncio.run(rag.sync_note_content("n1", "u1"))
+    total = len(rag.index._vectors)
+    assert added == total > 10 and removed == 0
+    assert asyncio.run(rag.sync_note_content("n1", "u1")) == (0, 0)
+
+    # Edit one sentence in the middle
+    paragraphs[6] = paragraphs[6].replace("sentence 10 explains topic 6", "sentence 10 gives the revised view of topic 6")
+    db.query(Note).filter(Note.id == "n1").update({Note.content: "\n\n".join(paragraphs)})
+    db.commit()
+    embedded.clear()
+    added, removed = asyncio.run(rag.sync_note_content("n1", "u1"))
+
+    assert 1 <= added <= 2 and 1 <= removed <= 2 and len(embedded) == added
+    assert len(rag.index._vectors) == total - removed + added
+    assert db.query(DocumentChunk).filter(DocumentChunk.content_hash == "note-n1").count() == len(rag.index._vectors)
+    matches = asyncio.run(rag._retrieve("n1", "What is the revised view?", "u1", top_k=1))
+    assert "revised view of topic 6" in matches[0]["text"]
+
+    # While Q&A searches an attached document, the note's text vectors go and edits embed nothing
+    document = document_text_store.save(db, "doc", ["Photosynthesis makes sugar."])
+    document.chunk_count = 1
+    document_text_store.attach(db, "n1", document)
+    db.commit()
+    embedded.clear()
+    stale = len(rag.index._vectors)
+    assert asyncio.run(rag.sync_note_content("n1", "u1")) == (0, stale)
+    assert not rag.index._vectors and db.query(DocumentChunk).filter(DocumentChunk.content_hash == "note-n1").count() == 0
+    db.query(Note).filter(Note.id == "n1").update({Note.content: "A brand new revised note."})
+    db.commit()
+    assert asyncio.run(rag.sync_note_content("n1", "u1")) == (0, 0) and not embedded
+
+    # Once the document is removed, the note's text is embedded again
+    document_text_store.detach(db, "n1")
+    db.commit()
+    assert asyncio.run(rag.sync_note_content("n1", "u1")) == (1, 0) and embedded == ["A brand new revised note."]
+
+    # Deleting the note drops its chunks
+    db.query(Note).filter(Note.id == "n1").update({Note.is_active: False})
+    db.commit()
+    assert asyncio.run(rag.sync_note_content("n1", "u1")) == (0, 1)
+    assert not rag.index._vectors and db.query(DocumentChunk).count() == 0
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import types
+
+import pytest
+
+from api import notes
+from models.postgresql.chat_log import ChatLog
+from models.postgresql.document_text import DocumentText, NoteDocument
+from models.postgresql.note import Note
+from services import rag_service as rag_module
+from services.document_store import document_text_store
+
+
+def test_deleting_a_note_releases_its_document_once_no_note_uses_it(client, db, monkeypatch):
+    released = []
+
+    async def release_document(document):
+        released.append(document.content_hash)
+
+    monkeypatch.setattr(notes, "release_document", release_document)
+    db.add_all([Note(id="n1", title="Biology", user_id="u1"), Note(id="n2", title="Biology", user_id="u1")])
+    document = document_text_store.save(db, "doc", ["Photosynthesis makes sugar."], storage_path="documents/doc.pdf")
+    for note_id in ("n1", "n2"):
+        document_text_store.attach(db, note_id, document)
+    db.commit()
+
+    assert client.delete("/api/v1/notes/n1").status_code == 200
+    db.expire_all()
+    assert db.get(DocumentText, "doc").ref_count == 1 and db.get(NoteDocument, "n1") is None
+    assert released == []
+
+    assert client.delete("/api/v1/notes/n2").status_code == 200
+    db.expire_all()
+    assert db.get(DocumentText, "doc") is None and released == ["doc"]
+
+
+def _events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+@pytest.fixture
+def streamed_note(rag, db, monkeypatch):
+    """Note n1, indexed, answered by `answer` deltas; `logged` records the ChatLog rows seen as each delta streams"""
+    db.add(Note(id="n1", title="Biology", user_id="u1", content="Photosynthesis turns light into sugar in the chloroplasts."))
+    db.commit()
+    asyncio.run(rag.sync_note_content("n1", "u1"))
+    monkeypatch.setattr(notes, "rag_service", rag)
+    stream = types.SimpleNamespace(answer=["Light ", "becomes ", "sugar."], error=None, logged=[])
+
+    async def stream_chat_completion(messages, **kwargs):
+        for delta in stream.answer:
+            stream.logged.append(db.query(ChatLog).count())
+            yield delta
+        if stream.error:
+            raise stream.error
+
+    monkeypatch.setattr(rag_module.ai_service, "_stream_chat_completion", stream_chat_completion)
+    return stream
+
+
+def test_streamed_answer_sends_context_then_tokens_then_done(client, db, streamed_note):
+    response = client.post("/api/v1/notes/n1/ask/stream", json={"question": "What does photosynthesis do?"})
+
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/event-stream")
+    events = _events(response.text)
+    assert [event for event, _ in events] == ["context", "token", "token", "token", "done"]
+    assert events[0][1]["chunks"] and events[0][1]["chunks"][0]["id"].startswith("note-n1")
+    assert "".join(data["delta"] for event, data in events if event == "token") == "Light becomes sugar."
+    assert events[-1][1]["answer"] == "Light becomes sugar."
+    # The answer is logged once, after the last token
+    assert streamed_note.logged == [0, 0, 0]
+    assert [log.answer for log in db.query(ChatLog).all()] == ["Light becomes sugar."]
+
+
+def test_streamed_answer_that_fails_ends_with_an_error_event(client, db, streamed_note):
+    streamed_note.answer = ["Light "]
+    streamed_note.error = RuntimeError("upstream closed the stream")
+
+    response = client.post("/api/v1/notes/n1/ask/stream", json={"question": "What does photosynthesis do?"})
+
+    assert response.status_code == 200
+    events = _events(response.text)
+    assert [event for event, _ in events] == ["context", "token", "error"]
+    assert events[-1][1] == {"detail": "Failed to answer question."}
+    assert db.query(ChatLog).count() == 0
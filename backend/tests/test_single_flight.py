@@ -0,0 +1,99 @@
+import asyncio
+
+from services.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run():
+        return await asyncio.gather(*[flight.do("k", work) for _ in range(5)])
+
+    assert asyncio.run(run()) == ["answer"] * 5
+    assert calls == 1
+    assert flight.in_flight() == 0
+
+
+def test_errors_propagate_to_every_waiter():
+    flight = SingleFlight()
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise ValueError("rate limited")
+
+    async def run():
+        return await asyncio.gather(flight.do("k", boom), flight.do("k", boom), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_shared_call_survives_one_cancelled_waiter_and_stops_with_the_last():
+    flight = SingleFlight()
+
+    async def run():
+        gate = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await gate.wait()
+                return "done"
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = asyncio.ensure_future(flight.do("k", work))
+        second = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        assert await second == "done"
+        assert not cancelled.is_set()
+
+        gate.clear()
+        third = asyncio.ensure_future(flight.do("k2", work))
+        await asyncio.sleep(0)
+        third.cancel()
+        await asyncio.sleep(0.01)
+        return cancelled.is_set(), flight.in_flight()
+
+    assert asyncio.run(run()) == (True, 0)
+
+
+def test_coalesced_stream_answers_under_the_leaders_message_id(monkeypatch):
+    from core import websocket as ws_module
+    from services.ai_service import ai_service
+
+    frames = []
+
+    async def stream_group_chat_response(**kwargs):
+        for delta in ["Mitosis ", "splits cells."]:
+            await asyncio.sleep(0.01)
+            yield delta
+
+    async def broadcast_to_topic(room_id, topic_id, sender_id, message):
+        frames.append(message)
+
+    monkeypatch.setattr(ai_service, "stream_group_chat_response", stream_group_chat_response)
+    monkeypatch.setattr(ws_module.manager, "broadcast_to_topic", broadcast_to_topic)
+    monkeypatch.setattr(ws_module, "get_mongo_db", lambda: None)
+    first = ws_module.ChatWebSocket(None, "r1", "t1", "u1")
+    second = ws_module.ChatWebSocket(None, "r1", "t1", "u2")
+
+    async def run():
+        return await asyncio.gather(
+            first.stream_ai_response("What is mitosis?", "m1"),
+            second.stream_ai_response("what is  MITOSIS?", "m2"),
+        )
+
+    assert asyncio.run(run()) == [("m1", "Mitosis splits cells."), ("m1", "Mitosis splits cells.")]
+    assert [frame["message_id"] for frame in frames] == ["m1", "m1"]
@@ -0,0 +1,31 @@
+from services.ai_service import split_into_sections, estimate_tokens
+
+
+def _document(paragraphs):
+    return "\n\n".join(paragraphs)
+
+
+PARAGRAPHS = [f"Paragraph {i}: " + ("lecture notes about topic %d. " % i) * 12 for i in range(200)]
+
+
+def test_sections_respect_the_token_budget():
+    sections = split_into_sections(_document(PARAGRAPHS), budget_tokens=500)
+    assert len(sections) > 1
+    assert all(estimate_tokens(section) <= 500 + 1 for section in sections)
+    assert " ".join(sections).split() == _document(PARAGRAPHS).split()
+
+
+def test_oversized_paragraph_is_hard_split():
+    sections = split_into_sections("x" * 10000, budget_tokens=500)
+    assert len(sections) == 5
+
+
+def test_an_edit_only_changes_nearby_sections():
+    before = split_into_sections(_document(PARAGRAPHS), budget_tokens=500)
+    edited = list(PARAGRAPHS)
+    edited[3] = edited[3] + " An extra sentence added by the author."
+    after = split_into_sections(_document(edited), budget_tokens=500)
+
+    unchanged = set(before) & set(after)
+    # Boundaries resynchronise after the edit, so almost every section is reused
+    assert len(unchanged) >= len(before) - 3
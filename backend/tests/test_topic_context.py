@@ -0,0 +1,61 @@
+import asyncio
+
+from services import topic_context
+from services.topic_context import TopicContextStore
+
+
+def _store(**overrides):
+    options = dict(recent_messages=3, token_budget=1000, summary_batch=2, max_catchup=50, max_topics=10)
+    options.update(overrides)
+    return TopicContextStore(**options)
+
+
+def test_keeps_last_k_messages_and_folds_older_ones_into_summary(monkeypatch):
+    folded = []
+
+    async def fake_summarize(previous_summary, messages):
+        folded.append([m["content"] for m in messages])
+        return (previous_summary + " " + " ".join(m["content"] for m in messages)).strip()
+
+    monkeypatch.setattr(topic_context.ai_service, "summarize_chat_context", fake_summarize)
+    store = _store()
+
+    async def run():
+        await store.get_context("room", "topic")
+        for i in range(7):
+            store.record("room", "topic", f"m{i}", "Ada", f"msg{i}")
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        return await store.get_context("room", "topic")
+
+    summary, history = asyncio.run(run())
+    assert [m["content"] for m in history] == ["msg4", "msg5", "msg6"]
+    assert summary == "msg0 msg1 msg2 msg3"
+    # Each message is summarized exactly once, never re-read
+    assert sum(len(batch) for batch in folded) == 4
+    assert store._topics[("room", "topic")].watermark_id == "m3"
+
+
+def test_history_is_trimmed_to_the_token_budget():
+    store = _store(recent_messages=10, token_budget=30)
+
+    async def run():
+        await store.get_context("room", "topic")
+        store.record("room", "topic", "old", "Ada", "x" * 200)
+        store.record("room", "topic", "new", "Bob", "short question")
+        return await store.get_context("room", "topic")
+
+    summary, history = asyncio.run(run())
+    assert summary == ""
+    assert [m["message_id"] for m in history] == ["new"]
+
+
+def test_chatbot_questions_in_the_log_are_user_turns():
+    entry = TopicContextStore._from_log({
+        "message_id": "ai_1",
+        "user_name": "AI Assistant",
+        "content": "what is entropy?",
+        "is_ai": True,
+        "metadata": {"requested_by": "u1", "requester_name": "Ada"},
+    })
+    assert entry == {"message_id": "ai_1", "user_name": "Ada", "content": "what is entropy?", "is_ai": False}
@@ -0,0 +1,60 @@
+import asyncio
+import io
+import os
+import tempfile
+
+import pytest
+from fastapi import UploadFile
+
+from services.document_store import content_hash
+from services.uploads import UploadTooLarge, spool_upload
+
+
+def _upload(data: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename="lecture.pdf")
+
+
+def test_spooled_upload_is_hashed_in_chunks():
+    data = os.urandom(10_000)
+    reads = []
+
+    async def run():
+        upload = _upload(data)
+        original_read = upload.read
+
+        async def read(size=-1):
+            reads.append(size)
+            return await original_read(size)
+
+        upload.read = read
+        return await spool_upload(upload, suffix=".pdf", chunk_size=4096)
+
+    spooled = asyncio.run(run())
+    with open(spooled.path, "rb") as handle:
+        assert handle.read() == data
+    assert spooled.size == len(data)
+    assert spooled.content_hash == content_hash(data)
+    spooled.discard()
+    assert spooled.path.endswith(".pdf") and not os.path.exists(spooled.path)
+    assert reads == [4096] * 4
+
+
+def test_oversized_upload_stops_at_the_limit(monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    reads = []
+
+    async def run():
+        upload = _upload(b"x" * 100_000)
+        original_read = upload.read
+
+        async def read(size=-1):
+            reads.append(size)
+            return await original_read(size)
+
+        upload.read = read
+        await spool_upload(upload, max_size=10_000, chunk_size=4096)
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(run())
+    assert len(reads) == 3
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,58 @@
+import os
+import random
+
+from services.vector_index import InMemoryIndex, LocalVectorIndex
+
+
+def _vectors(count, dim=8, seed=0):
+    rng = random.Random(seed)
+    return [[rng.uniform(-1, 1) for _ in range(dim)] for _ in range(count)]
+
+
+def test_local_index_ranks_like_brute_force_within_a_partition_and_persists(tmp_path):
+    local, memory = LocalVectorIndex(str(tmp_path)), InMemoryIndex()
+    vectors = []
+    for document in ("a", "b"):
+        for i, values in enumerate(_vectors(150, seed=ord(document))):
+            vectors.append((f"{document}-{i}", values, {"document_hash": document, "chunk": f"{document}{i}", "page": 1}))
+    vectors.append(("legacy-0", _vectors(1, seed=9)[0], {"note_id": "n1", "user_id": "u1", "chunk": "old"}))
+    for index in (local, memory):
+        # In two batches, so the partition files grow past their first size
+        index.upsert(vectors[:100])
+        index.upsert(vectors[100:])
+
+    query = _vectors(1, seed=42)[0]
+    for filter in ({"document_hash": "a"}, {"document_hash": "b"}, {"note_id": "n1", "user_id": "u1"}, None):
+        expected = memory.query(query, top_k=5, filter=filter)["matches"]
+        got = local.query(query, top_k=5, filter=filter)["matches"]
+        assert [m["id"] for m in got] == [m["id"] for m in expected]
+        assert all(abs(g["score"] - e["score"]) < 1e-5 for g, e in zip(got, expected))
+        assert [m["metadata"] for m in got] == [m["metadata"] for m in expected]
+
+    reopened = LocalVectorIndex(str(tmp_path))
+    assert reopened.query(query, top_k=5, filter={"document_hash": "a"}) == local.query(query, top_k=5, filter={"document_hash": "a"})
+    assert reopened.stats() == {"partitions": 3, "vectors": 301, "deleted_rows": 0}
+
+
+def test_deleted_vectors_leave_results_and_are_compacted_away(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    values = _vectors(10)
+    index.upsert([(f"d-{i}", v, {"document_hash": "d", "chunk": str(i)}) for i, v in enumerate(values)])
+
+    index.delete(["d-0", "d-1", "d-2"])
+    assert index.stats()["deleted_rows"] == 3
+    top = index.query(values[0], top_k=10, filter={"document_hash": "d"})["matches"]
+    assert len(top) == 7 and "d-0" not in {m["id"] for m in top}
+
+    # Past half deleted, the partition is rewritten with only live rows
+    index.delete(["d-3", "d-4", "d-5"])
+    assert index.stats() == {"partitions": 1, "vectors": 4, "deleted_rows": 0}
+    assert index.query(values[9], top_k=1, filter={"document_hash": "d"})["matches"][0]["id"] == "d-9"
+    # Upserting an existing id overwrites it in place
+    index.upsert([("d-9", values[6], {"document_hash": "d", "chunk": "moved"})])
+    best = index.query(values[6], top_k=2, filter={"document_hash": "d"})["matches"]
+    assert {m["id"] for m in best} == {"d-6", "d-9"} and index.stats()["vectors"] == 4
+
+    index.delete(["d-6", "d-7", "d-8", "d-9"])
+    assert index.stats()["partitions"] == 0 and os.listdir(tmp_path) == []
+    assert LocalVectorIndex(str(tmp_path)).query(values[0], top_k=3)["matches"] == []
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import pytest
+
+from core import websocket
+from core.websocket import ChatWebSocket
+from services.ai_service import ai_service
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, text):
+        self.frames.append(json.loads(text))
+
+
+@pytest.fixture
+def sockets(monkeypatch):
+    sockets = {"u1": FakeSocket(), "u2": FakeSocket()}
+    monkeypatch.setattr(websocket.manager, "active_connections", {"r1": {"t1": dict(sockets)}})
+    monkeypatch.setattr(websocket, "get_mongo_db", lambda: None)
+    monkeypatch.setattr(websocket.ai_usage, "check_quota", lambda **scope: None)
+    return sockets
+
+
+def test_chatbot_answer_is_streamed_to_the_topic_and_saved_once(sockets, monkeypatch):
+    saved = []
+    started, release = asyncio.Event(), asyncio.Event()
+    calls = 0
+
+    async def stream_group_chat_response(**kwargs):
+        nonlocal calls
+        calls += 1
+        started.set()
+        await release.wait()
+        for delta in ("Light ", "becomes ", "glucose."):
+            await asyncio.sleep(0)
+            yield delta
+
+    async def save_message_to_db(self, chat_message):
+        saved.append(chat_message)
+
+    async def get_topic_context(self):
+        return "", []
+
+    monkeypatch.setattr(ai_service, "stream_group_chat_response", stream_group_chat_response)
+    monkeypatch.setattr(ChatWebSocket, "save_message_to_db", save_message_to_db)
+    monkeypatch.setattr(ChatWebSocket, "get_topic_context", get_topic_context)
+
+    async def run():
+        request = {"content": "@chatbot What does photosynthesis do?", "stream": True}
+        leader = asyncio.create_task(ChatWebSocket(sockets["u1"], "r1", "t1", "u1").handle_ai_request(request))
+        await started.wait()
+        # The same question from another member joins the stream in flight
+        follower = asyncio.create_task(ChatWebSocket(sockets["u2"], "r1", "t1", "u2").handle_ai_request(request))
+        # Announcing the typing indicator is its last step before joining the flight
+        while sum(f["type"] == "ai_typing" for f in sockets["u1"].frames) < 2:
+            await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(leader, follower)
+
+    asyncio.run(run())
+    assert calls == 1
+    answers = [m for m in saved if m.message_id.startswith("ai_resp_")]
+    assert [m.content for m in answers] == ["Light becomes glucose."]
+    response_id = answers[0].message_id
+
+    for socket in sockets.values():
+        deltas = [f["delta"] for f in socket.frames if f["type"] == "ai_delta"]
+        assert deltas == ["Light ", "becomes ", "glucose."]
+        assert all(f["message_id"] == response_id for f in socket.frames if f["type"] == "ai_delta")
+        finals = [f for f in socket.frames if f["type"] == "chat_message" and f["is_ai"]]
+        assert [(f["message_id"], f["content"]) for f in finals] == [(response_id, "Light becomes glucose.")]
+        # The final message follows the last delta
+        kinds = [f["type"] for f in socket.frames]
+        assert kinds.index("chat_message") > max(i for i, kind in enumerate(kinds) if kind == "ai_delta")
+        assert not any(f["type"] == "error" for f in socket.frames)
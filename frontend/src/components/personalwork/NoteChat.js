@@ -4,6 +4,9 @@ import { FaFileUpload, FaRobot, FaUserCircle, FaQuestionCircle, FaVolumeUp } fro
 import { useUserContext } from '../../context/UserContext';
 import { toast } from 'react-toastify';
 
+// Stop polling an upload's processing after this long
+const INGESTION_POLL_TIMEOUT_MS = 10 * 60 * 1000;
+
 const Container = styled.div`
   display: flex;
   flex-direction: column;
@@ -236,8 +239,26 @@ const NoteChat = ({ note, onNoteUpdate }) => {
         method: 'POST',
         body: formData,
       });
-      const data = await res.json();
-      toast.success('Document uploaded successfully');
+      let data = await res.json();
+      toast.success('Document uploaded, processing…');
+      // Parsing, embedding and the summary run in the background; poll the job,
+      // but not forever
+      const pollUntil = Date.now() + INGESTION_POLL_TIMEOUT_MS;
+      while (data.ingestion && !['completed', 'failed'].includes(data.ingestion.status)) {
+        if (Date.now() > pollUntil) break;
+        await new Promise((resolve) => setTimeout(resolve, 1500));
+        const poll = await makeAuthenticatedRequest(
+          `/notes/${noteId}/ingestion?job_id=${data.ingestion.job_id}`
+        );
+        data = await poll.json();
+      }
+      if (data.ingestion && !['completed', 'failed'].includes(data.ingestion.status)) {
+        toast.info('Still processing the document; check back in a few minutes');
+      } else if (data.ingestion?.status === 'failed') {
+        toast.error(data.ingestion.error || 'Document processing failed');
+      } else {
+        toast.success('Document processed');
+      }
       onNoteUpdate?.(data.note || { ...note, has_uploaded_file: true, uploaded_file_name: file.name });
       await loadChatHistory();
     } catch (err) {
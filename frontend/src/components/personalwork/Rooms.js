@@ -712,12 +712,36 @@ const Rooms = () => {
             // Drop the "AI is thinking..." placeholder once the real answer arrives,
             // instead of leaving it stuck above/below the actual response.
             [selectedTopic.title]: [
-              ...(prev[selectedTopic.title] || []).filter((m) => !(payload.is_ai && m.isThinking)),
+              ...(prev[selectedTopic.title] || []).filter(
+                (m) => !(payload.is_ai && (m.isThinking || m.id === payload.message_id))
+              ),
               newMessage,
             ],
           }));
         }
         break;
+      case 'ai_delta':
+        if (!selectedTopic) break;
+        // Streamed @chatbot answer: grow one bubble per message_id until the
+        // final chat_message with the same id replaces it.
+        setRoomChatMessages((prev) => {
+          const messages = (prev[selectedTopic.title] || []).filter((m) => !m.isThinking);
+          const existing = messages.find((m) => m.id === data.message_id);
+          const updated = existing
+            ? messages.map((m) => (m.id === data.message_id ? { ...m, text: m.text + data.delta } : m))
+            : [
+                ...messages,
+                {
+                  id: data.message_id,
+                  text: data.delta,
+                  isUser: false,
+                  sender: 'AI Assistant',
+                  time: new Date().toLocaleTimeString(),
+                },
+              ];
+          return { ...prev, [selectedTopic.title]: updated };
+        });
+        break;
       case 'ai_typing':
         break;
       case 'user_joined':